@@ -0,0 +1,92 @@
+"""
+Права доступа в памяти.
+
+Таблицы admins и allowed_users маленькие, поэтому держим их целиком:
+проверка апдейта/колбэка идет без обращений к БД. Снимок загружается на
+старте и перечитывается раз в ACCESS_CACHE_TTL (изменения из другого
+процесса видны не позже этого), а обработчики админки обновляют его сразу.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Полная перезагрузка из БД (секунды)
+ACCESS_CACHE_TTL = float(os.getenv('ACCESS_CACHE_TTL', '60'))
+
+# loader() -> (id админов, id разрешенных пользователей)
+Loader = Callable[[], Awaitable[Tuple[Iterable[int], Iterable[int]]]]
+
+
+class AccessCache:
+    """Снимок admins/allowed_users с TTL"""
+
+    def __init__(self):
+        self._admins: Set[int] = set()
+        self._allowed: Set[int] = set()
+        self.loaded_at: Optional[float] = None
+        self._load_lock: Optional[asyncio.Lock] = None
+        self.hits = 0
+        self.reloads = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def is_stale(self, max_age: float = ACCESS_CACHE_TTL) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > max_age
+
+    def build(self, admin_ids: Iterable[int], allowed_ids: Iterable[int]):
+        self._admins = {int(user_id) for user_id in admin_ids}
+        self._allowed = {int(user_id) for user_id in allowed_ids}
+        self.loaded_at = time.monotonic()
+        self.reloads += 1
+        logger.info(f"[access] Loaded {len(self._admins)} admins, {len(self._allowed)} allowed users")
+
+    async def ensure_loaded(self, loader: Loader) -> bool:
+        """Загрузить снимок, если его нет или он устарел; False — снимка нет"""
+        if not self.is_stale():
+            return True
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if not self.is_stale():
+                return True
+            try:
+                admin_ids, allowed_ids = await loader()
+                self.build(admin_ids, allowed_ids)
+            except Exception as e:
+                logger.error(f"[access] Failed to load access lists: {e}", exc_info=True)
+                if self.ready:
+                    # Продолжаем со старым снимком, повторим через минуту
+                    self.loaded_at = time.monotonic() - ACCESS_CACHE_TTL + 60
+        return self.ready
+
+    def is_admin(self, user_id: int) -> bool:
+        self.hits += 1
+        return user_id in self._admins
+
+    def is_allowed(self, user_id: int) -> bool:
+        self.hits += 1
+        return user_id in self._admins or user_id in self._allowed
+
+    def grant(self, user_id: int):
+        """Пользователь добавлен в allowed_users"""
+        self._allowed.add(int(user_id))
+
+    def revoke(self, user_id: int):
+        """Пользователь удален из allowed_users"""
+        self._allowed.discard(int(user_id))
+
+    def add_admin(self, user_id: int):
+        self._admins.add(int(user_id))
+
+    def invalidate(self):
+        self.loaded_at = None
+
+
+access_cache = AccessCache()
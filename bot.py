@@ -6,9 +6,11 @@
 import asyncio
 import inspect
 import re
+import os
+import time
 import aiomysql
 from asyncio import Semaphore
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Optional, List, Dict, Any, Set, Tuple
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -87,8 +89,91 @@ except ImportError:
     get_mrkt_gift_by_id = None
     get_mrkt_auth_token = None
 
+try:
+    from mrktmp_wrapper import collect_mrkt_listings
+except ImportError:
+    collect_mrkt_listings = None
+
+# Корутинные версии оберток: синхронные внутри ждут retry-паузы и стопорили бы цикл событий
+try:
+    from tonnelmp_wrapper import (
+        search_tonnel_async, get_tonnel_model_floor_price_async,
+        get_tonnel_gift_floor_price_async, get_tonnel_model_sales_history_async
+    )
+except ImportError:
+    search_tonnel_async = None
+    get_tonnel_model_floor_price_async = None
+    get_tonnel_gift_floor_price_async = None
+    get_tonnel_model_sales_history_async = None
+
+try:
+    from mrktmp_wrapper import search_mrkt_async, get_mrkt_model_floor_price_async, get_mrkt_gift_floor_price_async
+except ImportError:
+    search_mrkt_async = None
+    get_mrkt_model_floor_price_async = None
+    get_mrkt_gift_floor_price_async = None
+
+# Индекс подписок: кому интересен листинг, без запроса в БД на каждого пользователя
+try:
+    from subscription_index import subscription_index
+except ImportError:
+    subscription_index = None
+
+# Фильтры цен в памяти
+try:
+    from price_filter_index import price_filter_index
+except ImportError:
+    price_filter_index = None
+
+# Флоры коллекций Portals из общего снимка (корутинный доступ)
+try:
+    from portalsmp import get_gift_floor_price_async as portals_gift_floor_async
+except ImportError:
+    portals_gift_floor_async = None
+
+# Склейка одинаковых запросов флоров/истории продаж
+try:
+    from single_flight import coalesce
+except ImportError:
+    coalesce = None
+
+# Ограниченная очередь обработки новых листингов
+try:
+    from work_queue import BoundedWorkQueue, merge_users
+except ImportError:
+    BoundedWorkQueue = None
+    merge_users = None
+
+# Увиденные листинги: FIFO/TTL и сохранение между рестартами
+try:
+    from seen_store import get_seen_store, save_all as save_seen_ids
+except ImportError:
+    get_seen_store = None
+    save_seen_ids = None
+
+# Права доступа в памяти (admins / allowed_users)
+try:
+    from access_cache import access_cache
+except ImportError:
+    access_cache = None
+
+# Дедупликация уведомлений между репликами (таблица notified_gifts)
+try:
+    from notification_dedup import NotificationDedup
+except ImportError:
+    NotificationDedup = None
+
+# Планировщик исходящих сообщений Telegram
+try:
+    from telegram_sender import TelegramSendScheduler, PhotoFileIdCache, MySQLFileIdStore
+except ImportError:
+    TelegramSendScheduler = None
+    PhotoFileIdCache = None
+    MySQLFileIdStore = None
+
 # GetGems удален
 
+from db_migrations import run_migrations
 from config import (
     PORTALS_AUTH,
     BOT_TOKEN, API_ID, API_HASH,
@@ -109,6 +194,19 @@ new_gifts_monitoring_enabled = {}  # user_id -> bool
 new_gifts_last_ids = {}  # marketplace -> set of gift_ids
 # Семафор для ограничения параллельных задач обработки новых подарков (максимум 10 одновременно для быстрой обработки всех новых подарков)
 processing_semaphore = Semaphore(10)
+# Очередь новых листингов: те же 10 воркеров, но число ждущих задач ограничено
+NEW_GIFTS_QUEUE_SIZE = int(os.getenv('NEW_GIFTS_QUEUE_SIZE', '500'))
+NEW_GIFTS_QUEUE_POLICY = os.getenv('NEW_GIFTS_QUEUE_POLICY', 'drop_oldest')
+new_gifts_queue = None
+send_scheduler = None
+notification_dedup = None
+
+
+async def _marketplace_call(async_func, sync_func, *args, **kwargs):
+    """Вызов обертки маркетплейса без блокировки цикла: корутинная версия или синхронная в потоке"""
+    if async_func is not None:
+        return await async_func(*args, **kwargs)
+    return await asyncio.to_thread(sync_func, *args, **kwargs)
 
 
 class AddGift(StatesGroup):
@@ -163,126 +261,11 @@ async def init_db():
             minsize=1,
             maxsize=10
         )
+        # Схема: версионные миграции (DDL только если есть непримененные шаги)
+        await run_migrations(db_pool)
+        
         async with db_pool.acquire() as conn:
             async with conn.cursor() as cur:
-                await cur.execute("""
-                CREATE TABLE IF NOT EXISTS gifts (
-                    name VARCHAR(255) NOT NULL,
-                    model VARCHAR(255),
-                    price FLOAT DEFAULT 0,
-                    floor_price FLOAT DEFAULT 0,
-                    photo_url TEXT,
-                    model_rarity VARCHAR(50),
-                    user_id BIGINT NOT NULL,
-                    marketplace VARCHAR(50) DEFAULT 'portals',
-                    PRIMARY KEY (user_id, name(255), model(255), marketplace(50))
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
-                
-                # Миграция: добавляем колонку marketplace если её нет
-                try:
-                    await cur.execute("""
-                        ALTER TABLE gifts 
-                        ADD COLUMN marketplace VARCHAR(50) DEFAULT 'portals'
-                    """)
-                    logger.info("Added marketplace column to gifts table")
-                except Exception as e:
-                    if "Duplicate column name" not in str(e):
-                        logger.warning(f"Could not add marketplace column: {e}")
-                
-                # Миграция: добавляем колонку model_floor_price если её нет
-                try:
-                    await cur.execute("""
-                        ALTER TABLE gifts 
-                        ADD COLUMN model_floor_price FLOAT DEFAULT NULL
-                    """)
-                    logger.info("Added model_floor_price column to gifts table")
-                except Exception as e:
-                    if "Duplicate column name" not in str(e):
-                        logger.warning(f"Could not add model_floor_price column: {e}")
-                
-                # Таблица для отслеживания уже уведомленных подарков
-                await cur.execute("""
-                CREATE TABLE IF NOT EXISTS notified_gifts (
-                    gift_id VARCHAR(255) NOT NULL PRIMARY KEY,
-                    notified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_notified_at (notified_at)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
-                
-                # Таблица для хранения всех пользователей бота (для отправки уведомлений)
-                await cur.execute("""
-                CREATE TABLE IF NOT EXISTS bot_users (
-                    user_id BIGINT NOT NULL PRIMARY KEY,
-                    username VARCHAR(255),
-                    first_name VARCHAR(255),
-                    last_name VARCHAR(255),
-                    notifications_enabled BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
-                
-                # Таблица для админов
-                await cur.execute("""
-                CREATE TABLE IF NOT EXISTS admins (
-                    user_id BIGINT NOT NULL PRIMARY KEY,
-                    username VARCHAR(255),
-                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_user_id (user_id)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
-                
-                # Таблица для разрешенных пользователей
-                await cur.execute("""
-                CREATE TABLE IF NOT EXISTS allowed_users (
-                    user_id BIGINT NOT NULL PRIMARY KEY,
-                    username VARCHAR(255),
-                    first_name VARCHAR(255),
-                    added_by BIGINT,
-                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_user_id (user_id),
-                    INDEX idx_added_by (added_by)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
-                
-                # Таблица для отслеживания включенного мониторинга новых подарков
-                await cur.execute("""
-                CREATE TABLE IF NOT EXISTS new_gifts_monitoring (
-                    user_id BIGINT NOT NULL PRIMARY KEY,
-                    enabled BOOLEAN DEFAULT FALSE,
-                    enabled_at TIMESTAMP NULL,
-                    last_check_at TIMESTAMP NULL,
-                    INDEX idx_enabled (enabled)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
-                
-                # Таблица для настроек маркетплейсов пользователя
-                await cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_marketplaces (
-                    user_id BIGINT NOT NULL,
-                    marketplace VARCHAR(50) NOT NULL,
-                    enabled BOOLEAN DEFAULT TRUE,
-                    PRIMARY KEY (user_id, marketplace),
-                    INDEX idx_user_id (user_id),
-                    INDEX idx_marketplace (marketplace)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
-                
-                # Таблица для фильтров цены пользователя
-                await cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_price_filters (
-                    user_id BIGINT NOT NULL PRIMARY KEY,
-                    min_price FLOAT DEFAULT NULL,
-                    max_price FLOAT DEFAULT NULL,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_user_id (user_id)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-                """)
-                
-                # Инициализируем настройки по умолчанию для всех пользователей (все маркетплейсы включены)
-                # Это делается при первом использовании, не здесь
-                
                 # Добавляем первого админа (5299538981)
                 try:
                     await cur.execute("""
@@ -293,32 +276,6 @@ async def init_db():
                     logger.info("Added default admin to database")
                 except Exception as e:
                     logger.warning(f"Could not add default admin: {e}")
-                
-                # Миграция: добавляем колонку notifications_enabled если её нет
-                try:
-                    await cur.execute("""
-                        ALTER TABLE bot_users 
-                        ADD COLUMN notifications_enabled BOOLEAN DEFAULT TRUE
-                    """)
-                    logger.info("Added notifications_enabled column to bot_users table")
-                except Exception as e:
-                    # Колонка уже существует или другая ошибка
-                    if "Duplicate column name" not in str(e):
-                        logger.warning(f"Could not add notifications_enabled column: {e}")
-                
-                # Миграция: добавляем колонку marketplace если её нет
-                try:
-                    await cur.execute("""
-                        ALTER TABLE bot_users 
-                        ADD COLUMN marketplace VARCHAR(50) DEFAULT 'portals'
-                    """)
-                    logger.info("Added marketplace column to bot_users table")
-                except Exception as e:
-                    # Колонка уже существует или другая ошибка
-                    if "Duplicate column name" not in str(e):
-                        logger.warning(f"Could not add marketplace column: {e}")
-                
-                await conn.commit()
         logger.info("Database initialized successfully")
     except Exception as e:
         error_msg = str(e)
@@ -381,12 +338,29 @@ async def init_mrkt_auth():
     return MRKT_AUTH
 
 
+async def _load_access_lists():
+    """id админов и разрешенных пользователей для кеша прав"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT user_id FROM admins")
+            admin_ids = {row[0] for row in await cur.fetchall()}
+            await cur.execute("SELECT user_id FROM allowed_users")
+            allowed_ids = {row[0] for row in await cur.fetchall()}
+    return admin_ids, allowed_ids
+
+
+async def _access_ready() -> bool:
+    return access_cache is not None and db_pool is not None and await access_cache.ensure_loaded(_load_access_lists)
+
+
 async def is_admin(user_id: int) -> bool:
     """Проверка, является ли пользователь админом"""
     if user_id == ADMIN_ID:
         return True
     if not db_pool:
         return False
+    if await _access_ready():
+        return access_cache.is_admin(user_id)
     try:
         async with db_pool.acquire() as conn:
             async with conn.cursor() as cur:
@@ -403,6 +377,8 @@ async def is_allowed_user(user_id: int) -> bool:
         return True
     if not db_pool:
         return False
+    if await _access_ready():
+        return access_cache.is_allowed(user_id)
     try:
         async with db_pool.acquire() as conn:
             async with conn.cursor() as cur:
@@ -1041,7 +1017,7 @@ async def get_all_gift_names_from_marketplace(marketplace: str) -> set:
                 
         elif marketplace == 'mrkt' and search_mrkt and MRKT_AUTH:
             try:
-                items = search_mrkt(limit=100, sort="price_asc", auth_token=MRKT_AUTH)
+                items = await _marketplace_call(search_mrkt_async, search_mrkt, limit=100, sort="price_asc", auth_token=MRKT_AUTH)
                 if isinstance(items, dict):
                     items = items.get('gifts') or items.get('results') or items.get('items') or []
                 elif not isinstance(items, list):
@@ -1121,7 +1097,7 @@ async def get_models_for_gift(gift_name: str, marketplace: str = None) -> set:
                         
             elif mp == 'tonnel' and search_tonnel:
                 try:
-                    items = search_tonnel(gift_name=gift_name, limit=100, sort="price_asc", authData=TONNEL_AUTH)
+                    items = await _marketplace_call(search_tonnel_async, search_tonnel, gift_name=gift_name, limit=100, sort="price_asc", authData=TONNEL_AUTH)
                     if isinstance(items, dict):
                         items = items.get('results') or items.get('items') or items.get('gifts') or []
                     elif not isinstance(items, list):
@@ -1137,7 +1113,7 @@ async def get_models_for_gift(gift_name: str, marketplace: str = None) -> set:
                     
             elif mp == 'mrkt' and search_mrkt and MRKT_AUTH:
                 try:
-                    items = search_mrkt(gift_name=gift_name, limit=100, sort="price_asc", auth_token=MRKT_AUTH)
+                    items = await _marketplace_call(search_mrkt_async, search_mrkt, gift_name=gift_name, limit=100, sort="price_asc", auth_token=MRKT_AUTH)
                     if isinstance(items, dict):
                         items = items.get('gifts') or items.get('results') or items.get('items') or []
                     elif not isinstance(items, list):
@@ -1644,6 +1620,12 @@ async def save_gift_selection(callback_or_message, state: FSMContext):
                 
                 await conn.commit()
         
+        if subscription_index is not None:
+            subscription_index.add(user_id, gift_name, model)
+        if price_filter_index is not None:
+            # Старая схема: один фильтр на пользователя
+            price_filter_index.set(user_id, None, None, min_price, max_price)
+        
         # Формируем сообщение
         gift_text = "любые подарки" if gift_name == "ANY" else gift_name
         model_text = "любые модели" if model == "ANY" else model
@@ -1764,7 +1746,7 @@ async def add_model(message: types.Message, state: FSMContext):
                 await state.clear()
                 return
             
-            items = search_tonnel(
+            items = await _marketplace_call(search_tonnel_async, search_tonnel, 
                 gift_name=gift_name,
                 model=model if model else None,
                 limit=5,
@@ -1784,7 +1766,7 @@ async def add_model(message: types.Message, state: FSMContext):
                 await state.clear()
                 return
             
-            items = search_mrkt(
+            items = await _marketplace_call(search_mrkt_async, search_mrkt, 
                 gift_name=gift_name,
                 model=model if model else None,
                 limit=5,
@@ -1906,10 +1888,10 @@ async def add_model(message: types.Message, state: FSMContext):
                         model_floor_price = await asyncio.to_thread(get_model_floor_price, gift_dict.get("name"), model, portals_auth)
             elif user_marketplace == 'tonnel':
                 if TONNEL_AUTH and get_tonnel_model_floor_price:
-                    model_floor_price = get_tonnel_model_floor_price(gift_dict.get("name"), model, TONNEL_AUTH)
+                    model_floor_price = await _marketplace_call(get_tonnel_model_floor_price_async, get_tonnel_model_floor_price, gift_dict.get("name"), model, TONNEL_AUTH)
             elif user_marketplace == 'mrkt':
                 if MRKT_AUTH and get_mrkt_model_floor_price:
-                    model_floor_price = get_mrkt_model_floor_price(gift_dict.get("name"), model, MRKT_AUTH)
+                    model_floor_price = await _marketplace_call(get_mrkt_model_floor_price_async, get_mrkt_model_floor_price, gift_dict.get("name"), model, MRKT_AUTH)
         except Exception as e:
             logger.error(f"Error getting model floor price when adding gift: {e}")
         
@@ -2161,6 +2143,9 @@ async def callback_gift_delete(callback: types.CallbackQuery):
                 deleted_count = cur.rowcount
                 await conn.commit()
         
+        if subscription_index is not None:
+            subscription_index.remove(callback.from_user.id, gift_name, model)
+        
         if deleted_count > 0:
             await callback.answer(f"✅ Подарок {gift_name} ({model}) удален")
         else:
@@ -2228,6 +2213,11 @@ async def check_prices():
             await cur.execute("SELECT * FROM gifts")
             gifts = await cur.fetchall()
 
+        # Результаты запросов по ключу (маркетплейс, подарок, модель) и отложенные UPDATE
+        fetched_items = {}
+        fetched_model_floors = {}
+        updates = []
+        
         for gift in gifts:
             name = gift["name"]
             model = gift["model"]
@@ -2251,69 +2241,76 @@ async def check_prices():
                 continue
 
             try:
-                # Работаем с выбранным маркетплейсом
-                if marketplace == 'tonnel':
-                    # Tonnel
-                    if not TONNEL_AUTH:
-                        logger.warning(f"TONNEL_AUTH not configured, skipping gift {name} for user {user_id}")
-                        continue
-                    
-                    if not search_tonnel:
-                        logger.warning(f"search_tonnel not available, skipping gift {name} for user {user_id}")
-                        continue
-                    
-                    items = search_tonnel(
-                        gift_name=name,
-                        model=model if model else None,
-                        limit=1,
-                        sort="price_asc",
-                        authData=TONNEL_AUTH
-                    )
-                elif marketplace == 'mrkt':
-                    # MRKT
-                    if not search_mrkt:
-                        logger.warning(f"search_mrkt not available, skipping gift {name} for user {user_id}")
-                        continue
-                    
-                    # Используем токен MRKT из конфига
-                    if not MRKT_AUTH:
-                        logger.warning(f"MRKT_AUTH not configured, skipping gift {name} for user {user_id}")
-                        continue
-                    
-                    items = search_mrkt(
-                        gift_name=name,
-                        model=model if model else None,
-                        limit=1,
-                        sort="price_asc",
-                        auth_token=MRKT_AUTH
-                    )
+                # Один запрос на (маркетплейс, подарок, модель) за проход
+                key = (marketplace, name, model)
+                if key in fetched_items:
+                    items = fetched_items[key]
                 else:
-                    # Portals (по умолчанию)
-                    if not auth_token:
-                        auth_token = await init_auth()
-                        if not auth_token:
-                            logger.error("Cannot check prices: auth failed")
+                    # Работаем с выбранным маркетплейсом
+                    if marketplace == 'tonnel':
+                        # Tonnel
+                        if not TONNEL_AUTH:
+                            logger.warning(f"TONNEL_AUTH not configured, skipping gift {name} for user {user_id}")
                             continue
-
-                    # Проверяем, является ли search асинхронной функцией
-                    if inspect.iscoroutinefunction(search):
-                        items = await search(
+                    
+                        if not search_tonnel:
+                            logger.warning(f"search_tonnel not available, skipping gift {name} for user {user_id}")
+                            continue
+                    
+                        items = await _marketplace_call(search_tonnel_async, search_tonnel, 
                             gift_name=name,
-                            model=model if model else "",
+                            model=model if model else None,
                             limit=1,
                             sort="price_asc",
-                            authData=auth_token
+                            authData=TONNEL_AUTH
                         )
-                    else:
-                        # Если синхронная, запускаем в отдельном потоке
-                        items = await asyncio.to_thread(
-                            search,
+                    elif marketplace == 'mrkt':
+                        # MRKT
+                        if not search_mrkt:
+                            logger.warning(f"search_mrkt not available, skipping gift {name} for user {user_id}")
+                            continue
+                    
+                        # Используем токен MRKT из конфига
+                        if not MRKT_AUTH:
+                            logger.warning(f"MRKT_AUTH not configured, skipping gift {name} for user {user_id}")
+                            continue
+                    
+                        items = await _marketplace_call(search_mrkt_async, search_mrkt, 
                             gift_name=name,
-                            model=model if model else "",
+                            model=model if model else None,
                             limit=1,
                             sort="price_asc",
-                            authData=auth_token
+                            auth_token=MRKT_AUTH
                         )
+                    else:
+                        # Portals (по умолчанию)
+                        if not auth_token:
+                            auth_token = await init_auth()
+                            if not auth_token:
+                                logger.error("Cannot check prices: auth failed")
+                                continue
+
+                        # Проверяем, является ли search асинхронной функцией
+                        if inspect.iscoroutinefunction(search):
+                            items = await search(
+                                gift_name=name,
+                                model=model if model else "",
+                                limit=1,
+                                sort="price_asc",
+                                authData=auth_token
+                            )
+                        else:
+                            # Если синхронная, запускаем в отдельном потоке
+                            items = await asyncio.to_thread(
+                                search,
+                                gift_name=name,
+                                model=model if model else "",
+                                limit=1,
+                                sort="price_asc",
+                                authData=auth_token
+                            )
+                    if isinstance(items, list):
+                        fetched_items[key] = items
 
                 # Официальная библиотека возвращает список напрямую
                 if isinstance(items, str):
@@ -2335,8 +2332,8 @@ async def check_prices():
                 # Обрабатываем как объект PortalsGift или dict
                 if hasattr(current, 'price'):
                     # Это объект PortalsGift из aportalsmp
-                    new_price = float(current.price) if current.price else float('inf')
-                    new_floor = float(current.floor_price) if hasattr(current, 'floor_price') and current.floor_price else float('inf')
+                    new_price = float(current.price) if current.price else None
+                    new_floor = float(current.floor_price) if hasattr(current, 'floor_price') and current.floor_price else None
                     current_id = current.id if hasattr(current, 'id') else None
                     current_photo_url = current.photo_url if hasattr(current, 'photo_url') else None
                     current_model_rarity = (
@@ -2348,8 +2345,9 @@ async def check_prices():
                     )
                 else:
                     # Это dict
-                    new_price = float(current.get("price", float('inf')))
-                    new_floor = float(current.get("floor_price", float('inf')))
+                    # Нет цены/флора — None (NULL в БД), inf не пропускает драйвер MySQL
+                    new_price = float(current["price"]) if current.get("price") else None
+                    new_floor = float(current["floor_price"]) if current.get("floor_price") else None
                     current_id = current.get('id')
                     current_photo_url = current.get('photo_url')
                     current_model_rarity = (
@@ -2361,23 +2359,28 @@ async def check_prices():
                     )
                 
                 # Получаем флор модели для сравнения
-                new_model_floor = None
-                try:
-                    if marketplace == 'portals':
-                        portals_auth = PORTALS_AUTH if PORTALS_AUTH else auth_token
-                        if portals_auth:
-                            if inspect.iscoroutinefunction(get_model_floor_price):
-                                new_model_floor = await get_model_floor_price(name, model, portals_auth)
-                            else:
-                                new_model_floor = await asyncio.to_thread(get_model_floor_price, name, model, portals_auth)
-                    elif marketplace == 'tonnel':
-                        if TONNEL_AUTH and get_tonnel_model_floor_price:
-                            new_model_floor = get_tonnel_model_floor_price(name, model, TONNEL_AUTH)
-                    elif marketplace == 'mrkt':
-                        if MRKT_AUTH and get_mrkt_model_floor_price:
-                            new_model_floor = get_mrkt_model_floor_price(name, model, MRKT_AUTH)
-                except Exception as e:
-                    logger.error(f"Error getting model floor price for {name} / {model} on {marketplace}: {e}")
+                key = (marketplace, name, model)
+                if key in fetched_model_floors:
+                    new_model_floor = fetched_model_floors[key]
+                else:
+                    new_model_floor = None
+                    try:
+                        if marketplace == 'portals':
+                            portals_auth = PORTALS_AUTH if PORTALS_AUTH else auth_token
+                            if portals_auth:
+                                if inspect.iscoroutinefunction(get_model_floor_price):
+                                    new_model_floor = await get_model_floor_price(name, model, portals_auth)
+                                else:
+                                    new_model_floor = await asyncio.to_thread(get_model_floor_price, name, model, portals_auth)
+                        elif marketplace == 'tonnel':
+                            if TONNEL_AUTH and get_tonnel_model_floor_price:
+                                new_model_floor = await _marketplace_call(get_tonnel_model_floor_price_async, get_tonnel_model_floor_price, name, model, TONNEL_AUTH)
+                        elif marketplace == 'mrkt':
+                            if MRKT_AUTH and get_mrkt_model_floor_price:
+                                new_model_floor = await _marketplace_call(get_mrkt_model_floor_price_async, get_mrkt_model_floor_price, name, model, MRKT_AUTH)
+                    except Exception as e:
+                        logger.error(f"Error getting model floor price for {name} / {model} on {marketplace}: {e}")
+                    fetched_model_floors[key] = new_model_floor
                 
                 # Получаем старый флор модели из базы данных
                 old_model_floor = gift.get("model_floor_price")
@@ -2385,8 +2388,8 @@ async def check_prices():
                     old_model_floor = old_floor  # Используем старый флор подарка как fallback
 
                 # Проверяем снижение цены или флора (цены подарка или флора модели)
-                price_dropped = new_price < old_price
-                floor_dropped = new_floor < old_floor
+                price_dropped = new_price is not None and new_price < old_price
+                floor_dropped = new_floor is not None and new_floor < old_floor
                 model_floor_dropped = new_model_floor is not None and old_model_floor is not None and new_model_floor < old_model_floor
                 
                 if price_dropped or floor_dropped or model_floor_dropped:
@@ -2470,45 +2473,40 @@ async def check_prices():
                             reply_markup=keyboard
                         )
 
-                    async with conn.cursor() as cur:
-                        # Проверяем наличие колонки model_floor_price
-                        try:
-                            await cur.execute("""
-                            UPDATE gifts 
-                            SET price = %s, floor_price = %s, photo_url = %s, model_rarity = %s, model_floor_price = %s
-                            WHERE name = %s AND model = %s AND user_id = %s AND marketplace = %s
-                            """, (
-                                new_price,
-                                new_floor,
-                                current_photo_url,
-                                current_model_rarity,
-                                new_model_floor,
-                                name,
-                                model,
-                                user_id,
-                                marketplace
-                            ))
-                        except Exception as e:
-                            # Если колонка model_floor_price не существует, обновляем без неё
-                            logger.warning(f"Column model_floor_price might not exist: {e}")
-                            await cur.execute("""
-                            UPDATE gifts 
-                            SET price = %s, floor_price = %s, photo_url = %s, model_rarity = %s
-                            WHERE name = %s AND model = %s AND user_id = %s AND marketplace = %s
-                            """, (
-                                new_price,
-                                new_floor,
-                                current_photo_url,
-                                current_model_rarity,
-                                name,
-                                model,
-                                user_id,
-                                marketplace
-                            ))
-                        await conn.commit()
+                    updates.append((
+                        new_price,
+                        new_floor,
+                        current_photo_url,
+                        current_model_rarity,
+                        new_model_floor,
+                        name,
+                        model,
+                        user_id,
+                        marketplace
+                    ))
             except Exception as e:
                 logger.error(f"Error checking price for {name} ({model}) for user {user_id}: {e}", exc_info=True)
 
+        # Все изменения одной транзакцией
+        if updates:
+            async with conn.cursor() as cur:
+                try:
+                    await cur.executemany("""
+                    UPDATE gifts 
+                    SET price = %s, floor_price = %s, photo_url = %s, model_rarity = %s, model_floor_price = %s
+                    WHERE name = %s AND model = %s AND user_id = %s AND marketplace = %s
+                    """, updates)
+                except Exception as e:
+                    # Если колонка model_floor_price не существует, обновляем без неё
+                    logger.warning(f"Column model_floor_price might not exist: {e}")
+                    await conn.rollback()
+                    await cur.executemany("""
+                    UPDATE gifts 
+                    SET price = %s, floor_price = %s, photo_url = %s, model_rarity = %s
+                    WHERE name = %s AND model = %s AND user_id = %s AND marketplace = %s
+                    """, [row[:4] + row[5:] for row in updates])
+                await conn.commit()
+
 
 async def check_new_gifts():
     """Проверка новых подарков на маркетплейсе (старая функция, оставлена для совместимости)"""
@@ -2806,13 +2804,13 @@ async def process_new_gifts(items, marketplace: str):
                             logger.warning(f"No rarity fields found in gift_details. Available keys: {list(gift_details.keys())}")
                 elif marketplace == 'tonnel':
                     if get_tonnel_gift_by_id:
-                        gift_details = get_tonnel_gift_by_id(gift_id_original, TONNEL_AUTH)
+                        gift_details = await asyncio.to_thread(get_tonnel_gift_by_id, gift_id_original, TONNEL_AUTH)
                     # Для Tonnel продажи получаем через модель (будет получено позже)
                 elif marketplace == 'mrkt':
                     if not MRKT_AUTH:
                         logger.warning("MRKT_AUTH not configured, skipping gift details")
                     elif get_mrkt_gift_by_id:
-                        gift_details = get_mrkt_gift_by_id(gift_id_original, MRKT_AUTH)
+                        gift_details = await asyncio.to_thread(get_mrkt_gift_by_id, gift_id_original, MRKT_AUTH)
                     # Для MRKT продажи получаем через модель (будет получено позже)
                 
                 # Формируем данные о подарке - сначала из item (который приходит из search()), потом из gift_details
@@ -3003,7 +3001,7 @@ async def process_new_gifts(items, marketplace: str):
                         if name != 'Unknown' and model and model != 'N/A' and get_tonnel_model_sales_history and TONNEL_AUTH:
                             try:
                                 logger.info(f"Getting model sales history from Tonnel for {name} / {model}")
-                                model_sales = get_tonnel_model_sales_history(name, model, TONNEL_AUTH, limit=5)
+                                model_sales = await _marketplace_call(get_tonnel_model_sales_history_async, get_tonnel_model_sales_history, name, model, TONNEL_AUTH, limit=5)
                             except Exception as e:
                                 logger.error(f"Error getting Tonnel model sales history: {e}")
                                 model_sales = []
@@ -3014,14 +3012,14 @@ async def process_new_gifts(items, marketplace: str):
                     if name != 'Unknown' and model and model != 'N/A' and get_tonnel_model_floor_price:
                         try:
                             logger.info(f"Getting floor prices for {name} / {model} (Tonnel)")
-                            model_floor = get_tonnel_model_floor_price(name, model, TONNEL_AUTH)
+                            model_floor = await _marketplace_call(get_tonnel_model_floor_price_async, get_tonnel_model_floor_price, name, model, TONNEL_AUTH)
                             logger.info(f"Model floor: {model_floor}")
                         except Exception as e:
                             logger.error(f"Error getting Tonnel model floor price: {e}")
                     
                     if name != 'Unknown' and get_tonnel_gift_floor_price:
                         try:
-                            gift_floor = get_tonnel_gift_floor_price(name, TONNEL_AUTH)
+                            gift_floor = await _marketplace_call(get_tonnel_gift_floor_price_async, get_tonnel_gift_floor_price, name, TONNEL_AUTH)
                             logger.info(f"Gift floor: {gift_floor}")
                         except Exception as e:
                             logger.error(f"Error getting Tonnel gift floor price: {e}")
@@ -3030,7 +3028,7 @@ async def process_new_gifts(items, marketplace: str):
                     if name != 'Unknown' and model and model != 'N/A' and get_tonnel_model_sales_history and TONNEL_AUTH:
                         try:
                             logger.info(f"Getting model sales history from Tonnel for {name} / {model}")
-                            model_sales = get_tonnel_model_sales_history(name, model, TONNEL_AUTH, limit=5)
+                            model_sales = await _marketplace_call(get_tonnel_model_sales_history_async, get_tonnel_model_sales_history, name, model, TONNEL_AUTH, limit=5)
                         except Exception as e:
                             logger.error(f"Error getting Tonnel model sales history: {e}")
                             model_sales = []
@@ -3047,7 +3045,7 @@ async def process_new_gifts(items, marketplace: str):
                         if name != 'Unknown' and model and model != 'N/A' and get_mrkt_model_floor_price:
                             try:
                                 logger.info(f"Getting floor prices for {name} / {model} (MRKT)")
-                                model_floor = get_mrkt_model_floor_price(name, model, MRKT_AUTH)
+                                model_floor = await _marketplace_call(get_mrkt_model_floor_price_async, get_mrkt_model_floor_price, name, model, MRKT_AUTH)
                                 logger.info(f"Model floor: {model_floor}")
                             except Exception as e:
                                 error_msg = str(e)
@@ -3062,7 +3060,7 @@ async def process_new_gifts(items, marketplace: str):
                         
                         if name != 'Unknown' and get_mrkt_gift_floor_price:
                             try:
-                                gift_floor = get_mrkt_gift_floor_price(name, MRKT_AUTH)
+                                gift_floor = await _marketplace_call(get_mrkt_gift_floor_price_async, get_mrkt_gift_floor_price, name, MRKT_AUTH)
                                 logger.info(f"Gift floor: {gift_floor}")
                             except Exception as e:
                                 error_msg = str(e)
@@ -3076,7 +3074,7 @@ async def process_new_gifts(items, marketplace: str):
                         if name != 'Unknown' and model and model != 'N/A' and get_tonnel_model_sales_history and TONNEL_AUTH:
                             try:
                                 logger.info(f"Getting model sales history from Tonnel for {name} / {model}")
-                                model_sales = get_tonnel_model_sales_history(name, model, TONNEL_AUTH, limit=5)
+                                model_sales = await _marketplace_call(get_tonnel_model_sales_history_async, get_tonnel_model_sales_history, name, model, TONNEL_AUTH, limit=5)
                             except Exception as e:
                                 logger.error(f"Error getting Tonnel model sales history: {e}")
                                 model_sales = []
@@ -3231,10 +3229,14 @@ async def init_existing_gifts():
     # Инициализируем словари для каждого маркетплейса
     for mp in ['portals', 'tonnel', 'mrkt']:
         if mp not in new_gifts_last_ids:
-            new_gifts_last_ids[mp] = set()
+            new_gifts_last_ids[mp] = get_seen_store('bot', mp) if get_seen_store else set()
     
     # Загружаем текущие подарки из каждого маркетплейса
     for marketplace in ['portals', 'tonnel', 'mrkt']:
+        if getattr(new_gifts_last_ids[marketplace], 'warm', False):
+            # Состояние до рестарта свежее — baseline не нужен
+            logger.info(f"[init] {marketplace}: warm start with {len(new_gifts_last_ids[marketplace])} saved ids")
+            continue
         try:
             items = []
             if marketplace == 'portals':
@@ -3247,10 +3249,14 @@ async def init_existing_gifts():
                         items = await asyncio.to_thread(search, limit=999, sort="latest", authData=portals_auth)
             elif marketplace == 'tonnel' and search_tonnel:
                 logger.info(f"[init] Loading existing gifts from tonnel...")
-                items = search_tonnel(limit=30, sort="latest", authData=TONNEL_AUTH)
+                items = await _marketplace_call(search_tonnel_async, search_tonnel, limit=30, sort="latest", authData=TONNEL_AUTH)
             elif marketplace == 'mrkt' and search_mrkt and MRKT_AUTH:
                 logger.info(f"[init] Loading existing gifts from mrkt...")
-                items = search_mrkt(limit=999, sort="price_asc", auth_token=MRKT_AUTH)
+                if collect_mrkt_listings:
+                    # Обходим страницы по курсору: одна страница MRKT — максимум 20 лотов
+                    items = await collect_mrkt_listings(sort="price_asc", auth_token=MRKT_AUTH, max_items=999)
+                else:
+                    items = await _marketplace_call(search_mrkt_async, search_mrkt, limit=999, sort="price_asc", auth_token=MRKT_AUTH)
             
             # Приводим формат к списку
             if isinstance(items, dict):
@@ -3294,6 +3300,8 @@ async def init_existing_gifts():
                         count += 1
                 
                 logger.info(f"[init] Loaded {count} existing gifts from {marketplace}")
+                if save_seen_ids:
+                    save_seen_ids(force=True)
         except Exception as e:
             logger.error(f"Error initializing existing gifts from {marketplace}: {e}")
     
@@ -3309,7 +3317,7 @@ async def new_gifts_monitoring_tracker():
     # Инициализируем словари для каждого маркетплейса
     for mp in ['portals', 'tonnel', 'mrkt']:
         if mp not in new_gifts_last_ids:
-            new_gifts_last_ids[mp] = set()
+            new_gifts_last_ids[mp] = get_seen_store('bot', mp) if get_seen_store else set()
     
     while True:
         try:
@@ -3475,7 +3483,7 @@ async def new_gifts_monitoring_tracker():
                         logger.info(f"[monitor] Starting Tonnel processing...")
                         try:
                             # Tonnel имеет лимит 30, используем максимальный лимит
-                            items = search_tonnel(limit=30, sort="latest", authData=TONNEL_AUTH)
+                            items = await _marketplace_call(search_tonnel_async, search_tonnel, limit=30, sort="latest", authData=TONNEL_AUTH)
                             # Приводим формат к списку
                             if isinstance(items, dict):
                                 if 'results' in items:
@@ -3499,7 +3507,7 @@ async def new_gifts_monitoring_tracker():
                         try:
                             # MRKT имеет лимит 20, используем максимальный лимит
                             # Для MRKT используем сортировку по цене (price_asc), так как latest даёт 400 (ordering null)
-                            items = search_mrkt(limit=20, sort="price_asc", auth_token=MRKT_AUTH)
+                            items = await _marketplace_call(search_mrkt_async, search_mrkt, limit=20, sort="price_asc", auth_token=MRKT_AUTH)
                             # Приводим формат к списку
                             if isinstance(items, dict):
                                 if 'gifts' in items:
@@ -3613,12 +3621,12 @@ async def new_gifts_monitoring_tracker():
                             if filtered_users:
                                 logger.info(f"[monitor] {marketplace}: ✅ NEW GIFT - {name} ({model}), ID: {gift_id}, sending to {len(filtered_users)} users")
                                 # Создаем задачу для обработки этого подарка - все новые подарки будут отправлены
-                                asyncio.create_task(process_new_gift_monitoring_with_semaphore(item_dict, marketplace, filtered_users))
+                                enqueue_new_gift(item_dict, marketplace, filtered_users, gift_id_str)
                             else:
                                 logger.debug(f"[monitor] {marketplace}: No users to notify for gift {name} ({model})")
                             
-                            # Ограничиваем размер множества (храним последние 1000)
-                            if len(new_gifts_last_ids[marketplace]) > 1000:
+                            # Ограничиваем размер множества (SeenIdStore вытесняет старые id сам)
+                            if isinstance(new_gifts_last_ids[marketplace], set) and len(new_gifts_last_ids[marketplace]) > 1000:
                                 new_gifts_last_ids[marketplace] = set(list(new_gifts_last_ids[marketplace])[-1000:])
                         else:
                             seen_count += 1
@@ -3646,6 +3654,13 @@ async def new_gifts_monitoring_tracker():
             else:
                 logger.warning(f"[monitor] No tasks to run")
             
+            if new_gifts_queue is not None:
+                new_gifts_queue.log_stats()
+            if send_scheduler is not None:
+                log_send_stats()
+            if save_seen_ids:
+                save_seen_ids()
+            
             # Небольшая задержка перед следующим циклом
             await asyncio.sleep(2)  # Проверка каждые 2 секунды
         
@@ -3660,9 +3675,118 @@ async def process_new_gift_monitoring_with_semaphore(item: Dict, marketplace: st
         await process_new_gift_monitoring(item, marketplace, users)
 
 
+def get_notification_dedup():
+    """Общая дедупликация уведомлений (нужен db_pool)"""
+    global notification_dedup
+    if notification_dedup is None and NotificationDedup is not None and db_pool is not None:
+        notification_dedup = NotificationDedup(db_pool)
+    return notification_dedup
+
+
+_send_stats_logged_at = 0.0
+
+
+def log_send_stats(interval: float = 60.0):
+    """Метрики доставки уведомлений в лог не чаще раза в минуту"""
+    global _send_stats_logged_at
+    now = time.monotonic()
+    if send_scheduler is not None and now - _send_stats_logged_at >= interval:
+        _send_stats_logged_at = now
+        logger.info(f"[telegram] {send_scheduler.stats()}")
+        if notification_dedup is not None:
+            logger.info(f"[dedup] {notification_dedup.stats()}")
+
+
+def get_send_scheduler():
+    """Общий планировщик уведомлений для bot"""
+    global send_scheduler
+    if send_scheduler is None and TelegramSendScheduler is not None:
+        # file_id картинок: память процесса + таблица telegram_file_ids (переживают перезапуск)
+        backend = MySQLFileIdStore(db_pool) if db_pool is not None else None
+        send_scheduler = TelegramSendScheduler(bot, photo_cache=PhotoFileIdCache(backend))
+    return send_scheduler
+
+
+def enqueue_new_gift(item: Dict, marketplace: str, users: List, key: str):
+    """Поставить новый листинг в ограниченную очередь (без work_queue — задача под семафором)"""
+    global new_gifts_queue
+    if BoundedWorkQueue is None:
+        asyncio.create_task(process_new_gift_monitoring_with_semaphore(item, marketplace, users))
+        return
+    if new_gifts_queue is None:
+        new_gifts_queue = BoundedWorkQueue(
+            'new_gifts',
+            process_new_gift_monitoring,
+            workers=10,
+            maxsize=NEW_GIFTS_QUEUE_SIZE,
+            policy=NEW_GIFTS_QUEUE_POLICY,
+            merge=merge_users,
+        )
+    new_gifts_queue.submit(item, marketplace, users, key=key)
+
+
+async def _load_subscriptions() -> List[Dict]:
+    """Все подписки из gifts для индекса подписок"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute("SELECT user_id, name, model FROM gifts")
+            return await cur.fetchall()
+
+
+async def get_gift_subscribers(gift_name: str, model: str) -> Optional[Set[int]]:
+    """Подписчики листинга по индексу; None — индекс недоступен"""
+    if subscription_index is None:
+        return None
+    if not await subscription_index.ensure_loaded(_load_subscriptions):
+        return None
+    return subscription_index.match(gift_name, model)
+
+
+async def _load_price_filters() -> List[Dict]:
+    """Все фильтры цен для индекса в памяти"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute("SELECT * FROM user_price_filters")
+            return await cur.fetchall()
+
+
+async def filter_users_by_price(user_ids: List[int], gift_name: str, model: str, price: float) -> List[int]:
+    """Пользователи, чьи фильтры цены пропускают листинг (без БД, если индекс загружен)"""
+    if price_filter_index is not None and await price_filter_index.ensure_loaded(_load_price_filters):
+        return price_filter_index.filter_users(user_ids, gift_name, model, price)
+    return [user_id for user_id in user_ids if await check_user_price_filter(user_id, price)]
+
+
+async def check_user_price_filter(user_id: int, price: float) -> bool:
+    """Проверить фильтр цены пользователя"""
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            await cur.execute("""
+                SELECT min_price, max_price FROM user_price_filters WHERE user_id = %s
+            """, (user_id,))
+            price_filter = await cur.fetchone()
+    if price_filter:
+        min_price = price_filter.get('min_price')
+        max_price = price_filter.get('max_price')
+        if min_price is not None and price < min_price:
+            logger.debug(f"[filter] User {user_id}: price {price} < min_price {min_price}")
+            return False
+        if max_price is not None and price > max_price:
+            logger.debug(f"[filter] User {user_id}: price {price} > max_price {max_price}")
+            return False
+    return True
+
+
 async def should_process_gift_for_user(user_id: int, gift_name: str, model: str, price: float) -> bool:
     """Проверить, должен ли подарок быть обработан для пользователя"""
     try:
+        # Быстрый путь: индекс подписок
+        subscribers = await get_gift_subscribers(gift_name, model)
+        if subscribers is not None:
+            if user_id not in subscribers:
+                return False
+            return bool(await filter_users_by_price([user_id], gift_name, model, price))
+        
         async with db_pool.acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cur:
                 # Получаем выбранные подарки пользователя
@@ -3735,6 +3859,7 @@ async def should_process_gift_for_user(user_id: int, gift_name: str, model: str,
 async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List):
     """Обработка нового подарка для мониторинга с правильным форматом вывода"""
     try:
+        detected_at = time.time()
         
         # Извлекаем данные - для разных маркетплейсов поля могут отличаться
         if marketplace == 'portals':
@@ -3811,9 +3936,16 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
         
         # Фильтруем пользователей по выбранным подаркам и фильтрам
         filtered_users = []
-        for user_id in users:
-            if await should_process_gift_for_user(user_id, name, model, price_ton):
-                filtered_users.append(user_id)
+        subscribers = await get_gift_subscribers(name, model)
+        if subscribers is not None:
+            # Подписки и фильтры цен — одна проверка в памяти на весь листинг
+            filtered_users = await filter_users_by_price(
+                [user_id for user_id in users if user_id in subscribers], name, model, price_ton
+            )
+        else:
+            for user_id in users:
+                if await should_process_gift_for_user(user_id, name, model, price_ton):
+                    filtered_users.append(user_id)
         
         if not filtered_users:
             # Подарок не подходит ни под один критерий пользователей
@@ -3857,6 +3989,15 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
             if found_mrkt_hash:
                 found_mrkt_hash = str(found_mrkt_hash).replace('-', '')
         
+        # Дедупликация между репликами: каждый (пользователь, листинг) уведомляет одна реплика
+        dedup = get_notification_dedup()
+        dedup_id = found_gift_id or found_mrkt_hash
+        if dedup is not None and dedup_id:
+            users = await dedup.claim(marketplace, dedup_id, users)
+            if not users:
+                logger.debug(f"[monitor] {marketplace}: {dedup_id} already notified by another replica")
+                return
+        
         # Очищаем название для URL (убираем пробелы и спецсимволы)
         name_clean = re.sub(r'[^\w-]', '', name.replace(' ', ''))
         gift_link = f"https://t.me/nft/{name_clean}-{gift_number}"
@@ -3873,6 +4014,12 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
         elif marketplace == 'mrkt' and found_mrkt_hash:
             gift_links['MRKT'] = f"https://t.me/mrkt/app?startapp={found_mrkt_hash}"
         
+        def _coalesced(mp: str, operation: str, model_key: Optional[str], factory):
+            # Одинаковые листинги в одной пачке делят один запрос к API
+            if coalesce is None:
+                return factory()
+            return coalesce(mp, operation, name_clean_for_search, model_key, factory)
+        
         # Оптимизация: получаем флоры со всех маркетплейсов параллельно
         async def get_portals_floor():
             try:
@@ -3913,9 +4060,9 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
         
         # Выполняем все запросы параллельно
         portals_floor, tonnel_floor, mrkt_floor = await asyncio.gather(
-            get_portals_floor(),
-            get_tonnel_floor(),
-            get_mrkt_floor(),
+            _coalesced('portals', 'model_floor', model_clean, get_portals_floor),
+            _coalesced('tonnel', 'model_floor', model_clean, get_tonnel_floor),
+            _coalesced('mrkt', 'model_floor', model_clean, get_mrkt_floor),
             return_exceptions=True
         )
         
@@ -3930,9 +4077,9 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
                 try:
                     portals_auth = PORTALS_AUTH if PORTALS_AUTH else auth_token
                     if inspect.iscoroutinefunction(search):
-                        portals_items = await search(gift_name=name_clean_for_search, model=model_clean, limit=1, sort="price_asc", authData=portals_auth)
+                        portals_items = await _coalesced('portals', 'cheapest', model_clean, lambda: search(gift_name=name_clean_for_search, model=model_clean, limit=1, sort="price_asc", authData=portals_auth))
                     else:
-                        portals_items = await asyncio.to_thread(search, gift_name=name_clean_for_search, model=model_clean, limit=1, sort="price_asc", authData=portals_auth)
+                        portals_items = await _coalesced('portals', 'cheapest', model_clean, lambda: asyncio.to_thread(search, gift_name=name_clean_for_search, model=model_clean, limit=1, sort="price_asc", authData=portals_auth))
                     if isinstance(portals_items, list) and portals_items:
                         gift_item = portals_items[0]
                         gift_id = gift_item.get('id') if isinstance(gift_item, dict) else (gift_item.id if hasattr(gift_item, 'id') else None)
@@ -3944,7 +4091,7 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
         async def get_tonnel_link():
             if floors['Tonnel'] and 'Tonnel' not in gift_links and search_tonnel:
                 try:
-                    tonnel_items = await asyncio.to_thread(search_tonnel, gift_name=name_clean_for_search, model=model_clean, limit=1, sort="price_asc", authData=TONNEL_AUTH)
+                    tonnel_items = await _coalesced('tonnel', 'cheapest', model_clean, lambda: asyncio.to_thread(search_tonnel, gift_name=name_clean_for_search, model=model_clean, limit=1, sort="price_asc", authData=TONNEL_AUTH))
                     if isinstance(tonnel_items, list) and tonnel_items:
                         gift_id = tonnel_items[0].get('id') if isinstance(tonnel_items[0], dict) else tonnel_items[0].get('gift_id')
                         if gift_id:
@@ -3955,7 +4102,7 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
         async def get_mrkt_link():
             if floors['MRKT'] and 'MRKT' not in gift_links and search_mrkt:
                 try:
-                    mrkt_items = await asyncio.to_thread(search_mrkt, gift_name=name_clean_for_search, model=model_clean, limit=1, sort="price_asc", auth_token=MRKT_AUTH)
+                    mrkt_items = await _coalesced('mrkt', 'cheapest', model_clean, lambda: asyncio.to_thread(search_mrkt, gift_name=name_clean_for_search, model=model_clean, limit=1, sort="price_asc", auth_token=MRKT_AUTH))
                     if isinstance(mrkt_items, list) and mrkt_items:
                         mrkt_hash = (mrkt_items[0].get('mrkt_hash') or mrkt_items[0].get('hash') or mrkt_items[0].get('hash_id') or 
                                    mrkt_items[0].get('token') or mrkt_items[0].get('uuid') or mrkt_items[0].get('id'))
@@ -4004,6 +4151,8 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
             try:
                 if marketplace == 'portals' and get_gift_floor_price:
                     portals_auth = PORTALS_AUTH if PORTALS_AUTH else auth_token
+                    if portals_auth and portals_gift_floor_async:
+                        return await portals_gift_floor_async(name_clean_for_search, portals_auth)
                     if portals_auth:
                         return await asyncio.to_thread(get_gift_floor_price, name_clean_for_search, portals_auth)
                 elif marketplace == 'tonnel' and get_tonnel_gift_floor_price:
@@ -4015,7 +4164,7 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
             return None
         
         # Запускаем получение gift_floor параллельно с другими операциями
-        gift_floor_task = asyncio.create_task(get_gift_floor_task())
+        gift_floor_task = asyncio.create_task(_coalesced(marketplace, 'gift_floor', None, get_gift_floor_task))
         
         # История продаж берем из Tonnel для всех маркетплейсов (только модели, не подарка)
         # Делаем это параллельно с получением gift_floor
@@ -4027,7 +4176,7 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
                 logger.debug(f"Error getting model sales: {e}")
             return []
         
-        model_sales_task = asyncio.create_task(get_model_sales_task())
+        model_sales_task = asyncio.create_task(_coalesced('tonnel', 'model_sales', model_clean, get_model_sales_task))
         
         # Ждем завершения всех параллельных задач
         model_sales = await model_sales_task
@@ -4072,6 +4221,18 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List)
         
         # Отправляем уведомления всем пользователям
         logger.info(f"Sending notifications to {len(users)} users: {users}")
+        sender = get_send_scheduler()
+        if sender is not None:
+            # Через планировщик: лимиты Telegram и повтор после RetryAfter
+            for user_id in users:
+                if photo_url:
+                    sender.send_photo(user_id, photo_url, caption=caption, created_at=detected_at,
+                                      parse_mode="HTML", reply_markup=keyboard)
+                else:
+                    sender.send_message(user_id, caption, created_at=detected_at, parse_mode="HTML",
+                                        reply_markup=keyboard, disable_web_page_preview=False)
+            return
+        
         for user_id in users:
             try:
                 if photo_url:
@@ -4337,6 +4498,8 @@ async def admin_add_user_id(message: types.Message, state: FSMContext):
                         first_name = VALUES(first_name)
                 """, (user_id, username, first_name, message.from_user.id))
                 await conn.commit()
+        if access_cache is not None:
+            access_cache.grant(user_id)
         
         await message.answer(f"✅ Пользователь {user_id} добавлен в список разрешенных")
     
@@ -4382,6 +4545,8 @@ async def admin_remove_user_id(message: types.Message, state: FSMContext):
                     DELETE FROM allowed_users WHERE user_id = %s
                 """, (user_id,))
                 await conn.commit()
+        if access_cache is not None:
+            access_cache.revoke(user_id)
         
         await message.answer(f"✅ Пользователь {user_id} удален из списка разрешенных")
     
@@ -4434,6 +4599,8 @@ async def callback_admin_list_users(callback: types.CallbackQuery):
 async def main():
     """Главная функция"""
     await init_db()
+    # Права доступа в память: апдейты проверяются без запросов к БД
+    await _access_ready()
     await init_auth()
     
     # Инициализируем существующие подарки, чтобы не отправлять старые
@@ -4449,15 +4616,29 @@ async def main():
     asyncio.create_task(new_gifts_monitoring_tracker())
     
     logger.info("Bot started")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # В том же цикле, где живут воркеры очереди и диспетчер отправок
+        await shutdown()
 
 
 async def shutdown():
     """Закрытие соединений при остановке"""
-    global db_pool
+    global db_pool, new_gifts_queue, send_scheduler
+    # Как Container.shutdown / stop_background_tasks: останавливаем очередь листингов и отправки
+    if new_gifts_queue is not None:
+        await new_gifts_queue.stop()
+        new_gifts_queue = None
+    if send_scheduler is not None:
+        await send_scheduler.stop()
+        send_scheduler = None
+    if save_seen_ids:
+        save_seen_ids(force=True)
     if db_pool:
         db_pool.close()
         await db_pool.wait_closed()
+        db_pool = None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,351 @@
+"""
+Версионные миграции схемы MySQL.
+
+Применённые версии хранятся в schema_migrations. На старте читается
+список версий: если всё применено, DDL не выполняется вообще. Каждый шаг
+идемпотентен (проверяет information_schema), поэтому сводит к одной схеме
+и базы, созданные старым bot.py::init_db, и базы DatabaseService.init_schema.
+Реплики берут GET_LOCK, чтобы не применять миграции одновременно.
+"""
+
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_LOCK = 'schema_migrations'
+MIGRATIONS_LOCK_TIMEOUT = 60
+
+Step = Callable[[object], Awaitable[None]]
+
+
+# --- information_schema ---
+
+async def _table_exists(cur, table: str) -> bool:
+    await cur.execute("""
+        SELECT 1 FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    return await cur.fetchone() is not None
+
+
+async def _columns(cur, table: str) -> Dict[str, Tuple]:
+    """Колонки таблицы: имя -> (IS_NULLABLE, COLUMN_DEFAULT)"""
+    await cur.execute("""
+        SELECT COLUMN_NAME, IS_NULLABLE, COLUMN_DEFAULT FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (table,))
+    return {row[0]: (row[1], row[2]) for row in await cur.fetchall()}
+
+
+async def _indexes(cur, table: str) -> Dict[str, List[str]]:
+    """Индексы таблицы: имя -> колонки по порядку"""
+    await cur.execute("""
+        SELECT INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,))
+    indexes: Dict[str, List[str]] = {}
+    for name, column in await cur.fetchall():
+        indexes.setdefault(name, []).append(column)
+    return indexes
+
+
+async def _add_column(cur, table: str, column: str, definition: str):
+    if column not in await _columns(cur, table):
+        await cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"[migrations] Added {table}.{column}")
+
+
+async def _add_index(cur, table: str, name: str, columns: Sequence[str], unique: bool = False):
+    """Создать индекс, если нет индекса с тем же именем или с теми же ведущими колонками"""
+    for index_name, index_columns in (await _indexes(cur, table)).items():
+        if index_name == name or index_columns[:len(columns)] == list(columns):
+            return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    await cur.execute(f"ALTER TABLE {table} ADD {kind} {name} ({', '.join(columns)})")
+    logger.info(f"[migrations] Added index {table}.{name} ({', '.join(columns)})")
+
+
+# --- шаги ---
+
+async def _m001_base_tables(cur):
+    """Все таблицы в сведенной схеме (на существующих базах — no-op)"""
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS bot_users (
+            user_id BIGINT NOT NULL PRIMARY KEY,
+            username VARCHAR(255),
+            first_name VARCHAR(255),
+            last_name VARCHAR(255),
+            notifications_enabled BOOLEAN DEFAULT TRUE,
+            marketplace VARCHAR(50) DEFAULT 'portals',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS gifts (
+            id BIGINT NOT NULL AUTO_INCREMENT,
+            name VARCHAR(255) NOT NULL,
+            model VARCHAR(255) NOT NULL DEFAULT '',
+            price FLOAT DEFAULT 0,
+            floor_price FLOAT DEFAULT 0,
+            model_floor_price FLOAT DEFAULT NULL,
+            photo_url TEXT,
+            model_rarity VARCHAR(255),
+            user_id BIGINT NOT NULL,
+            marketplace VARCHAR(50) NOT NULL DEFAULT 'portals',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, name, model, marketplace),
+            UNIQUE INDEX idx_id (id),
+            INDEX idx_name_model (name, model)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id BIGINT NOT NULL PRIMARY KEY,
+            username VARCHAR(255),
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS allowed_users (
+            user_id BIGINT NOT NULL PRIMARY KEY,
+            username VARCHAR(255),
+            first_name VARCHAR(255),
+            added_by BIGINT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_added_by (added_by)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS new_gifts_monitoring (
+            user_id BIGINT NOT NULL PRIMARY KEY,
+            enabled BOOLEAN DEFAULT FALSE,
+            enabled_at TIMESTAMP NULL,
+            last_check_at TIMESTAMP NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_enabled (enabled)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_marketplaces (
+            user_id BIGINT NOT NULL,
+            marketplace VARCHAR(50) NOT NULL,
+            enabled BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, marketplace),
+            INDEX idx_marketplace (marketplace)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    # gift_name = 'ANY' и model = '' — общий фильтр пользователя (старая схема bot.py)
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_price_filters (
+            user_id BIGINT NOT NULL,
+            gift_name VARCHAR(255) NOT NULL DEFAULT 'ANY',
+            model VARCHAR(255) NOT NULL DEFAULT '',
+            min_price FLOAT DEFAULT NULL,
+            max_price FLOAT DEFAULT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, gift_name, model)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+async def _m002_converge_columns(cur):
+    """Колонки, которых нет в одной из двух старых схем"""
+    for column, definition in (
+        ('marketplace', "VARCHAR(50) DEFAULT 'portals'"),
+        ('model_floor_price', "FLOAT DEFAULT NULL"),
+        ('created_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+        ('updated_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+    ):
+        await _add_column(cur, 'gifts', column, definition)
+    # Самая старая схема (init_db.py) — ключ без marketplace
+    if (await _indexes(cur, 'gifts')).get('PRIMARY') == ['user_id', 'name', 'model']:
+        await cur.execute("UPDATE gifts SET marketplace = 'portals' WHERE marketplace IS NULL")
+        await cur.execute("ALTER TABLE gifts MODIFY marketplace VARCHAR(50) NOT NULL DEFAULT 'portals'")
+        await cur.execute("ALTER TABLE gifts DROP PRIMARY KEY, ADD PRIMARY KEY (user_id, name, model, marketplace)")
+        logger.info("[migrations] gifts key now includes marketplace")
+    # id нужен GiftRepository.update_price; в схеме bot.py его нет
+    await _add_column(cur, 'gifts', 'id', "BIGINT NOT NULL AUTO_INCREMENT UNIQUE FIRST")
+
+    for column, definition in (
+        ('notifications_enabled', "BOOLEAN DEFAULT TRUE"),
+        ('marketplace', "VARCHAR(50) DEFAULT 'portals'"),
+        ('created_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+        ('updated_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+    ):
+        await _add_column(cur, 'bot_users', column, definition)
+
+    await _add_column(cur, 'admins', 'username', "VARCHAR(255)")
+    await _add_column(cur, 'admins', 'added_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+    for column, definition in (
+        ('username', "VARCHAR(255)"),
+        ('first_name', "VARCHAR(255)"),
+        ('added_by', "BIGINT"),
+        ('added_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+        ('updated_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+    ):
+        await _add_column(cur, 'allowed_users', column, definition)
+
+    await _add_column(cur, 'new_gifts_monitoring', 'updated_at',
+                      "TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
+    await _add_column(cur, 'user_marketplaces', 'updated_at',
+                      "TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
+
+    # user_price_filters: в bot.py ключ только user_id, в src/bot — (user_id, gift_name, model)
+    columns = await _columns(cur, 'user_price_filters')
+    if 'gift_name' not in columns:
+        await cur.execute("ALTER TABLE user_price_filters ADD COLUMN gift_name VARCHAR(255) NOT NULL DEFAULT 'ANY' AFTER user_id")
+    else:
+        await cur.execute("ALTER TABLE user_price_filters MODIFY gift_name VARCHAR(255) NOT NULL DEFAULT 'ANY'")
+    if 'model' not in columns:
+        await cur.execute("ALTER TABLE user_price_filters ADD COLUMN model VARCHAR(255) NOT NULL DEFAULT '' AFTER gift_name")
+    else:
+        await cur.execute("UPDATE user_price_filters SET model = '' WHERE model IS NULL")
+        await cur.execute("ALTER TABLE user_price_filters MODIFY model VARCHAR(255) NOT NULL DEFAULT ''")
+    await _add_column(cur, 'user_price_filters', 'created_at', "TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+    primary = (await _indexes(cur, 'user_price_filters')).get('PRIMARY', [])
+    if primary != ['user_id', 'gift_name', 'model']:
+        await cur.execute("""
+            ALTER TABLE user_price_filters
+            DROP PRIMARY KEY, ADD PRIMARY KEY (user_id, gift_name, model)
+        """)
+        logger.info("[migrations] user_price_filters key is now (user_id, gift_name, model)")
+
+
+async def _m003_hot_query_indexes(cur):
+    """Индексы под горячие запросы (если их нет ни под каким именем)"""
+    await _add_index(cur, 'gifts', 'idx_user_id', ['user_id'])
+    await _add_index(cur, 'gifts', 'idx_name_model', ['name', 'model'])
+    await _add_index(cur, 'user_price_filters', 'idx_user_gift_model', ['user_id', 'gift_name', 'model'])
+    await _add_index(cur, 'user_marketplaces', 'idx_user_id', ['user_id'])
+    await _add_index(cur, 'user_marketplaces', 'idx_marketplace_enabled', ['marketplace', 'enabled'])
+    await _add_index(cur, 'new_gifts_monitoring', 'idx_enabled', ['enabled'])
+
+
+async def _m004_notified_gifts(cur):
+    """notified_gifts с ключом (user_id, marketplace, gift_id) — см. notification_dedup"""
+    from notification_dedup import migrate_notified_gifts
+    await migrate_notified_gifts(cur)
+
+
+GIFT_KEY = ['user_id', 'name', 'model', 'marketplace']
+
+
+async def _m005_gifts_key_and_foreign_keys(cur):
+    """
+    Базы DatabaseService.init_schema: gifts с PRIMARY KEY (id) без уникального
+    (user_id, name, model, marketplace) и внешние ключи на bot_users, которых
+    нет в схеме bot.py (он пишет пользователей без строки в bot_users).
+    """
+    await cur.execute("""
+        SELECT TABLE_NAME, CONSTRAINT_NAME FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME = 'bot_users'
+    """)
+    for table, constraint in await cur.fetchall():
+        await cur.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {constraint}")
+        logger.info(f"[migrations] Dropped foreign key {table}.{constraint}")
+
+    primary = (await _indexes(cur, 'gifts')).get('PRIMARY', [])
+    if primary == GIFT_KEY:
+        return
+    await cur.execute("UPDATE gifts SET model = '' WHERE model IS NULL")
+    await cur.execute("UPDATE gifts SET marketplace = 'portals' WHERE marketplace IS NULL")
+    # Дубликаты: оставляем самую новую строку (последние цены)
+    await cur.execute("""
+        DELETE g1 FROM gifts g1
+        JOIN gifts g2 ON g1.user_id = g2.user_id AND g1.name = g2.name
+            AND g1.model = g2.model AND g1.marketplace = g2.marketplace AND g1.id < g2.id
+    """)
+    if cur.rowcount:
+        logger.info(f"[migrations] Removed {cur.rowcount} duplicate gifts rows")
+    await cur.execute("""
+        ALTER TABLE gifts
+        MODIFY model VARCHAR(255) NOT NULL DEFAULT '',
+        MODIFY marketplace VARCHAR(50) NOT NULL DEFAULT 'portals'
+    """)
+    if primary == ['id']:
+        await cur.execute("""
+            ALTER TABLE gifts
+            MODIFY id BIGINT NOT NULL AUTO_INCREMENT,
+            DROP PRIMARY KEY,
+            ADD PRIMARY KEY (user_id, name, model, marketplace),
+            ADD UNIQUE INDEX idx_id (id)
+        """)
+        logger.info("[migrations] gifts key is now (user_id, name, model, marketplace)")
+    else:
+        await _add_index(cur, 'gifts', 'uq_user_gift', GIFT_KEY, unique=True)
+
+
+async def _m006_telegram_file_ids(cur):
+    """telegram_file_ids для file_id картинок — см. telegram_sender"""
+    from telegram_sender import migrate_telegram_file_ids
+    await migrate_telegram_file_ids(cur)
+
+
+MIGRATIONS: List[Tuple[int, str, Step]] = [
+    (1, 'base_tables', _m001_base_tables),
+    (2, 'converge_columns', _m002_converge_columns),
+    (3, 'hot_query_indexes', _m003_hot_query_indexes),
+    (4, 'notified_gifts_per_user', _m004_notified_gifts),
+    (5, 'gifts_key_and_foreign_keys', _m005_gifts_key_and_foreign_keys),
+    (6, 'telegram_file_ids', _m006_telegram_file_ids),
+]
+
+
+async def _applied_versions(cur) -> Set[int]:
+    if not await _table_exists(cur, 'schema_migrations'):
+        return set()
+    await cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in await cur.fetchall()}
+
+
+async def run_migrations(pool, migrations: Optional[List[Tuple[int, str, Step]]] = None) -> int:
+    """Применить недостающие миграции; возвращает число примененных"""
+    migrations = migrations or MIGRATIONS
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            applied = await _applied_versions(cur)
+            if all(version in applied for version, _, _ in migrations):
+                logger.info(f"[migrations] Schema is up to date (version {max(applied)})")
+                return 0
+
+            await cur.execute("SELECT GET_LOCK(%s, %s)", (MIGRATIONS_LOCK, MIGRATIONS_LOCK_TIMEOUT))
+            row = await cur.fetchone()
+            if not row or row[0] != 1:
+                raise RuntimeError("Could not acquire schema migrations lock")
+            count = 0
+            try:
+                await cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INT NOT NULL PRIMARY KEY,
+                        name VARCHAR(100) NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                # Другая реплика могла успеть, пока мы ждали блокировку
+                applied = await _applied_versions(cur)
+                for version, name, step in sorted(migrations, key=lambda m: m[0]):
+                    if version in applied:
+                        continue
+                    logger.info(f"[migrations] Applying {version:03d}_{name}")
+                    await step(cur)
+                    await cur.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name)
+                    )
+                    await conn.commit()
+                    count += 1
+            finally:
+                await cur.execute("SELECT RELEASE_LOCK(%s)", (MIGRATIONS_LOCK,))
+                await cur.fetchone()
+            logger.info(f"[migrations] Applied {count} migration(s)")
+            return count
@@ -4,11 +4,25 @@
 Авторизация: Authorization: Bearer <API_KEY>
 """
 
+import asyncio
+import heapq
+import json
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import List, Dict, Optional
 import requests
 
+try:
+    from marketplace_http import get_client
+except ImportError:
+    get_client = None
+
+from rate_limiter import get_limiter
+
 logger = logging.getLogger(__name__)
 
 GETGEMS_BASE_URL = 'https://api.getgems.io/public-api'
@@ -29,55 +43,105 @@ def _headers(api_key: Optional[str] = None) -> Dict[str, str]:
     }
 
 
+def _items_from_response(data: Dict) -> List[Dict]:
+    if not data.get('success'):
+        logger.warning('GetGems API success=false')
+        return []
+    r = data.get('response') or {}
+    raw_items = r.get('items') or []
+    return [it for it in raw_items if isinstance(it, dict)]
+
+
+def _nft_from_response(data: Dict) -> Optional[Dict]:
+    if not data.get('success'):
+        return None
+    r = data.get('response')
+    return r if isinstance(r, dict) else None
+
+
 def _fetch_on_sale_items(fetch_limit: int, api_key: Optional[str]) -> List[Dict]:
+    limiter = get_limiter('getgems', 'search')
+    limiter.acquire_sync()
     resp = requests.get(
         GETGEMS_GIFTS_URL,
         headers=_headers(api_key),
         params={'limit': fetch_limit},
         timeout=30,
     )
+    limiter.note_response(resp.status_code, resp.headers)
     resp.raise_for_status()
-    data = resp.json()
-    if not data.get('success'):
-        logger.warning('GetGems API success=false')
-        return []
-    r = data.get('response') or {}
-    raw_items = r.get('items') or []
-    return [it for it in raw_items if isinstance(it, dict)]
+    return _items_from_response(resp.json())
 
 
 def _fetch_nft_details(nft_address: str, api_key: Optional[str]) -> Optional[Dict]:
     if not nft_address:
         return None
     url = GETGEMS_NFT_URL_TEMPLATE.format(nftAddress=nft_address)
+    limiter = get_limiter('getgems', 'search')
+    limiter.acquire_sync()
     resp = requests.get(
         url,
         headers=_headers(api_key),
         timeout=30,
     )
+    limiter.note_response(resp.status_code, resp.headers)
     resp.raise_for_status()
-    data = resp.json()
-    if not data.get('success'):
-        return None
-    r = data.get('response')
-    return r if isinstance(r, dict) else None
+    return _nft_from_response(resp.json())
 
 
 def _fetch_history_items(fetch_limit: int, types: str, api_key: Optional[str]) -> List[Dict]:
+    limiter = get_limiter('getgems', 'history')
+    limiter.acquire_sync()
     resp = requests.get(
         GETGEMS_GIFTS_HISTORY_URL,
         headers=_headers(api_key),
         params={'limit': fetch_limit, 'types': types},
         timeout=30,
     )
+    limiter.note_response(resp.status_code, resp.headers)
     resp.raise_for_status()
-    data = resp.json()
-    if not data.get('success'):
-        logger.warning('GetGems API success=false')
-        return []
-    r = data.get('response') or {}
-    raw_items = r.get('items') or []
-    return [it for it in raw_items if isinstance(it, dict)]
+    return _items_from_response(resp.json())
+
+
+async def _fetch_on_sale_items_async(fetch_limit: int, api_key: Optional[str]) -> List[Dict]:
+    """Корутинная версия _fetch_on_sale_items через общий пул соединений"""
+    if get_client is None:
+        return await asyncio.to_thread(_fetch_on_sale_items, fetch_limit, api_key)
+    resp = await get_client('getgems').get(
+        GETGEMS_GIFTS_URL,
+        headers=_headers(api_key),
+        params={'limit': fetch_limit},
+    )
+    resp.raise_for_status()
+    return _items_from_response(resp.json())
+
+
+async def _fetch_nft_details_async(nft_address: str, api_key: Optional[str]) -> Optional[Dict]:
+    """Корутинная версия _fetch_nft_details"""
+    if not nft_address:
+        return None
+    if get_client is None:
+        return await asyncio.to_thread(_fetch_nft_details, nft_address, api_key)
+    resp = await get_client('getgems').get(
+        GETGEMS_NFT_URL_TEMPLATE.format(nftAddress=nft_address),
+        headers=_headers(api_key),
+    )
+    resp.raise_for_status()
+    return _nft_from_response(resp.json())
+
+
+async def _fetch_history_items_async(fetch_limit: int, types: str, api_key: Optional[str]) -> List[Dict]:
+    """Корутинная версия _fetch_history_items"""
+    if get_client is None:
+        return await asyncio.to_thread(_fetch_history_items, fetch_limit, types, api_key)
+    resp = await get_client('getgems').get(
+        GETGEMS_GIFTS_HISTORY_URL,
+        headers=_headers(api_key),
+        params={'limit': fetch_limit, 'types': types},
+        rate_class='history',
+    )
+    resp.raise_for_status()
+    return _items_from_response(resp.json())
 
 
 def _parse_gift_item(item: Dict) -> Dict:
@@ -168,6 +232,442 @@ def _parse_history_item(event: Dict) -> Optional[Dict]:
     }
 
 
+def _matches(parsed: Dict, gift_name: Optional[str], model: Optional[str]) -> bool:
+    if gift_name and (gift_name.lower() not in (parsed.get('name') or '').lower()):
+        return False
+    if model and (model.lower() not in (parsed.get('model') or '').lower()):
+        return False
+    return True
+
+
+def _history_addresses(history_items: List[Dict]) -> tuple[List[str], Dict[str, Dict]]:
+    """Уникальные адреса из history (в порядке появления) и их базовый парсинг"""
+    history_addresses: List[str] = []
+    history_parsed_by_address: Dict[str, Dict] = {}
+    for it in history_items:
+        parsed = _parse_history_item(it)
+        if not parsed:
+            continue
+        addr = parsed.get('gift_id')
+        if not addr:
+            continue
+        if addr not in history_parsed_by_address:
+            history_addresses.append(addr)
+            history_parsed_by_address[addr] = parsed
+    return history_addresses, history_parsed_by_address
+
+
+def _filter_on_sale(raw_items: List[Dict], gift_name: Optional[str], model: Optional[str], limit: int) -> List[Dict]:
+    items_out: List[Dict] = []
+    for it in raw_items:
+        parsed = _parse_gift_item(it)
+        if not parsed or not _matches(parsed, gift_name, model):
+            continue
+        items_out.append(parsed)
+        if len(items_out) >= limit:
+            break
+    return items_out
+
+
+def _sort_by_price(items_out: List[Dict], sort: str, limit: int) -> List[Dict]:
+    # Сортировка по цене на нашей стороне
+    def _price(x: Dict) -> float:
+        p = x.get('price')
+        return float(p) if p is not None else float('inf')
+
+    if sort == 'price_desc':
+        items_out.sort(key=_price, reverse=True)
+    else:
+        items_out.sort(key=_price)
+
+    return items_out[:limit]
+
+
+# Сколько деталей NFT грузить одновременно (сверху все равно ограничивает лимитер getgems)
+GETGEMS_DETAILS_CONCURRENCY = int(os.getenv('GETGEMS_DETAILS_CONCURRENCY', '8'))
+# Файл кеша неизменяемых атрибутов NFT по адресу
+GETGEMS_NFT_CACHE_FILE = Path(os.getenv(
+    'GETGEMS_NFT_CACHE_FILE', str(Path(__file__).parent / 'data' / 'getgems_nft_cache.json')
+))
+GETGEMS_NFT_CACHE_MAX = int(os.getenv('GETGEMS_NFT_CACHE_MAX', '20000'))
+# Не чаще раза в N секунд сбрасываем кеш на диск
+GETGEMS_NFT_CACHE_SAVE_INTERVAL = 30.0
+
+# Поля _parse_gift_item, которые не меняются для адреса (цена и флор — меняются)
+_STATIC_FIELDS = ('name', 'model', 'backdrop', 'gift_number', 'gift_id', 'photo_url', 'collection_address', 'attributes')
+
+
+class _NftDetailsCache:
+    """Разобранные атрибуты NFT по адресу: в памяти и в JSON-файле между перезапусками"""
+
+    def __init__(self, path: Path, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._items: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._dirty = False
+        self._saved_at = 0.0
+
+    def load(self):
+        """Прочитать файл (один раз); корутины зовут через asyncio.to_thread"""
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            if self.path.exists():
+                data = json.loads(self.path.read_text(encoding='utf-8'))
+                if isinstance(data, dict):
+                    self._items = {k: v for k, v in data.items() if isinstance(v, dict)}
+                    logger.info(f'GetGems: loaded {len(self._items)} cached NFT details')
+        except Exception as e:
+            logger.warning(f'GetGems: failed to load NFT cache {self.path}: {e}')
+
+    def get(self, address: str) -> Optional[Dict]:
+        with self._lock:
+            self._load()
+            return self._items.get(address)
+
+    def put(self, address: str, parsed: Dict):
+        with self._lock:
+            self._load()
+            self._items[address] = {k: parsed.get(k) for k in _STATIC_FIELDS}
+            while len(self._items) > self.max_entries:
+                del self._items[next(iter(self._items))]
+            self._dirty = True
+
+    def _take_snapshot(self, force: bool) -> Optional[Dict[str, Dict]]:
+        """Копия для записи, если пора сохранять (иначе None)"""
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._saved_at < GETGEMS_NFT_CACHE_SAVE_INTERVAL):
+                return None
+            self._dirty = False
+            self._saved_at = time.monotonic()
+            return dict(self._items)
+
+    def save(self, force: bool = False):
+        snapshot = self._take_snapshot(force)
+        if snapshot is not None:
+            self._write(snapshot)
+
+    async def save_async(self, force: bool = False):
+        """save() без блокировки цикла: запись до 20k записей идет в потоке"""
+        snapshot = self._take_snapshot(force)
+        if snapshot is not None:
+            await asyncio.to_thread(self._write, snapshot)
+
+    def _write(self, snapshot: Dict[str, Dict]):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            tmp_path.write_text(json.dumps(snapshot, ensure_ascii=False), encoding='utf-8')
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f'GetGems: failed to save NFT cache {self.path}: {e}')
+
+
+_nft_cache = _NftDetailsCache(GETGEMS_NFT_CACHE_FILE, GETGEMS_NFT_CACHE_MAX)
+
+
+def _with_history_price(static: Dict, history_parsed: Optional[Dict]) -> Dict:
+    """Атрибуты из кеша + цена из события выставления на продажу"""
+    parsed = dict(static)
+    parsed['price'] = history_parsed.get('price') if history_parsed else None
+    parsed['floor_price'] = None
+    parsed['model_rarity'] = None
+    return parsed
+
+
+def _latest_candidates(history_items: List[Dict], gift_name: Optional[str]) -> tuple[List[str], Dict[str, Dict]]:
+    """Адреса из history; по коллекции отсеиваем сразу, модель есть только в деталях"""
+    addresses, parsed_by_address = _history_addresses(history_items)
+    if gift_name:
+        addresses = [a for a in addresses if _matches(parsed_by_address[a], gift_name, None)]
+    return addresses, parsed_by_address
+
+
+def _collect_latest(
+    addresses: List[str],
+    parsed_by_address: Dict[str, Dict],
+    details: Dict[str, Optional[Dict]],
+    gift_name: Optional[str],
+    model: Optional[str],
+    limit: int,
+    items_out: List[Dict],
+) -> bool:
+    """Добавить подходящие листинги по порядку; True — набрали limit"""
+    for addr in addresses:
+        static = _nft_cache.get(addr)
+        if static is not None:
+            parsed = _with_history_price(static, parsed_by_address.get(addr))
+        elif details.get(addr):
+            parsed = _parse_gift_item(details[addr])
+            if parsed.get('price') is None:
+                parsed['price'] = (parsed_by_address.get(addr) or {}).get('price')
+        else:
+            # Если детали не удалось получить, хотя бы вернем базовую инфу из history
+            parsed = parsed_by_address.get(addr)
+        if not parsed or not _matches(parsed, gift_name, model):
+            continue
+        items_out.append(parsed)
+        if len(items_out) >= limit:
+            return True
+    return False
+
+
+def _put_details(details: Dict[str, Optional[Dict]]):
+    for addr, raw in details.items():
+        if raw:
+            _nft_cache.put(addr, _parse_gift_item(raw))
+
+
+def _remember_details(details: Dict[str, Optional[Dict]]):
+    _put_details(details)
+    _nft_cache.save()
+
+
+def _search_latest(gift_name: Optional[str], model: Optional[str], limit: int, fetch_limit: int, key: str) -> List[Dict]:
+    """Новые листинги: один запрос history + детали только для адресов не из кеша"""
+    history_items = _fetch_history_items(fetch_limit=fetch_limit, types='putUpForSale', api_key=key)
+    addresses, parsed_by_address = _latest_candidates(history_items, gift_name)
+    items_out: List[Dict] = []
+    step = max(1, GETGEMS_DETAILS_CONCURRENCY)
+
+    def _details(addr: str) -> Optional[Dict]:
+        try:
+            return _fetch_nft_details(addr, api_key=key)
+        except Exception as e:
+            logger.warning(f'GetGems: failed to fetch nft details {addr}: {e}')
+            return None
+
+    with ThreadPoolExecutor(max_workers=step) as pool:
+        for start in range(0, len(addresses), step):
+            batch = addresses[start:start + step]
+            misses = [a for a in batch if _nft_cache.get(a) is None]
+            details = dict(zip(misses, pool.map(_details, misses)))
+            _remember_details(details)
+            if _collect_latest(batch, parsed_by_address, details, gift_name, model, limit, items_out):
+                break
+    return items_out
+
+
+async def _search_latest_async(gift_name: Optional[str], model: Optional[str], limit: int, fetch_limit: int, key: str) -> List[Dict]:
+    """Корутинная версия _search_latest"""
+    # Файл кеша читаем в потоке, дальше get/put работают только с памятью
+    await asyncio.to_thread(_nft_cache.load)
+    history_items = await _fetch_history_items_async(fetch_limit=fetch_limit, types='putUpForSale', api_key=key)
+    addresses, parsed_by_address = _latest_candidates(history_items, gift_name)
+    items_out: List[Dict] = []
+    step = max(1, GETGEMS_DETAILS_CONCURRENCY)
+
+    async def _details(addr: str) -> Optional[Dict]:
+        try:
+            return await _fetch_nft_details_async(addr, api_key=key)
+        except Exception as e:
+            logger.warning(f'GetGems: failed to fetch nft details {addr}: {e}')
+            return None
+
+    for start in range(0, len(addresses), step):
+        batch = addresses[start:start + step]
+        misses = [a for a in batch if _nft_cache.get(a) is None]
+        details = dict(zip(misses, await asyncio.gather(*[_details(a) for a in misses])))
+        _put_details(details)
+        await _nft_cache.save_async()
+        if _collect_latest(batch, parsed_by_address, details, gift_name, model, limit, items_out):
+            break
+    return items_out
+
+
+# Как часто перестраивать индекс лотов на продаже (секунды)
+GETGEMS_INDEX_REFRESH = float(os.getenv('GETGEMS_INDEX_REFRESH', '120'))
+# Ограничение на число страниц по 100 лотов за одно построение
+GETGEMS_INDEX_MAX_PAGES = int(os.getenv('GETGEMS_INDEX_MAX_PAGES', '50'))
+GETGEMS_INDEX_RETRY = 15.0
+
+
+def _fetch_on_sale_page(cursor: Optional[str], api_key: Optional[str]) -> tuple[List[Dict], Optional[str]]:
+    """Одна страница on-sale/gifts и курсор следующей"""
+    params = {'limit': 100}
+    if cursor:
+        params['cursor'] = cursor
+    limiter = get_limiter('getgems', 'search')
+    limiter.acquire_sync()
+    resp = requests.get(
+        GETGEMS_GIFTS_URL,
+        headers=_headers(api_key),
+        params=params,
+        timeout=30,
+    )
+    limiter.note_response(resp.status_code, resp.headers)
+    resp.raise_for_status()
+    data = resp.json()
+    next_cursor = (data.get('response') or {}).get('cursor') if isinstance(data, dict) else None
+    return _items_from_response(data), next_cursor
+
+
+def _index_key(value: Optional[str]) -> str:
+    return (value or '').strip().lower()
+
+
+class GetGemsMarketIndex:
+    """
+    Лоты GetGems на продаже в памяти: адрес -> лот и min-heap цен по коллекции
+    и по (коллекция, модель). Удаленные/переоцененные лоты выкидываются из куч
+    лениво при чтении вершины.
+    """
+
+    def __init__(self):
+        self.by_address: Dict[str, Dict] = {}
+        self._collections: Dict[str, List[tuple]] = {}
+        self._models: Dict[tuple, List[tuple]] = {}
+        self._lock = threading.Lock()
+        self.built_at = 0.0
+
+    @classmethod
+    def build(cls, parsed_items: List[Dict]) -> 'GetGemsMarketIndex':
+        index = cls()
+        for parsed in parsed_items:
+            index._add(parsed)
+        for heap in index._collections.values():
+            heapq.heapify(heap)
+        for heap in index._models.values():
+            heapq.heapify(heap)
+        index.built_at = time.monotonic()
+        return index
+
+    def _add(self, parsed: Dict, push: bool = False):
+        address = parsed.get('gift_id')
+        price = parsed.get('price')
+        if not address or price is None:
+            return
+        self.by_address[address] = parsed
+        entry = (float(price), address)
+        collection = _index_key(parsed.get('name'))
+        model = _index_key(parsed.get('model'))
+        targets = [self._collections.setdefault(collection, [])]
+        if model and model != 'n/a':
+            targets.append(self._models.setdefault((collection, model), []))
+        for heap in targets:
+            if push:
+                heapq.heappush(heap, entry)
+            else:
+                heap.append(entry)
+
+    def upsert(self, parsed: Dict):
+        """Новый или переоцененный лот (например, из search_getgems(sort='latest'))"""
+        with self._lock:
+            self._add(parsed, push=True)
+
+    def remove(self, address: str):
+        """Лот продан или снят с продажи"""
+        with self._lock:
+            self.by_address.pop(address, None)
+
+    def _peek(self, heap: Optional[List[tuple]]) -> Optional[float]:
+        while heap:
+            price, address = heap[0]
+            current = self.by_address.get(address)
+            if current is not None and current.get('price') is not None and float(current['price']) == price:
+                return price
+            heapq.heappop(heap)
+        return None
+
+    def _collection_keys(self, gift_name: str) -> List[str]:
+        key = _index_key(gift_name)
+        if key in self._collections:
+            return [key]
+        # Как в _matches: название коллекции может быть подстрокой
+        return [c for c in self._collections if key in c]
+
+    def floor(self, gift_name: str, model: Optional[str] = None) -> Optional[float]:
+        with self._lock:
+            floors = []
+            model_key = _index_key(model)
+            for collection in self._collection_keys(gift_name):
+                if model_key:
+                    if (collection, model_key) in self._models:
+                        heap_keys = [(collection, model_key)]
+                    else:
+                        heap_keys = [k for k in self._models if k[0] == collection and model_key in k[1]]
+                    floors.extend(self._peek(self._models.get(k)) for k in heap_keys)
+                else:
+                    floors.append(self._peek(self._collections.get(collection)))
+            floors = [f for f in floors if f is not None]
+            return min(floors) if floors else None
+
+    def get(self, address: str) -> Optional[Dict]:
+        return self.by_address.get(address)
+
+
+_market_index: Optional[GetGemsMarketIndex] = None
+_market_index_next_refresh = 0.0
+_market_index_lock = threading.Lock()
+
+
+def _build_market_index(api_key: Optional[str]) -> Optional[GetGemsMarketIndex]:
+    """Пройти все страницы on-sale и построить индекс"""
+    parsed_items: List[Dict] = []
+    cursor = None
+    for _ in range(GETGEMS_INDEX_MAX_PAGES):
+        items, cursor = _fetch_on_sale_page(cursor, api_key)
+        for it in items:
+            parsed = _parse_gift_item(it)
+            parsed_items.append(parsed)
+            if parsed.get('gift_id'):
+                _nft_cache.put(parsed['gift_id'], parsed)
+        if not cursor or not items:
+            break
+    _nft_cache.save()
+    index = GetGemsMarketIndex.build(parsed_items)
+    logger.info(f'GetGems: market index built, {len(index.by_address)} items on sale')
+    return index
+
+
+def _refresh_market_index(api_key: Optional[str]):
+    global _market_index, _market_index_next_refresh
+    try:
+        _market_index = _build_market_index(api_key)
+        _market_index_next_refresh = time.monotonic() + GETGEMS_INDEX_REFRESH
+    except Exception as e:
+        logger.warning(f'GetGems: failed to build market index: {e}')
+        _market_index_next_refresh = time.monotonic() + GETGEMS_INDEX_RETRY
+
+
+def _refresh_market_index_background(api_key: Optional[str]):
+    try:
+        _refresh_market_index(api_key)
+    finally:
+        _market_index_lock.release()
+
+
+def _index_listings(items: List[Dict]):
+    """Свежие листинги сразу попадают в индекс, не дожидаясь перестроения"""
+    if _market_index is None:
+        return
+    for parsed in items:
+        if parsed.get('gift_id') and parsed.get('price') is not None:
+            _market_index.upsert(parsed)
+
+
+def get_market_index(api_key: Optional[str] = None) -> Optional[GetGemsMarketIndex]:
+    """
+    Индекс лотов на продаже. Строится и перестраивается в фоне (обход всех
+    страниц занимает время); пока индекса нет — None, вызывающий идет в search.
+    """
+    key = api_key or os.getenv('GETGEMS_API_KEY') or GETGEMS_API_KEY
+    if not key:
+        return None
+    if _market_index is not None and time.monotonic() < _market_index_next_refresh:
+        return _market_index
+    if time.monotonic() >= _market_index_next_refresh and _market_index_lock.acquire(blocking=False):
+        threading.Thread(target=_refresh_market_index_background, args=(key,), daemon=True).start()
+    return _market_index
+
+
 def search_getgems(
     gift_name: Optional[str] = None,
     model: Optional[str] = None,
@@ -198,67 +698,13 @@ def search_getgems(
 
     try:
         if sort == 'latest':
-            # Get newest listings via history, then enrich with on-sale items to get attributes/images.
-            history_items = _fetch_history_items(fetch_limit=fetch_limit, types='putUpForSale', api_key=key)
-            history_addresses: List[str] = []
-            history_parsed_by_address: Dict[str, Dict] = {}
-
-            for it in history_items:
-                parsed = _parse_history_item(it)
-                if not parsed:
-                    continue
-                addr = parsed.get('gift_id')
-                if not addr:
-                    continue
-                if addr not in history_parsed_by_address:
-                    history_addresses.append(addr)
-                    history_parsed_by_address[addr] = parsed
-
-            for addr in history_addresses:
-                raw = None
-                try:
-                    raw = _fetch_nft_details(addr, api_key=key)
-                except Exception as e:
-                    logger.warning(f'GetGems: failed to fetch nft details {addr}: {e}')
-
-                # Если детали не удалось получить, хотя бы вернем базовую инфу из history
-                parsed = _parse_gift_item(raw) if raw else history_parsed_by_address.get(addr)
-                if not parsed:
-                    continue
-                if gift_name and (gift_name.lower() not in (parsed.get('name') or '').lower()):
-                    continue
-                if model and (model.lower() not in (parsed.get('model') or '').lower()):
-                    continue
-                items_out.append(parsed)
-                if len(items_out) >= limit:
-                    break
+            # Get newest listings via history, then enrich with cached/fetched NFT details.
+            items_out = _search_latest(gift_name, model, limit, fetch_limit, key)
+            _index_listings(items_out)
         else:
             raw_items = _fetch_on_sale_items(fetch_limit=fetch_limit, api_key=key)
+            items_out = _sort_by_price(_filter_on_sale(raw_items, gift_name, model, limit), sort, limit)
 
-            for it in raw_items:
-                parsed = _parse_gift_item(it)
-                if not parsed:
-                    continue
-                if gift_name and (gift_name.lower() not in (parsed.get('name') or '').lower()):
-                    continue
-                if model and (model.lower() not in (parsed.get('model') or '').lower()):
-                    continue
-                items_out.append(parsed)
-                if len(items_out) >= limit:
-                    break
-
-        if sort != 'latest':
-            # Сортировка по цене на нашей стороне
-            def _price(x: Dict) -> float:
-                p = x.get('price')
-                return float(p) if p is not None else float('inf')
-
-            if sort == 'price_desc':
-                items_out.sort(key=_price, reverse=True)
-            else:
-                items_out.sort(key=_price)
-
-            items_out = items_out[:limit]
         logger.info(f'GetGems: fetched {len(items_out)} gifts on sale')
         return items_out
 
@@ -274,9 +720,46 @@ def search_getgems(
         return []
 
 
+async def search_getgems_async(
+    gift_name: Optional[str] = None,
+    model: Optional[str] = None,
+    limit: int = 20,
+    sort: str = "price_asc",
+    api_key: Optional[str] = None,
+) -> List[Dict]:
+    """Корутинная версия search_getgems через общий пул соединений"""
+    key = api_key or os.getenv('GETGEMS_API_KEY') or GETGEMS_API_KEY
+    if not key:
+        logger.warning('GetGems: API key is missing (set GETGEMS_API_KEY env var)')
+        return []
+    items_out: List[Dict] = []
+    fetch_limit = min(max(limit, 1), 100)
+
+    try:
+        if sort == 'latest':
+            items_out = await _search_latest_async(gift_name, model, limit, fetch_limit, key)
+            _index_listings(items_out)
+        else:
+            raw_items = await _fetch_on_sale_items_async(fetch_limit=fetch_limit, api_key=key)
+            items_out = _sort_by_price(_filter_on_sale(raw_items, gift_name, model, limit), sort, limit)
+
+        logger.info(f'GetGems: fetched {len(items_out)} gifts on sale')
+        return items_out
+
+    except ValueError as e:
+        logger.warning(f'GetGems: {e}')
+        return []
+    except Exception as e:
+        logger.error(f'GetGems search error: {e}', exc_info=True)
+        return []
+
+
 def get_getgems_gift_floor_price(gift_name: str, api_key: Optional[str] = None) -> Optional[float]:
     """Флор коллекции (минимальная цена среди на продаже)."""
     try:
+        index = get_market_index(api_key)
+        if index is not None:
+            return index.floor(gift_name)
         items = search_getgems(gift_name=gift_name, limit=1, sort='price_asc', api_key=api_key)
         if items and items[0].get('price') is not None:
             return float(items[0]['price'])
@@ -289,6 +772,9 @@ def get_getgems_gift_floor_price(gift_name: str, api_key: Optional[str] = None)
 def get_getgems_model_floor_price(gift_name: str, model: str, api_key: Optional[str] = None) -> Optional[float]:
     """Флор модели (минимальная цена среди на продаже)."""
     try:
+        index = get_market_index(api_key)
+        if index is not None:
+            return index.floor(gift_name, model)
         items = search_getgems(gift_name=gift_name, model=model, limit=1, sort='price_asc', api_key=api_key)
         if items and items[0].get('price') is not None:
             return float(items[0]['price'])
@@ -314,9 +800,12 @@ def get_getgems_gift_by_id(gift_id: str, api_key: Optional[str] = None) -> Optio
     """
     Получить подарок по address.
     Эндпоинт on-sale/gifts отдает только лоты на продаже; по одному item отдельного
-    API может не быть. Ищем в search и возвращаем совпадение по address, иначе None.
+    API может не быть. Ищем в индексе лотов (или в search) и возвращаем совпадение по address, иначе None.
     """
     try:
+        index = get_market_index(api_key)
+        if index is not None:
+            return index.get(gift_id)
         items = search_getgems(limit=200, api_key=api_key)
         for it in items:
             if it.get('gift_id') == gift_id:
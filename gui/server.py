@@ -51,6 +51,11 @@ except ImportError:
         get_model_floor_price = None
         get_gift_floor_price = None
 
+try:
+    from portalsmp import get_floors as get_portals_floors
+except ImportError:
+    get_portals_floors = None
+
 try:
     from tonnelmp_wrapper import search_tonnel
 except ImportError:
@@ -83,6 +88,13 @@ except ImportError:
     get_getgems_model_floor_price = None
     get_getgems_gift_floor_price = None
 
+try:
+    import rate_limiter
+    # Синхронные обертки ждут лимитер через eventlet.sleep, а не блокируют hub
+    rate_limiter.set_sync_sleep(eventlet.sleep)
+except ImportError:
+    rate_limiter = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -116,9 +128,18 @@ def handle_preflight():
             'Access-Control-Allow-Headers': 'Content-Type',
         })
 
+# Увиденные листинги с сохранением между рестартами
+try:
+    from seen_store import get_seen_store, save_all as save_seen_ids
+except ImportError:
+    get_seen_store = None
+    save_seen_ids = None
+
 # Глобальное состояние
 monitoring_enabled = False
-seen_gift_ids: Set[str] = set()
+seen_gift_ids: Set[str] = get_seen_store('gui', 'all', max_size=10000) if get_seen_store else set()
+# Снимок с диска свежий: первое включение после старта обходится без baseline
+seen_restored = bool(getattr(seen_gift_ids, 'warm', False))
 # Недавние подарки для fallback-поллинга
 recent_gifts: List[Dict] = []
 MAX_RECENT_GIFTS = 200
@@ -429,7 +450,11 @@ def _build_portals_catalog(max_pages: int = 200, limit: int = 30):
             "&sort_by=listed_at+desc&status=listed&exclude_bundled=true&premarket_status=all"
         )
         try:
+            if rate_limiter:
+                rate_limiter.get_limiter('portals', 'search').acquire_sync()
             resp = requests.get(url, headers=_portals_headers(PORTALS_AUTH), timeout=30)
+            if rate_limiter:
+                rate_limiter.get_limiter('portals', 'search').note_response(resp.status_code, resp.headers)
             resp.raise_for_status()
             data = resp.json()
             items = []
@@ -477,7 +502,11 @@ def _build_tonnel_catalog(max_pages: int = 200, limit: int = 30):
                 "price_range": None,
                 "user_auth": TONNEL_AUTH or "",
             }
+            if rate_limiter:
+                rate_limiter.get_limiter('tonnel', 'search').acquire_sync()
             resp = requests.post(url, headers=headers, json=json_data, timeout=30)
+            if rate_limiter:
+                rate_limiter.get_limiter('tonnel', 'search').note_response(resp.status_code, resp.headers)
             resp.raise_for_status()
             data = resp.json()
             items = []
@@ -543,6 +572,9 @@ def _run_async(coro):
 def _get_portals_floors(name: str, model: str):
     if not name or not PORTALS_AUTH:
         return None, None
+    if get_portals_floors:
+        # Общий снимок filterFloors коллекции (TTL + фоновое обновление в portalsmp)
+        return get_portals_floors(name, model, PORTALS_AUTH)
     gift_key = f"portals:{name.lower()}"
     model_key = f"portals:{name.lower()}:{model.lower()}" if model else None
 
@@ -799,6 +831,8 @@ def fetch_marketplace(marketplace: str) -> List[Dict]:
                         search_kwargs['model'] = models
                     
                     if inspect.iscoroutinefunction(portals_search):
+                        if rate_limiter:
+                            rate_limiter.get_limiter('portals', 'search').acquire_sync()
                         loop = asyncio.new_event_loop()
                         asyncio.set_event_loop(loop)
                         result = loop.run_until_complete(portals_search(**search_kwargs))
@@ -980,8 +1014,10 @@ def monitoring_loop():
             if not baseline_done:
                 baseline_done = True
             
-            # Ограничиваем размер seen_gift_ids
-            if len(seen_gift_ids) > 10000:
+            # Ограничиваем размер seen_gift_ids (SeenIdStore вытесняет старые id сам и сохраняется на диск)
+            if save_seen_ids:
+                save_seen_ids()
+            elif len(seen_gift_ids) > 10000:
                 seen_gift_ids = set(list(seen_gift_ids)[-5000:])
             
             # Ждем перед следующей проверкой
@@ -1106,7 +1142,7 @@ def get_gift_details():
 @app.route('/api/toggle', methods=['POST'])
 def toggle_monitoring():
     """Включить/выключить мониторинг"""
-    global monitoring_enabled, baseline_done, seen_gift_ids
+    global monitoring_enabled, baseline_done, seen_gift_ids, seen_restored
     
     data = request.get_json()
     enabled = data.get('enabled', False)
@@ -1114,8 +1150,13 @@ def toggle_monitoring():
     if enabled and not monitoring_enabled:
         # Запускаем мониторинг через eventlet background task
         monitoring_enabled = True
-        seen_gift_ids.clear()
-        baseline_done = False  # первый проход после включения только снимет baseline
+        if seen_restored:
+            # Только первое включение после загрузки с диска; после паузы — заново baseline
+            seen_restored = False
+            baseline_done = True
+        else:
+            seen_gift_ids.clear()
+            baseline_done = False  # первый проход после включения только снимет baseline
         socketio.start_background_task(monitoring_loop)
         logger.info("Monitoring enabled")
     elif not enabled and monitoring_enabled:
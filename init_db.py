@@ -18,6 +18,7 @@ if sys.platform == 'win32':
         pass
 
 from config import DB_HOST, DB_USER, DB_PASS, DB_NAME
+from db_migrations import run_migrations
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -42,27 +43,18 @@ async def init_database():
             )
             logger.info(f"Database '{DB_NAME}' created or already exists")
             
-            # Select database
-            await cur.execute(f"USE {DB_NAME}")
-            
-            # Create table
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS gifts (
-                    name VARCHAR(255) NOT NULL,
-                    model VARCHAR(255),
-                    price FLOAT DEFAULT 0,
-                    floor_price FLOAT DEFAULT 0,
-                    photo_url TEXT,
-                    model_rarity VARCHAR(50),
-                    user_id BIGINT NOT NULL,
-                    PRIMARY KEY (user_id, name(255), model(255))
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            logger.info("Table 'gifts' created or already exists")
-            
             await conn.commit()
         
         conn.close()
+        
+        # Tables and indexes: versioned migrations shared with the bot
+        pool = await aiomysql.create_pool(host=DB_HOST, user=DB_USER, password=DB_PASS, db=DB_NAME)
+        try:
+            applied = await run_migrations(pool)
+            logger.info(f"Schema migrations applied: {applied}")
+        finally:
+            pool.close()
+            await pool.wait_closed()
         logger.info("Database initialization completed successfully!")
         return True
         
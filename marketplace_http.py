@@ -0,0 +1,184 @@
+"""
+Общий асинхронный HTTP-клиент для оберток маркетплейсов.
+
+Один клиент на маркетплейс (и на event loop) с keep-alive пулом соединений
+и ограничением одновременных соединений к хосту. Используется корутинными
+версиями функций из portalsmp, tonnelmp_wrapper, mrktmp_wrapper и getgems_wrapper.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import weakref
+from typing import Any, Dict, Optional
+
+from rate_limiter import get_limiter
+
+logger = logging.getLogger(__name__)
+
+try:
+    # curl_cffi умеет impersonate, как и синхронные обертки
+    from curl_cffi.requests import AsyncSession
+except ImportError:
+    AsyncSession = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Лимит одновременных соединений к одному хосту маркетплейса
+HTTP_LIMIT_PER_HOST = int(os.getenv('MARKETPLACE_HTTP_LIMIT_PER_HOST', '10'))
+# Общий таймаут запроса (секунды)
+HTTP_TIMEOUT = float(os.getenv('MARKETPLACE_HTTP_TIMEOUT', '30'))
+# Сколько держать простаивающее соединение открытым (секунды, только aiohttp)
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('MARKETPLACE_HTTP_KEEPALIVE', '60'))
+
+IMPERSONATE = "chrome110"
+
+
+class HttpError(Exception):
+    """HTTP статус >= 400 при вызове raise_for_status()"""
+
+    def __init__(self, status_code: int, url: str, text: str = ""):
+        self.status_code = status_code
+        self.url = url
+        self.text = text
+        super().__init__(f"HTTP {status_code} for {url}")
+
+
+class HttpResponse:
+    """Прочитанный ответ, одинаковый для curl_cffi и aiohttp"""
+
+    def __init__(self, status_code: int, text: str, headers: Dict[str, str], url: str):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+        self.url = url
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HttpError(self.status_code, self.url, self.text[:500])
+
+
+class MarketplaceHttpClient:
+    """Пул соединений одного маркетплейса"""
+
+    def __init__(self, name: str, limit_per_host: int = HTTP_LIMIT_PER_HOST, timeout: float = HTTP_TIMEOUT):
+        self.name = name
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self._session = None
+        self._backend: Optional[str] = None
+        self._lock = asyncio.Lock()
+
+    async def _get_session(self):
+        if self._session is not None:
+            return self._session
+        async with self._lock:
+            if self._session is not None:
+                return self._session
+            if AsyncSession is not None:
+                self._session = AsyncSession(impersonate=IMPERSONATE, max_clients=self.limit_per_host)
+                self._backend = 'curl_cffi'
+            elif aiohttp is not None:
+                connector = aiohttp.TCPConnector(
+                    limit=self.limit_per_host,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                    ttl_dns_cache=300,
+                )
+                self._session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=self.timeout),
+                )
+                self._backend = 'aiohttp'
+            else:
+                raise RuntimeError("Neither curl_cffi nor aiohttp is installed, async HTTP is unavailable")
+            logger.debug(f"[http] {self.name}: created {self._backend} session (limit_per_host={self.limit_per_host})")
+        return self._session
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        json_data: Any = None,
+        timeout: Optional[float] = None,
+        rate_class: Optional[str] = 'search',
+    ) -> HttpResponse:
+        """
+        Выполнить запрос. rate_class — класс эндпоинта для лимитера
+        (search/stats/history), None — без лимита.
+        """
+        session = await self._get_session()
+        timeout = timeout or self.timeout
+        limiter = get_limiter(self.name, rate_class) if rate_class else None
+        if limiter:
+            await limiter.acquire()
+
+        if self._backend == 'curl_cffi':
+            response = await session.request(
+                method, url, headers=headers, params=params, json=json_data, timeout=timeout
+            )
+            result = HttpResponse(response.status_code, response.text, dict(response.headers), url)
+        else:
+            async with session.request(
+                method, url, headers=headers, params=params, json=json_data,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as response:
+                text = await response.text()
+                result = HttpResponse(response.status, text, dict(response.headers), url)
+
+        if limiter:
+            limiter.note_response(result.status_code, result.headers)
+        return result
+
+    async def get(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request('POST', url, **kwargs)
+
+    async def close(self):
+        if self._session is None:
+            return
+        session, self._session = self._session, None
+        try:
+            await session.close()
+        except Exception as e:
+            logger.debug(f"[http] {self.name}: error closing session: {e}")
+
+
+# Клиенты привязаны к event loop: gui/server.py создает собственные циклы
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, MarketplaceHttpClient]]" = weakref.WeakKeyDictionary()
+
+
+def get_client(marketplace: str) -> MarketplaceHttpClient:
+    """Получить общий клиент маркетплейса для текущего event loop"""
+    loop = asyncio.get_running_loop()
+    loop_clients = _clients.get(loop)
+    if loop_clients is None:
+        loop_clients = {}
+        _clients[loop] = loop_clients
+    client = loop_clients.get(marketplace)
+    if client is None:
+        client = MarketplaceHttpClient(marketplace)
+        loop_clients[marketplace] = client
+    return client
+
+
+async def close_all_clients():
+    """Закрыть все клиенты текущего event loop"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    loop_clients = _clients.pop(loop, None) or {}
+    for client in loop_clients.values():
+        await client.close()
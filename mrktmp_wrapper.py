@@ -3,8 +3,12 @@
 Согласно документации: https://github.com/boostNT/MRKT-API
 """
 
+import asyncio
 import logging
-from typing import List, Dict, Optional, Any
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from urllib.parse import unquote
 
 logger = logging.getLogger(__name__)
@@ -14,9 +18,24 @@ try:
 except ImportError:
     import requests
 
+try:
+    from marketplace_http import get_client
+except ImportError:
+    get_client = None
+
+from rate_limiter import get_limiter
+from retry_policy import retry_sync, retry_async, check_retryable_status, RetryableHTTPStatus, MAX_ATTEMPTS
+
 # API URL согласно документации: https://github.com/boostNT/MRKT-API
 MRKT_API_URL = 'https://api.tgmrkt.io/api/v1'
 
+# Потоковый обход лотов: сколько максимум лотов и секунд на один обход
+MRKT_STREAM_MAX_ITEMS = int(os.getenv('MRKT_STREAM_MAX_ITEMS', '1000'))
+MRKT_STREAM_TIME_BUDGET = float(os.getenv('MRKT_STREAM_TIME_BUDGET', '30'))
+
+# Синхронная сессия — своя на поток (curl-хендлы не потокобезопасны), переиспользуется (keep-alive)
+_sync_local = threading.local()
+
 
 async def get_mrkt_auth_token(api_id: int, api_hash: str) -> Optional[str]:
     """
@@ -99,6 +118,287 @@ async def get_mrkt_auth_token(api_id: int, api_hash: str) -> Optional[str]:
         return None
 
 
+def _mrkt_search_body(
+    gift_name: Optional[str],
+    model: Optional[str],
+    limit: int,
+    sort: str,
+    cursor: str = '',
+) -> Dict[str, Any]:
+    """JSON body для POST /gifts/saling"""
+    # Маппинг сортировки согласно документации
+    # ordering: "Price" | "ModelRarity" | "BackgroundRarity" | "SymbolRarity" | None (по времени)
+    ordering_map = {
+        "price_asc": "Price",
+        "price_desc": "Price",
+        "latest": None,  # для последних — None означает сортировку по времени
+        "model_rarity_asc": "ModelRarity",
+        "model_rarity_desc": "ModelRarity",
+        "backdrop_rarity_asc": "BackgroundRarity",
+        "backdrop_rarity_desc": "BackgroundRarity",
+        "symbol_rarity_asc": "SymbolRarity",
+        "symbol_rarity_desc": "SymbolRarity",
+    }
+
+    ordering = ordering_map.get(sort, "Price")
+    low_to_high = sort.endswith("_asc") or sort == "latest"
+
+    # Формируем JSON body согласно документации
+    json_data = {
+        "collectionNames": [gift_name] if gift_name and gift_name.strip() else [],
+        "modelNames": [model] if model and model.strip() else [],
+        "backdropNames": [],
+        "symbolNames": [],
+        "lowToHigh": low_to_high,
+        "maxPrice": None,
+        "minPrice": None,
+        "mintable": None,
+        "number": None,
+        "count": limit,
+        "cursor": cursor or '',
+        "query": None,
+        "promotedFirst": False,
+    }
+
+    # Добавляем ordering только если оно не None
+    if ordering is not None:
+        json_data["ordering"] = ordering
+
+    # Поле req - попробуем передать валидное значение
+    # Согласно ошибке, поле требуется, но пустая строка не принимается
+    # Попробуем передать строку с описанием запроса
+    json_data["req"] = "search" if gift_name or model else "all"
+
+    return json_data
+
+
+def _mrkt_headers(auth_token: str) -> Dict[str, str]:
+    """Заголовки согласно документации (токен используется напрямую, без префикса tma)"""
+    return {
+        "Authorization": auth_token,
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+    }
+
+
+def _convert_mrkt_items(data: Any) -> List[Dict[str, Any]]:
+    """Преобразует ответ /gifts/saling в унифицированный формат"""
+    logger.info(f"MRKT API response type: {type(data)}, keys: {list(data.keys())[:10] if isinstance(data, dict) else 'N/A'}")
+
+    # Согласно документации, ответ содержит поле "gifts"
+    if isinstance(data, dict):
+        items = data.get("gifts", [])
+    elif isinstance(data, list):
+        items = data
+    else:
+        items = []
+
+    logger.info(f"Extracted items: type={type(items)}, len={len(items) if isinstance(items, list) else 'N/A'}")
+
+    if not isinstance(items, list):
+        logger.error(f"Items is not a list: {type(items)}")
+        return []
+
+    # Логируем структуру первого элемента для отладки
+    if items and isinstance(items[0], dict):
+        first_item = items[0]
+        logger.info(f"First MRKT API item keys: {list(first_item.keys())[:30]}")
+        logger.info(f"First MRKT API item sample: {dict(list(first_item.items())[:20])}")
+
+    # Преобразуем формат для совместимости
+    result = []
+    for item in items:
+        if isinstance(item, dict):
+            # Извлекаем цену - пробуем разные ключи
+            # Цена может приходить в нанотонах (1 TON = 1,000,000,000 нанотонов)
+            price = None
+            price_fields = ['price', 'tonPrice', 'ton_price', 'priceTON', 'price_ton', 'amount', 'salePrice', 'sale_price', 'listPrice', 'list_price', 'raw_price']
+            for field in price_fields:
+                if field in item:
+                    price_val = item[field]
+                    if price_val is not None:
+                        try:
+                            if isinstance(price_val, (int, float)):
+                                price_raw = float(price_val)
+                                # Если цена очень большая (> 1000), возможно это нанотоны, делим на 1e9
+                                # 1 TON = 1,000,000,000 нанотонов
+                                if price_raw > 1000:
+                                    price_nano = price_raw / 1e9
+                                    # Проверяем, имеет ли смысл (цена должна быть разумной, например 0.001-10000 TON)
+                                    if 0.001 <= price_nano < 10000:
+                                        price = price_nano
+                                        logger.debug(f"Converted price from nanoTON: {price_raw} -> {price}")
+                                    else:
+                                        price = price_raw
+                                else:
+                                    price = price_raw
+                            elif isinstance(price_val, str):
+                                # Убираем TON, пробелы, запятые и пробуем преобразовать
+                                price_clean = price_val.replace('TON', '').replace('ton', '').replace(',', '').replace(' ', '').strip()
+                                if price_clean:
+                                    price_raw = float(price_clean)
+                                    # Проверяем нанотоны
+                                    if price_raw > 1000:
+                                        price_nano = price_raw / 1e9
+                                        if 0.001 <= price_nano < 10000:
+                                            price = price_nano
+                                            logger.debug(f"Converted price from nanoTON: {price_raw} -> {price}")
+                                        else:
+                                            price = price_raw
+                                    else:
+                                        price = price_raw
+                            if price and price > 0:
+                                logger.debug(f"Found price in field '{field}': {price}")
+                                break
+                        except (ValueError, TypeError, AttributeError):
+                            continue
+
+            # Извлекаем флор - может быть в отдельном поле или нужно вычислять из коллекции
+            # Флор также может приходить в нанотонах
+            floor_price = None
+            floor_fields = ['floorPrice', 'floor_price', 'collectionFloor', 'collection_floor', 'minPrice', 'min_price', 'floor']
+            for field in floor_fields:
+                if field in item:
+                    floor_val = item[field]
+                    if floor_val is not None:
+                        try:
+                            if isinstance(floor_val, (int, float)):
+                                floor_raw = float(floor_val)
+                                # Если флор очень большой (> 1000), возможно это нанотоны
+                                if floor_raw > 1000:
+                                    floor_nano = floor_raw / 1e9
+                                    if 0.001 <= floor_nano < 10000:
+                                        floor_price = floor_nano
+                                        logger.debug(f"Converted floor_price from nanoTON: {floor_raw} -> {floor_price}")
+                                    else:
+                                        floor_price = floor_raw
+                                else:
+                                    floor_price = floor_raw
+                            elif isinstance(floor_val, str):
+                                floor_clean = floor_val.replace('TON', '').replace('ton', '').replace(',', '').replace(' ', '').strip()
+                                if floor_clean:
+                                    floor_raw = float(floor_clean)
+                                    # Проверяем нанотоны
+                                    if floor_raw > 1000:
+                                        floor_nano = floor_raw / 1e9
+                                        if 0.001 <= floor_nano < 10000:
+                                            floor_price = floor_nano
+                                            logger.debug(f"Converted floor_price from nanoTON: {floor_raw} -> {floor_price}")
+                                        else:
+                                            floor_price = floor_raw
+                                    else:
+                                        floor_price = floor_raw
+                            if floor_price and floor_price > 0:
+                                logger.debug(f"Found floor_price in field '{field}': {floor_price}")
+                                break
+                        except (ValueError, TypeError, AttributeError):
+                            continue
+
+            # Если флор не найден, НЕ используем цену как fallback (это разные вещи)
+            # floor_price остается None если не найден
+
+            # Для MRKT ссылок нужен хеш (32 символа hex) - это поле id согласно документации
+            item_id = item.get('id')
+
+            # Проверяем, является ли id хешем (32 символа hex без дефисов)
+            def is_hex_hash(value):
+                if not value:
+                    return False
+                value_str = str(value).replace('-', '')
+                return len(value_str) == 32 and all(c in '0123456789abcdefABCDEF' for c in value_str)
+
+            # Извлекаем хеш для ссылки
+            mrkt_hash = None
+            if item_id:
+                if is_hex_hash(item_id):
+                    # Если id уже хеш, используем его
+                    mrkt_hash = str(item_id).replace('-', '')
+                    logger.debug(f"Using id as hash: {mrkt_hash}")
+                else:
+                    # Ищем хеш в других полях (на случай если структура отличается)
+                    hash_fields = ['hash', 'hashId', 'hash_id', 'token', 'uuid', 'guid', 'appId', 'app_id', 'startappId', 'startapp_id']
+                    for field in hash_fields:
+                        hash_val = item.get(field)
+                        if hash_val and is_hex_hash(hash_val):
+                            mrkt_hash = str(hash_val).replace('-', '')
+                            logger.debug(f"Found hash in field '{field}': {mrkt_hash}")
+                            break
+
+            # Извлекаем название подарка
+            name = (
+                item.get('collectionName') or 
+                item.get('collection_name') or 
+                item.get('name') or 
+                item.get('giftName') or 
+                item.get('gift_name') or
+                'Unknown'
+            )
+
+            # Извлекаем модель
+            model_name = (
+                item.get('modelName') or 
+                item.get('model_name') or 
+                item.get('model') or
+                'N/A'
+            )
+
+            # Извлекаем номер подарка
+            gift_number = (
+                item.get('number') or 
+                item.get('giftNumber') or 
+                item.get('gift_number') or
+                item.get('externalCollectionNumber') or
+                item.get('external_collection_number') or
+                'N/A'
+            )
+
+            # Извлекаем фото
+            photo_url = (
+                item.get('photoUrl') or 
+                item.get('photo_url') or 
+                item.get('imageUrl') or 
+                item.get('image_url') or 
+                item.get('image') or
+                item.get('photo') or
+                None
+            )
+
+            # Извлекаем редкость модели
+            model_rarity = (
+                item.get('modelRarity') or 
+                item.get('model_rarity') or 
+                item.get('rarity') or
+                item.get('modelRarityPercent') or
+                item.get('model_rarity_percent') or
+                None
+            )
+
+            converted = {
+                'id': item_id,
+                'mrkt_hash': mrkt_hash,  # Хеш для ссылки в мини-приложение (32 символа hex)
+                'name': name,
+                'model': model_name,
+                'price': price,
+                'floor_price': floor_price,  # Не используем price как fallback
+                'photo_url': photo_url,
+                'model_rarity': model_rarity,
+                'external_collection_number': str(gift_number),
+            }
+            result.append(converted)
+            logger.debug(f"Converted MRKT item: name={name}, model={model_name}, price={price}, floor={floor_price}, hash={mrkt_hash}")
+
+    return result
+
+
+def _get_sync_session():
+    """curl_cffi сессия текущего потока (asyncio.to_thread зовет из разных потоков пула)"""
+    session = getattr(_sync_local, 'session', None)
+    if session is None and hasattr(requests, 'Session') and hasattr(requests.Session, 'impersonate'):
+        session = requests.Session(impersonate="chrome110")
+        _sync_local.session = session
+    return session
+
+
 def search_mrkt(
     gift_name: Optional[str] = None,
     model: Optional[str] = None,
@@ -131,102 +431,50 @@ def search_mrkt(
         if limit < 1:
             limit = 1
         
-        # Маппинг сортировки согласно документации
-        # ordering: "Price" | "ModelRarity" | "BackgroundRarity" | "SymbolRarity" | None (по времени)
-        ordering_map = {
-            "price_asc": "Price",
-            "price_desc": "Price",
-            "latest": None,  # для последних — None означает сортировку по времени
-            "model_rarity_asc": "ModelRarity",
-            "model_rarity_desc": "ModelRarity",
-            "backdrop_rarity_asc": "BackgroundRarity",
-            "backdrop_rarity_desc": "BackgroundRarity",
-            "symbol_rarity_asc": "SymbolRarity",
-            "symbol_rarity_desc": "SymbolRarity",
-        }
-        
-        ordering = ordering_map.get(sort, "Price")
-        low_to_high = sort.endswith("_asc") or sort == "latest"
-        
-        # Формируем JSON body согласно документации
-        json_data = {
-            "collectionNames": [gift_name] if gift_name and gift_name.strip() else [],
-            "modelNames": [model] if model and model.strip() else [],
-            "backdropNames": [],
-            "symbolNames": [],
-            "lowToHigh": low_to_high,
-            "maxPrice": None,
-            "minPrice": None,
-            "mintable": None,
-            "number": None,
-            "count": limit,
-            "cursor": '',
-            "query": None,
-            "promotedFirst": False,
-        }
-        
-        # Добавляем ordering только если оно не None
-        if ordering is not None:
-            json_data["ordering"] = ordering
-        
-        # Поле req - попробуем передать валидное значение
-        # Согласно ошибке, поле требуется, но пустая строка не принимается
-        # Попробуем передать строку с описанием запроса
-        json_data["req"] = "search" if gift_name or model else "all"
-        
-        # Заголовки согласно документации
-        # Токен используется напрямую без префикса "tma "
-        headers = {
-            "Authorization": auth_token,
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-        }
+        json_data = _mrkt_search_body(gift_name, model, limit, sort)
+        headers = _mrkt_headers(auth_token)
         
         # Endpoint согласно документации: POST https://api.tgmrkt.io/api/v1/gifts/saling
         endpoint = f"{MRKT_API_URL}/gifts/saling"
         
-        # Выполняем POST запрос с retry для 429 ошибок
-        import time
-        max_retries = 3
-        retry_delay = 2
+        # Выполняем POST запрос с общей политикой повторов (429, 5xx, ошибки соединения)
+        limiter = get_limiter('mrkt', 'search')
         
-        for attempt in range(max_retries):
+        def _post():
+            limiter.acquire_sync()
             try:
-                if hasattr(requests, 'post'):
+                session = _get_sync_session()
+                if session is not None:
                     # Используем curl_cffi если доступен
-                    if hasattr(requests, 'Session') and hasattr(requests.Session, 'impersonate'):
-                        session = requests.Session(impersonate="chrome110")
-                        response = session.post(endpoint, headers=headers, json=json_data, timeout=30)
-                    else:
-                        response = requests.post(endpoint, headers=headers, json=json_data, timeout=30)
+                    response = session.post(endpoint, headers=headers, json=json_data, timeout=30)
+                elif hasattr(requests, 'post'):
+                    response = requests.post(endpoint, headers=headers, json=json_data, timeout=30)
                 else:
                     import requests as std_requests
                     response = std_requests.post(endpoint, headers=headers, json=json_data, timeout=30)
             except Exception as e:
                 logger.error(f"Error making request to MRKT API: {e}")
-                if attempt < max_retries - 1:
-                    # Используем очень короткую задержку, чтобы не блокировать event loop
-                    time.sleep(0.1 * (attempt + 1))
-                    continue
-                return f"Error: Failed to perform request: {str(e)}"
-            
-            if response.status_code == 401:
-                return "Auth error: invalid or expired token"
-            
-            if response.status_code == 429:
-                if attempt < max_retries - 1:
-                    wait_time = retry_delay * (attempt + 1)
-                    logger.warning(f"Rate limit (429) hit, waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    return f"Error: Rate limit exceeded (429) after {max_retries} attempts"
-            
-            if response.status_code != 200:
-                logger.error(f"MRKT API returned status {response.status_code}: {response.text}")
-                response.raise_for_status()
-            
-            break
+                raise ConnectionError(str(e)) from e
+            limiter.note_response(response.status_code, response.headers)
+            check_retryable_status(response.status_code, response.headers)
+            return response
+        
+        try:
+            response = retry_sync('mrkt:search', _post)
+        except ConnectionError as e:
+            return f"Error: Failed to perform request: {str(e)}"
+        except RetryableHTTPStatus as e:
+            if e.status_code == 429:
+                return f"Error: Rate limit exceeded (429) after {MAX_ATTEMPTS} attempts"
+            logger.error(f"MRKT API returned status {e.status_code}")
+            return f"HTTP error: {e.status_code}"
+        
+        if response.status_code == 401:
+            return "Auth error: invalid or expired token"
+        
+        if response.status_code != 200:
+            logger.error(f"MRKT API returned status {response.status_code}: {response.text}")
+            response.raise_for_status()
         
         try:
             data = response.json()
@@ -234,214 +482,188 @@ def search_mrkt(
             logger.error(f"Error parsing JSON response: {e}")
             return f"Error: Invalid JSON response: {str(e)}"
         
-        logger.info(f"MRKT API response type: {type(data)}, keys: {list(data.keys())[:10] if isinstance(data, dict) else 'N/A'}")
-        
-        # Согласно документации, ответ содержит поле "gifts"
-        if isinstance(data, dict):
-            items = data.get("gifts", [])
-        elif isinstance(data, list):
-            items = data
-        else:
-            items = []
+        return _convert_mrkt_items(data)
+    except Exception as e:
+        logger.error(f"Error in search_mrkt: {e}", exc_info=True)
+        return f"Error: {str(e)}"
+
+
+async def _fetch_mrkt_page_async(
+    gift_name: Optional[str],
+    model: Optional[str],
+    limit: int,
+    sort: str,
+    auth_token: str,
+    cursor: str = '',
+) -> Tuple[List[Dict[str, Any]] | str, str]:
+    """Одна страница /gifts/saling: (подарки или строка с ошибкой, курсор следующей страницы)"""
+    try:
+        limit = max(1, min(limit, 20))
+        json_data = _mrkt_search_body(gift_name, model, limit, sort, cursor)
         
-        logger.info(f"Extracted items: type={type(items)}, len={len(items) if isinstance(items, list) else 'N/A'}")
+        async def _post():
+            try:
+                response = await get_client('mrkt').post(
+                    f"{MRKT_API_URL}/gifts/saling", headers=_mrkt_headers(auth_token), json_data=json_data
+                )
+            except Exception as e:
+                logger.error(f"Error making request to MRKT API: {e}")
+                raise ConnectionError(str(e)) from e
+            check_retryable_status(response.status_code, response.headers)
+            return response
         
-        if not isinstance(items, list):
-            logger.error(f"Items is not a list: {type(items)}")
-            return []
+        try:
+            response = await retry_async('mrkt:search', _post)
+        except ConnectionError as e:
+            return f"Error: Failed to perform request: {str(e)}", ""
+        except RetryableHTTPStatus as e:
+            if e.status_code == 429:
+                return f"Error: Rate limit exceeded (429) after {MAX_ATTEMPTS} attempts", ""
+            logger.error(f"MRKT API returned status {e.status_code}")
+            return f"HTTP error: {e.status_code}", ""
+        
+        if response.status_code == 401:
+            return "Auth error: invalid or expired token", ""
+        
+        if response.status_code != 200:
+            logger.error(f"MRKT API returned status {response.status_code}: {response.text[:500]}")
+            return f"HTTP error: {response.status_code}", ""
         
-        # Логируем структуру первого элемента для отладки
-        if items and isinstance(items[0], dict):
-            first_item = items[0]
-            logger.info(f"First MRKT API item keys: {list(first_item.keys())[:30]}")
-            logger.info(f"First MRKT API item sample: {dict(list(first_item.items())[:20])}")
+        try:
+            data = response.json()
+        except Exception as e:
+            logger.error(f"Error parsing JSON response: {e}")
+            return f"Error: Invalid JSON response: {str(e)}", ""
         
-        # Преобразуем формат для совместимости
-        result = []
-        for item in items:
-            if isinstance(item, dict):
-                # Извлекаем цену - пробуем разные ключи
-                # Цена может приходить в нанотонах (1 TON = 1,000,000,000 нанотонов)
-                price = None
-                price_fields = ['price', 'tonPrice', 'ton_price', 'priceTON', 'price_ton', 'amount', 'salePrice', 'sale_price', 'listPrice', 'list_price', 'raw_price']
-                for field in price_fields:
-                    if field in item:
-                        price_val = item[field]
-                        if price_val is not None:
-                            try:
-                                if isinstance(price_val, (int, float)):
-                                    price_raw = float(price_val)
-                                    # Если цена очень большая (> 1000), возможно это нанотоны, делим на 1e9
-                                    # 1 TON = 1,000,000,000 нанотонов
-                                    if price_raw > 1000:
-                                        price_nano = price_raw / 1e9
-                                        # Проверяем, имеет ли смысл (цена должна быть разумной, например 0.001-10000 TON)
-                                        if 0.001 <= price_nano < 10000:
-                                            price = price_nano
-                                            logger.debug(f"Converted price from nanoTON: {price_raw} -> {price}")
-                                        else:
-                                            price = price_raw
-                                    else:
-                                        price = price_raw
-                                elif isinstance(price_val, str):
-                                    # Убираем TON, пробелы, запятые и пробуем преобразовать
-                                    price_clean = price_val.replace('TON', '').replace('ton', '').replace(',', '').replace(' ', '').strip()
-                                    if price_clean:
-                                        price_raw = float(price_clean)
-                                        # Проверяем нанотоны
-                                        if price_raw > 1000:
-                                            price_nano = price_raw / 1e9
-                                            if 0.001 <= price_nano < 10000:
-                                                price = price_nano
-                                                logger.debug(f"Converted price from nanoTON: {price_raw} -> {price}")
-                                            else:
-                                                price = price_raw
-                                        else:
-                                            price = price_raw
-                                if price and price > 0:
-                                    logger.debug(f"Found price in field '{field}': {price}")
-                                    break
-                            except (ValueError, TypeError, AttributeError):
-                                continue
-                
-                # Извлекаем флор - может быть в отдельном поле или нужно вычислять из коллекции
-                # Флор также может приходить в нанотонах
-                floor_price = None
-                floor_fields = ['floorPrice', 'floor_price', 'collectionFloor', 'collection_floor', 'minPrice', 'min_price', 'floor']
-                for field in floor_fields:
-                    if field in item:
-                        floor_val = item[field]
-                        if floor_val is not None:
-                            try:
-                                if isinstance(floor_val, (int, float)):
-                                    floor_raw = float(floor_val)
-                                    # Если флор очень большой (> 1000), возможно это нанотоны
-                                    if floor_raw > 1000:
-                                        floor_nano = floor_raw / 1e9
-                                        if 0.001 <= floor_nano < 10000:
-                                            floor_price = floor_nano
-                                            logger.debug(f"Converted floor_price from nanoTON: {floor_raw} -> {floor_price}")
-                                        else:
-                                            floor_price = floor_raw
-                                    else:
-                                        floor_price = floor_raw
-                                elif isinstance(floor_val, str):
-                                    floor_clean = floor_val.replace('TON', '').replace('ton', '').replace(',', '').replace(' ', '').strip()
-                                    if floor_clean:
-                                        floor_raw = float(floor_clean)
-                                        # Проверяем нанотоны
-                                        if floor_raw > 1000:
-                                            floor_nano = floor_raw / 1e9
-                                            if 0.001 <= floor_nano < 10000:
-                                                floor_price = floor_nano
-                                                logger.debug(f"Converted floor_price from nanoTON: {floor_raw} -> {floor_price}")
-                                            else:
-                                                floor_price = floor_raw
-                                        else:
-                                            floor_price = floor_raw
-                                if floor_price and floor_price > 0:
-                                    logger.debug(f"Found floor_price in field '{field}': {floor_price}")
-                                    break
-                            except (ValueError, TypeError, AttributeError):
-                                continue
-                
-                # Если флор не найден, НЕ используем цену как fallback (это разные вещи)
-                # floor_price остается None если не найден
-                
-                # Для MRKT ссылок нужен хеш (32 символа hex) - это поле id согласно документации
-                item_id = item.get('id')
-                
-                # Проверяем, является ли id хешем (32 символа hex без дефисов)
-                def is_hex_hash(value):
-                    if not value:
-                        return False
-                    value_str = str(value).replace('-', '')
-                    return len(value_str) == 32 and all(c in '0123456789abcdefABCDEF' for c in value_str)
-                
-                # Извлекаем хеш для ссылки
-                mrkt_hash = None
-                if item_id:
-                    if is_hex_hash(item_id):
-                        # Если id уже хеш, используем его
-                        mrkt_hash = str(item_id).replace('-', '')
-                        logger.debug(f"Using id as hash: {mrkt_hash}")
-                    else:
-                        # Ищем хеш в других полях (на случай если структура отличается)
-                        hash_fields = ['hash', 'hashId', 'hash_id', 'token', 'uuid', 'guid', 'appId', 'app_id', 'startappId', 'startapp_id']
-                        for field in hash_fields:
-                            hash_val = item.get(field)
-                            if hash_val and is_hex_hash(hash_val):
-                                mrkt_hash = str(hash_val).replace('-', '')
-                                logger.debug(f"Found hash in field '{field}': {mrkt_hash}")
-                                break
-                
-                # Извлекаем название подарка
-                name = (
-                    item.get('collectionName') or 
-                    item.get('collection_name') or 
-                    item.get('name') or 
-                    item.get('giftName') or 
-                    item.get('gift_name') or
-                    'Unknown'
-                )
-                
-                # Извлекаем модель
-                model_name = (
-                    item.get('modelName') or 
-                    item.get('model_name') or 
-                    item.get('model') or
-                    'N/A'
-                )
-                
-                # Извлекаем номер подарка
-                gift_number = (
-                    item.get('number') or 
-                    item.get('giftNumber') or 
-                    item.get('gift_number') or
-                    item.get('externalCollectionNumber') or
-                    item.get('external_collection_number') or
-                    'N/A'
-                )
-                
-                # Извлекаем фото
-                photo_url = (
-                    item.get('photoUrl') or 
-                    item.get('photo_url') or 
-                    item.get('imageUrl') or 
-                    item.get('image_url') or 
-                    item.get('image') or
-                    item.get('photo') or
-                    None
-                )
-                
-                # Извлекаем редкость модели
-                model_rarity = (
-                    item.get('modelRarity') or 
-                    item.get('model_rarity') or 
-                    item.get('rarity') or
-                    item.get('modelRarityPercent') or
-                    item.get('model_rarity_percent') or
-                    None
+        next_cursor = data.get("cursor") if isinstance(data, dict) else None
+        return _convert_mrkt_items(data), next_cursor or ""
+    except Exception as e:
+        logger.error(f"Error in search_mrkt_async: {e}", exc_info=True)
+        return f"Error: {str(e)}", ""
+
+
+async def search_mrkt_async(
+    gift_name: Optional[str] = None,
+    model: Optional[str] = None,
+    limit: int = 30,
+    sort: str = "price_asc",
+    auth_token: Optional[str] = None
+) -> List[Dict[str, Any]] | str:
+    """
+    Корутинная версия search_mrkt через общий пул соединений marketplace_http
+    
+    Returns:
+        Список подарков или строка с ошибкой (как search_mrkt())
+    """
+    if not auth_token:
+        return "Error: auth_token required for MRKT"
+    if get_client is None:
+        return await asyncio.to_thread(search_mrkt, gift_name, model, limit, sort, auth_token)
+    
+    items, _ = await _fetch_mrkt_page_async(gift_name, model, limit, sort, auth_token)
+    return items
+
+
+async def iter_mrkt_listings(
+    gift_name: Optional[str] = None,
+    model: Optional[str] = None,
+    sort: str = "price_asc",
+    auth_token: Optional[str] = None,
+    max_items: int = MRKT_STREAM_MAX_ITEMS,
+    time_budget: float = MRKT_STREAM_TIME_BUDGET,
+    page_size: int = 20,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Потоковый обход лотов MRKT по курсору API (страницы по 20).
+    Следующая страница запрашивается, пока вызывающий обрабатывает текущую.
+    Останавливается на max_items лотах, по истечении time_budget секунд
+    или когда курсор закончился. Ошибки API логируются и завершают обход.
+    """
+    if not auth_token:
+        logger.error("iter_mrkt_listings: auth_token required for MRKT")
+        return
+    
+    if get_client is None:
+        # Без пула соединений курсор недоступен — отдаем первую страницу
+        items = await asyncio.to_thread(search_mrkt, gift_name, model, page_size, sort, auth_token)
+        if isinstance(items, list):
+            for item in items[:max_items]:
+                yield item
+        return
+    
+    deadline = time.monotonic() + time_budget
+    yielded = 0
+    seen_cursors = set()
+    pending = asyncio.ensure_future(_fetch_mrkt_page_async(gift_name, model, page_size, sort, auth_token))
+    try:
+        while pending is not None:
+            items, next_cursor = await pending
+            pending = None
+            if isinstance(items, str):
+                logger.error(f"iter_mrkt_listings stopped: {items}")
+                return
+            
+            # Prefetch следующей страницы, пока отдаем текущую
+            if (items and next_cursor and next_cursor not in seen_cursors
+                    and yielded + len(items) < max_items and time.monotonic() < deadline):
+                seen_cursors.add(next_cursor)
+                pending = asyncio.ensure_future(
+                    _fetch_mrkt_page_async(gift_name, model, page_size, sort, auth_token, next_cursor)
                 )
-                
-                converted = {
-                    'id': item_id,
-                    'mrkt_hash': mrkt_hash,  # Хеш для ссылки в мини-приложение (32 символа hex)
-                    'name': name,
-                    'model': model_name,
-                    'price': price,
-                    'floor_price': floor_price,  # Не используем price как fallback
-                    'photo_url': photo_url,
-                    'model_rarity': model_rarity,
-                    'external_collection_number': str(gift_number),
-                }
-                result.append(converted)
-                logger.debug(f"Converted MRKT item: name={name}, model={model_name}, price={price}, floor={floor_price}, hash={mrkt_hash}")
-        
-        return result
+            
+            for item in items:
+                yield item
+                yielded += 1
+                if yielded >= max_items:
+                    return
+            
+            if time.monotonic() >= deadline:
+                logger.warning(f"iter_mrkt_listings: time budget {time_budget}s exhausted after {yielded} items")
+                return
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def collect_mrkt_listings(**kwargs) -> List[Dict[str, Any]]:
+    """Собрать iter_mrkt_listings в список (для вызывающих, которым нужен весь результат)"""
+    return [item async for item in iter_mrkt_listings(**kwargs)]
+
+
+def _min_price(items: Any) -> Optional[float]:
+    """Минимальная положительная цена среди результатов search_mrkt"""
+    if isinstance(items, str) or not isinstance(items, list) or not items:
+        return None
+    prices = []
+    for item in items:
+        if isinstance(item, dict):
+            price = item.get('price')
+            if price and isinstance(price, (int, float)) and price > 0:
+                prices.append(float(price))
+    return min(prices) if prices else None
+
+
+async def get_mrkt_model_floor_price_async(gift_name: str, model: str, auth_token: str) -> Optional[float]:
+    """Корутинная версия get_mrkt_model_floor_price"""
+    try:
+        items = await search_mrkt_async(gift_name=gift_name, model=model, limit=20, sort="price_asc", auth_token=auth_token)
+        if isinstance(items, str):
+            logger.error(f"search_mrkt_async returned error: {items}")
+            return None
+        return _min_price(items)
     except Exception as e:
-        logger.error(f"Error in search_mrkt: {e}", exc_info=True)
-        return f"Error: {str(e)}"
+        logger.error(f"Error getting MRKT model floor price: {e}", exc_info=True)
+        return None
+
+
+async def get_mrkt_gift_floor_price_async(gift_name: str, auth_token: str) -> Optional[float]:
+    """Корутинная версия get_mrkt_gift_floor_price"""
+    try:
+        items = await search_mrkt_async(gift_name=gift_name, model=None, limit=20, sort="price_asc", auth_token=auth_token)
+        return _min_price(items)
+    except Exception as e:
+        logger.error(f"Error getting MRKT gift floor price: {e}")
+        return None
 
 
 def get_mrkt_model_floor_price(gift_name: str, model: str, auth_token: str) -> Optional[float]:
@@ -572,8 +794,9 @@ def get_mrkt_model_sales_history(gift_name: str, model: str, auth_token: str, li
             if gift_id:
                 try:
                     # Пробуем получить продажи через отдельный endpoint
-                    if hasattr(requests, 'Session') and hasattr(requests.Session, 'impersonate'):
-                        session = requests.Session(impersonate="chrome110")
+                    get_limiter('mrkt', 'history').acquire_sync()
+                    session = _get_sync_session()
+                    if session is not None:
                         response = session.get(
                             f"{MRKT_API_URL}/gifts/{gift_id}/sales",
                             headers=headers,
@@ -646,8 +869,9 @@ def get_mrkt_gift_by_id(gift_id: str, auth_token: str) -> Optional[Dict[str, Any
         
         for endpoint in endpoints:
             try:
-                if hasattr(requests, 'Session') and hasattr(requests.Session, 'impersonate'):
-                    session = requests.Session(impersonate="chrome110")
+                get_limiter('mrkt', 'search').acquire_sync()
+                session = _get_sync_session()
+                if session is not None:
                     response = session.get(endpoint, headers=headers, timeout=30)
                 else:
                     response = requests.get(endpoint, headers=headers, timeout=30)
@@ -0,0 +1,233 @@
+"""
+Дедупликация уведомлений между репликами бота.
+
+Ключ — (user_id, marketplace, gift_id). Перед отправкой реплика "заявляет"
+ключи в таблице notified_gifts: INSERT IGNORE со своим replica-id, затем
+выбирает, какие строки достались ей. Заявки копятся несколько сотен
+миллисекунд и уходят одной пачкой, поэтому число запросов в БД не зависит
+от числа листингов и реплик. Уже решенные ключи помнятся в памяти.
+
+Если БД недоступна, уведомления отправляются (лучше дубль, чем потеря).
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Окно накопления заявок (секунды) и максимальный размер пачки
+NOTIFY_DEDUP_WINDOW = float(os.getenv('NOTIFY_DEDUP_WINDOW', '0.2'))
+NOTIFY_DEDUP_BATCH = int(os.getenv('NOTIFY_DEDUP_BATCH', '500'))
+# Сколько хранить строки в notified_gifts (секунды)
+NOTIFY_DEDUP_RETENTION = int(os.getenv('NOTIFY_DEDUP_RETENTION', str(3 * 24 * 3600)))
+# Как часто чистить таблицу (секунды)
+NOTIFY_DEDUP_PRUNE_INTERVAL = float(os.getenv('NOTIFY_DEDUP_PRUNE_INTERVAL', '3600'))
+# Сколько решенных ключей держать в памяти
+NOTIFY_DEDUP_LOCAL_MAX = int(os.getenv('NOTIFY_DEDUP_LOCAL_MAX', '100000'))
+
+Key = Tuple[int, str, str]
+
+
+async def migrate_notified_gifts(cur):
+    """
+    notified_gifts с ключом (user_id, marketplace, gift_id).
+    Старые строки (только gift_id) остаются с user_id = 0 и marketplace = ''.
+    """
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS notified_gifts (
+            user_id BIGINT NOT NULL DEFAULT 0,
+            marketplace VARCHAR(50) NOT NULL DEFAULT '',
+            gift_id VARCHAR(255) NOT NULL,
+            replica VARCHAR(64) NULL,
+            notified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, marketplace, gift_id),
+            INDEX idx_notified_at (notified_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    # Миграция старой схемы (PRIMARY KEY gift_id)
+    await cur.execute("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'notified_gifts'
+    """)
+    columns = {row[0] for row in await cur.fetchall()}
+    for column, column_sql in (
+        ('user_id', "ADD COLUMN user_id BIGINT NOT NULL DEFAULT 0 FIRST"),
+        ('marketplace', "ADD COLUMN marketplace VARCHAR(50) NOT NULL DEFAULT '' AFTER user_id"),
+        ('replica', "ADD COLUMN replica VARCHAR(64) NULL"),
+    ):
+        if column not in columns:
+            await cur.execute(f"ALTER TABLE notified_gifts {column_sql}")
+    await cur.execute("""
+        SELECT COUNT(*) FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'notified_gifts'
+          AND CONSTRAINT_NAME = 'PRIMARY'
+    """)
+    row = await cur.fetchone()
+    if row and row[0] == 1:
+        await cur.execute("""
+            ALTER TABLE notified_gifts
+            DROP PRIMARY KEY, ADD PRIMARY KEY (user_id, marketplace, gift_id)
+        """)
+        logger.info("[dedup] notified_gifts migrated to (user_id, marketplace, gift_id) key")
+
+
+async def ensure_schema(pool):
+    """Проверить схему (обычно ее уже привели db_migrations) и мигрировать при необходимости"""
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT 1 FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'notified_gifts'
+                  AND COLUMN_NAME = 'replica'
+            """)
+            if await cur.fetchone() is not None:
+                return
+            await migrate_notified_gifts(cur)
+            await conn.commit()
+
+
+class NotificationDedup:
+    """Заявки на отправку (user, marketplace, gift) с общим решением через БД"""
+
+    def __init__(self, pool, replica_id: Optional[str] = None):
+        self.pool = pool
+        self.replica_id = replica_id or f"{socket.gethostname()[:40]}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # Решенные ключи: True — отправляем мы, False — другая реплика
+        self._decided: "OrderedDict[Key, bool]" = OrderedDict()
+        self._pending: Dict[Key, asyncio.Future] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._schema_ready = False
+        self._last_prune = time.monotonic()
+        # Метрики
+        self.claimed = 0
+        self.skipped = 0
+        self.local_hits = 0
+        self.batches = 0
+        self.errors = 0
+
+    def _remember(self, key: Key, owned: bool):
+        self._decided[key] = owned
+        while len(self._decided) > NOTIFY_DEDUP_LOCAL_MAX:
+            self._decided.popitem(last=False)
+
+    async def claim(self, marketplace: str, gift_id: str, user_ids: Iterable[int]) -> List[int]:
+        """Пользователи, которым уведомление об этом листинге должна отправить эта реплика"""
+        if not gift_id:
+            return list(user_ids)
+        gift_id = str(gift_id)[:255]
+        loop = asyncio.get_running_loop()
+        waits: List[Tuple[int, asyncio.Future]] = []
+        result: List[int] = []
+        for user_id in user_ids:
+            key = (int(user_id), marketplace, gift_id)
+            decided = self._decided.get(key)
+            if decided is not None:
+                # Повтор в этой же реплике — уже отправлено или отдано другой
+                self.local_hits += 1
+                continue
+            future = self._pending.get(key)
+            if future is None:
+                future = loop.create_future()
+                self._pending[key] = future
+                waits.append((key[0], future))
+            # Ключ уже заявлен этим же процессом и ждет пачки — второй раз не шлем
+        if not waits:
+            return result
+
+        if len(self._pending) >= NOTIFY_DEDUP_BATCH:
+            await self._flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+
+        for user_id, future in waits:
+            if await future:
+                result.append(user_id)
+        return result
+
+    async def _flush_later(self):
+        await asyncio.sleep(NOTIFY_DEDUP_WINDOW)
+        await self._flush()
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        keys = list(batch.keys())
+        owned: Set[Key] = set()
+        try:
+            if not self._schema_ready:
+                await ensure_schema(self.pool)
+                self._schema_ready = True
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.executemany(
+                        "INSERT IGNORE INTO notified_gifts (user_id, marketplace, gift_id, replica) VALUES (%s, %s, %s, %s)",
+                        [(user_id, mp, gift_id, self.replica_id) for user_id, mp, gift_id in keys]
+                    )
+                    # Ровно вставленные ключи: поиск по PRIMARY KEY, без скана таблицы
+                    placeholders = ','.join(['(%s, %s, %s)'] * len(keys))
+                    await cur.execute(
+                        f"SELECT user_id, marketplace, gift_id FROM notified_gifts "
+                        f"WHERE (user_id, marketplace, gift_id) IN ({placeholders}) AND replica = %s",
+                        [part for key in keys for part in key] + [self.replica_id]
+                    )
+                    owned = {(int(r[0]), r[1], r[2]) for r in await cur.fetchall()}
+                    await conn.commit()
+            self.batches += 1
+        except Exception as e:
+            # БД недоступна — отправляем сами
+            self.errors += 1
+            logger.warning(f"[dedup] Claim batch failed, sending without dedup: {e}")
+            owned = set(keys)
+
+        for key, future in batch.items():
+            is_owner = key in owned
+            self._remember(key, is_owner)
+            if is_owner:
+                self.claimed += 1
+            else:
+                self.skipped += 1
+            if not future.done():
+                future.set_result(is_owner)
+
+        if time.monotonic() - self._last_prune >= NOTIFY_DEDUP_PRUNE_INTERVAL:
+            self._last_prune = time.monotonic()
+            await self.prune()
+
+        # Заявки, пришедшие во время запроса: claim() видел живую задачу и новую не ставил
+        if self._pending and (self._flush_task is None or self._flush_task.done()
+                              or self._flush_task is asyncio.current_task()):
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def prune(self):
+        """Удалить старые заявки (строки старой схемы с user_id = 0 не трогаем)"""
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(
+                        "DELETE FROM notified_gifts WHERE user_id <> 0 "
+                        "AND notified_at < NOW() - INTERVAL %s SECOND",
+                        (NOTIFY_DEDUP_RETENTION,)
+                    )
+                    deleted = cur.rowcount
+                    await conn.commit()
+            if deleted:
+                logger.info(f"[dedup] Pruned {deleted} old notified_gifts rows")
+        except Exception as e:
+            logger.warning(f"[dedup] Prune failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'claimed': self.claimed,
+            'skipped': self.skipped,
+            'local_hits': self.local_hits,
+            'batches': self.batches,
+            'errors': self.errors,
+            'pending': len(self._pending),
+        }
@@ -9,9 +9,27 @@ except ImportError:
     # Fallback на обычный requests если curl_cffi не установлен
     import requests
 
+import asyncio
 import logging
+import os
 import re
-from typing import List, Dict, Optional, Any
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Any, Set, Tuple
+
+try:
+    from marketplace_http import get_client
+except ImportError:
+    get_client = None
+
+from rate_limiter import get_limiter
+
+try:
+    from single_flight import coalesce
+except ImportError:
+    coalesce = None
 
 logger = logging.getLogger(__name__)
 
@@ -87,6 +105,137 @@ async def update_auth(api_id: int, api_hash: str) -> Optional[str]:
         return None
 
 
+def _search_url(
+    gift_name: Optional[List[str]] | str,
+    model: Optional[List[str]] | str,
+    limit: int,
+    sort: str,
+) -> str:
+    """Формирует URL nfts/search (как в официальной библиотеке portalsmp)"""
+    from urllib.parse import quote_plus
+    
+    def cap(text: str) -> str:
+        words = re.findall(r"\w+(?:'\w+)?", text)
+        for word in words:
+            if len(word) > 0:
+                cap_word = word[0].upper() + word[1:]
+                text = text.replace(word, cap_word, 1)
+        return text
+    
+    def listToURL(gifts: list) -> str:
+        return '%2C'.join(quote_plus(cap(gift)) for gift in gifts)
+    
+    SORTS = {
+        "latest": "&sort_by=listed_at+desc&status=listed&exclude_bundled=true&premarket_status=all",
+        "price_asc": "&sort_by=price+asc",
+        "price_desc": "&sort_by=price+desc",
+        "gift_id_asc": "&sort_by=external_collection_number+asc",
+        "gift_id_desc": "&sort_by=external_collection_number+desc",
+        "model_rarity_asc": "&sort_by=model_rarity+asc",
+        "model_rarity_desc": "&sort_by=model_rarity+desc"
+    }
+    
+    URL = f"{PORTALS_API_URL}nfts/search?offset=0&limit={limit}{SORTS.get(sort, SORTS['price_asc'])}"
+    
+    if gift_name:
+        if isinstance(gift_name, str):
+            URL += f"&filter_by_collections={quote_plus(cap(gift_name))}"
+        elif isinstance(gift_name, list):
+            URL += f"&filter_by_collections={listToURL(gift_name)}"
+    
+    if model:
+        if isinstance(model, str):
+            URL += f"&filter_by_models={quote_plus(cap(model))}"
+        elif isinstance(model, list):
+            URL += f"&filter_by_models={listToURL(model)}"
+    
+    return URL
+
+
+def _auth_headers(authData: Optional[str]) -> Dict[str, str]:
+    """Заголовки запроса к Portals API"""
+    # Если токен уже содержит "tma ", используем его как есть, иначе добавляем префикс
+    auth_header = authData if authData and authData.startswith('tma ') else (f"tma {authData}" if authData else "")
+    
+    return {
+        "Authorization": auth_header,
+        "Accept": "application/json, text/plain, */*",
+        "Origin": "https://portal-market.com",
+        "Referer": "https://portal-market.com/",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
+    }
+
+
+def _parse_search_data(data: Any) -> List[Dict[str, Any]]:
+    """Приводит ответ nfts/search к списку подарков"""
+    if isinstance(data, dict):
+        logger.info(f"API response keys: {list(data.keys())}")
+    logger.debug(f"API response content: {str(data)[:500]}")
+    
+    # Возвращаем список напрямую (как в официальной библиотеке)
+    if isinstance(data, dict):
+        # Проверяем различные возможные ключи
+        if "results" in data:
+            results = data["results"]
+            if isinstance(results, list):
+                # Нормализуем данные: извлекаем модель и редкость из attributes
+                normalized_results = []
+                for item in results:
+                    if isinstance(item, dict):
+                        # Извлекаем модель из attributes
+                        model = None
+                        model_rarity = None
+                        if "attributes" in item and isinstance(item["attributes"], list):
+                            for attr in item["attributes"]:
+                                if isinstance(attr, dict) and attr.get("type") == "model":
+                                    model = attr.get("value")
+                                    rarity_per_mille = attr.get("rarity_per_mille")
+                                    if rarity_per_mille is not None:
+                                        model_rarity = f"{rarity_per_mille}%"
+                                    break
+                        
+                        # Добавляем нормализованные поля
+                        normalized_item = item.copy()
+                        if model:
+                            normalized_item["model"] = model
+                        if model_rarity:
+                            normalized_item["model_rarity"] = model_rarity
+                        
+                        normalized_results.append(normalized_item)
+                    else:
+                        normalized_results.append(item)
+                
+                return normalized_results if normalized_results else []
+            else:
+                logger.warning(f"Unexpected 'results' type: {type(results)}")
+                return []
+        elif "items" in data:
+            items = data["items"]
+            if isinstance(items, list):
+                return items if items else []
+            else:
+                logger.warning(f"Unexpected 'items' type: {type(items)}")
+                return []
+        elif "data" in data:
+            data_content = data["data"]
+            if isinstance(data_content, list):
+                return data_content if data_content else []
+            elif isinstance(data_content, dict) and "results" in data_content:
+                return data_content["results"] if data_content["results"] else []
+            else:
+                logger.warning(f"Unexpected 'data' type: {type(data_content)}")
+                return []
+        else:
+            # Если это словарь, но нет известных ключей, логируем и возвращаем пустой список
+            logger.warning(f"Unexpected dict structure. Keys: {list(data.keys())}")
+            return []
+    elif isinstance(data, list):
+        return data if data else []
+    else:
+        logger.warning(f"Unexpected response type: {type(data)}, value: {str(data)[:200]}")
+        return []
+
+
 def search(
     gift_name: Optional[List[str]] | str = None,
     model: Optional[List[str]] | str = None,
@@ -107,57 +256,13 @@ def search(
     Returns:
         Список подарков или строка с ошибкой
     """
-    from urllib.parse import quote_plus
-    import re
-    
-    def cap(text: str) -> str:
-        words = re.findall(r"\w+(?:'\w+)?", text)
-        for word in words:
-            if len(word) > 0:
-                cap_word = word[0].upper() + word[1:]
-                text = text.replace(word, cap_word, 1)
-        return text
-    
-    def listToURL(gifts: list) -> str:
-        return '%2C'.join(quote_plus(cap(gift)) for gift in gifts)
-    
     try:
-        SORTS = {
-            "latest": "&sort_by=listed_at+desc&status=listed&exclude_bundled=true&premarket_status=all",
-            "price_asc": "&sort_by=price+asc",
-            "price_desc": "&sort_by=price+desc",
-            "gift_id_asc": "&sort_by=external_collection_number+asc",
-            "gift_id_desc": "&sort_by=external_collection_number+desc",
-            "model_rarity_asc": "&sort_by=model_rarity+asc",
-            "model_rarity_desc": "&sort_by=model_rarity+desc"
-        }
-        
-        URL = f"{PORTALS_API_URL}nfts/search?offset=0&limit={limit}{SORTS.get(sort, SORTS['price_asc'])}"
-        
-        if gift_name:
-            if isinstance(gift_name, str):
-                URL += f"&filter_by_collections={quote_plus(cap(gift_name))}"
-            elif isinstance(gift_name, list):
-                URL += f"&filter_by_collections={listToURL(gift_name)}"
-        
-        if model:
-            if isinstance(model, str):
-                URL += f"&filter_by_models={quote_plus(cap(model))}"
-            elif isinstance(model, list):
-                URL += f"&filter_by_models={listToURL(model)}"
-        
+        URL = _search_url(gift_name, model, limit, sort)
         logger.info(f"Portals search URL: {URL[:200]}...")  # Логируем первые 200 символов URL
         
-        # Если токен уже содержит "tma ", используем его как есть, иначе добавляем префикс
-        auth_header = authData if authData and authData.startswith('tma ') else (f"tma {authData}" if authData else "")
-        
-        headers = {
-            "Authorization": auth_header,
-            "Accept": "application/json, text/plain, */*",
-            "Origin": "https://portal-market.com",
-            "Referer": "https://portal-market.com/",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
-        }
+        headers = _auth_headers(authData)
+        limiter = get_limiter('portals', 'search')
+        limiter.acquire_sync()
         
         # Используем curl_cffi если доступен (лучше работает с DNS)
         try:
@@ -189,78 +294,14 @@ def search(
             else:
                 return f"Error: Failed to perform, {error_str}"
         
+        limiter.note_response(response.status_code, response.headers)
         if response.status_code == 401:
             return "Auth error: invalid or expired token"
         response.raise_for_status()
         
         data = response.json()
         logger.info(f"API response status: {response.status_code}, type: {type(data)}")
-        if isinstance(data, dict):
-            logger.info(f"API response keys: {list(data.keys())}")
-        logger.debug(f"API response content: {str(data)[:500]}")
-        
-        # Возвращаем список напрямую (как в официальной библиотеке)
-        if isinstance(data, dict):
-            # Проверяем различные возможные ключи
-            if "results" in data:
-                results = data["results"]
-                if isinstance(results, list):
-                    # Нормализуем данные: извлекаем модель и редкость из attributes
-                    normalized_results = []
-                    for item in results:
-                        if isinstance(item, dict):
-                            # Извлекаем модель из attributes
-                            model = None
-                            model_rarity = None
-                            if "attributes" in item and isinstance(item["attributes"], list):
-                                for attr in item["attributes"]:
-                                    if isinstance(attr, dict) and attr.get("type") == "model":
-                                        model = attr.get("value")
-                                        rarity_per_mille = attr.get("rarity_per_mille")
-                                        if rarity_per_mille is not None:
-                                            model_rarity = f"{rarity_per_mille}%"
-                                        break
-                            
-                            # Добавляем нормализованные поля
-                            normalized_item = item.copy()
-                            if model:
-                                normalized_item["model"] = model
-                            if model_rarity:
-                                normalized_item["model_rarity"] = model_rarity
-                            
-                            normalized_results.append(normalized_item)
-                        else:
-                            normalized_results.append(item)
-                    
-                    return normalized_results if normalized_results else []
-                else:
-                    logger.warning(f"Unexpected 'results' type: {type(results)}")
-                    return []
-            elif "items" in data:
-                items = data["items"]
-                if isinstance(items, list):
-                    return items if items else []
-                else:
-                    logger.warning(f"Unexpected 'items' type: {type(items)}")
-                    return []
-            elif "data" in data:
-                data_content = data["data"]
-                if isinstance(data_content, list):
-                    return data_content if data_content else []
-                elif isinstance(data_content, dict) and "results" in data_content:
-                    return data_content["results"] if data_content["results"] else []
-                else:
-                    logger.warning(f"Unexpected 'data' type: {type(data_content)}")
-                    return []
-            else:
-                # Если это словарь, но нет известных ключей, логируем и возвращаем пустой список
-                logger.warning(f"Unexpected dict structure. Keys: {list(data.keys())}")
-                return []
-        elif isinstance(data, list):
-            return data if data else []
-        else:
-            logger.warning(f"Unexpected response type: {type(data)}, value: {str(data)[:200]}")
-            return []
+        return _parse_search_data(data)
     except requests.exceptions.HTTPError as e:
         return f"HTTP error: {e.response.status_code}"
     except Exception as e:
@@ -268,6 +309,43 @@ def search(
         return f"Error: {str(e)}"
 
 
+async def search_async(
+    gift_name: Optional[List[str]] | str = None,
+    model: Optional[List[str]] | str = None,
+    limit: int = 10,
+    sort: str = "price_asc",
+    authData: Optional[str] = None
+) -> List[Dict[str, Any]] | str:
+    """
+    Корутинная версия search() через общий пул соединений marketplace_http
+    
+    Returns:
+        Список подарков или строка с ошибкой (как search())
+    """
+    if get_client is None:
+        return await asyncio.to_thread(search, gift_name, model, limit, sort, authData)
+    
+    try:
+        URL = _search_url(gift_name, model, limit, sort)
+        logger.debug(f"Portals async search URL: {URL[:200]}...")
+        
+        try:
+            response = await get_client('portals').get(URL, headers=_auth_headers(authData))
+        except Exception as e:
+            logger.error(f"Error making request to Portals API: {e}")
+            return f"Error: Failed to perform, {str(e)}"
+        
+        if response.status_code == 401:
+            return "Auth error: invalid or expired token"
+        if response.status_code >= 400:
+            return f"HTTP error: {response.status_code}"
+        
+        return _parse_search_data(response.json())
+    except Exception as e:
+        logger.error(f"Error in search_async: {e}")
+        return f"Error: {str(e)}"
+
+
 def filterFloors(
     items: List[Dict[str, Any]],
     min_floor_price: Optional[float] = None,
@@ -318,6 +396,7 @@ async def search_by_id(gift_id: str, auth_token: str):
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
         }
         
+        await get_limiter('portals', 'search').acquire()
         try:
             if hasattr(requests, 'Session') and hasattr(requests.Session, 'impersonate'):
                 response = requests.get(
@@ -350,11 +429,311 @@ async def search_by_id(gift_id: str, auth_token: str):
         return None
 
 
+# Сколько снимок коллекции считается свежим (секунды)
+PORTALS_FLOORS_TTL = float(os.getenv('PORTALS_FLOORS_TTL', '60'))
+# Сколько еще можно отдавать устаревший снимок, обновляя его в фоне (секунды)
+PORTALS_FLOORS_STALE_TTL = float(os.getenv('PORTALS_FLOORS_STALE_TTL', '600'))
+
+
+def _item_price(item: Any) -> Optional[float]:
+    """Положительная цена листинга (dict или объект aportalsmp)"""
+    if isinstance(item, dict):
+        price = item.get('price') or item.get('floor_price')
+    else:
+        price = getattr(item, 'price', None)
+    if price is None:
+        return None
+    try:
+        price_float = float(price)
+    except (ValueError, TypeError):
+        return None
+    return price_float if price_float > 0 else None
+
+
+def _min_item_price(items: Any) -> Optional[float]:
+    if isinstance(items, dict):
+        items = items.get('results') or items.get('items') or []
+    if not isinstance(items, list):
+        return None
+    prices = [p for p in (_item_price(item) for item in items) if p is not None]
+    return min(prices) if prices else None
+
+
+def _normalize_model(value: Optional[str]) -> str:
+    if not value:
+        return ""
+    return re.sub(r"\s*\([^)]*\)", "", str(value)).strip().lower()
+
+
+class CollectionFloors:
+    """Флоры одной коллекции: флор коллекции и флоры всех моделей"""
+
+    __slots__ = ('gift_floor', 'models', 'complete', 'fetched_at', 'filters')
+
+    def __init__(self, gift_floor: Optional[float], models: Dict[str, float], complete: bool,
+                 filters: Any = None):
+        self.gift_floor = gift_floor
+        self.models = models  # нормализованная модель -> флор
+        # complete=False — снимок неполный (search(limit=100) или пустой .models), промах не окончательный
+        self.complete = complete
+        self.fetched_at = time.monotonic()
+        # Результат filterFloors: его .model() — основной путь aportalsmp, .models бывает пустым
+        self.filters = filters
+
+    def model_floor(self, model: Optional[str]) -> Optional[float]:
+        if not model:
+            return None
+        key = _normalize_model(model)
+        floor = self.models.get(key)
+        if floor is None and self.filters is not None and callable(getattr(self.filters, 'model', None)):
+            for model_to_try in (model, re.sub(r"\s*\([^)]*\)", "", model).strip()):
+                try:
+                    value = self.filters.model(model_to_try)
+                except Exception:
+                    continue
+                if value is not None:
+                    try:
+                        floor = float(value)
+                    except (ValueError, TypeError):
+                        continue
+                    self.models[key] = floor
+                    break
+        return floor
+
+
+def _floors_from_filters(filters: Any) -> Optional[CollectionFloors]:
+    """Снимок из результата aportalsmp.filterFloors"""
+    if not filters:
+        return None
+    models: Dict[str, float] = {}
+    raw_models = getattr(filters, 'models', None)
+    if isinstance(raw_models, dict):
+        for model_name, floor_price in raw_models.items():
+            if floor_price is None:
+                continue
+            try:
+                models.setdefault(_normalize_model(model_name), float(floor_price))
+            except (ValueError, TypeError):
+                continue
+
+    # Флор коллекции: пробуем известные методы, иначе минимум по моделям
+    gift_floor = None
+    for method_name in ['all', 'collection', 'gift', 'floor', 'min']:
+        if hasattr(filters, method_name):
+            try:
+                method = getattr(filters, method_name)
+                value = method() if callable(method) else method
+                if value is not None:
+                    gift_floor = float(value)
+                    break
+            except Exception as e:
+                logger.debug(f"Method {method_name}() failed: {e}")
+                continue
+    if gift_floor is None and models:
+        gift_floor = min(models.values())
+    # Без .models полнота неизвестна: промах по модели уйдет в search()
+    return CollectionFloors(gift_floor, models, complete=bool(models), filters=filters)
+
+
+def _floors_from_items(items: Any) -> Optional[CollectionFloors]:
+    """Снимок из списка листингов (fallback без aportalsmp)"""
+    if isinstance(items, dict):
+        items = items.get('results') or items.get('items') or []
+    if not isinstance(items, list):
+        return None
+    models: Dict[str, float] = {}
+    for item in items:
+        price = _item_price(item)
+        if price is None:
+            continue
+        model = item.get('model') if isinstance(item, dict) else getattr(item, 'model', None)
+        key = _normalize_model(model)
+        if key and (key not in models or price < models[key]):
+            models[key] = price
+    return CollectionFloors(_min_item_price(items), models, complete=False)
+
+
+async def _fetch_collection_floors_async(gift_name: str, auth_token: str) -> Optional[CollectionFloors]:
+    try:
+        from aportalsmp.gifts import filterFloors as aportals_filter_floors
+        await get_limiter('portals', 'stats').acquire()
+        floors = _floors_from_filters(await aportals_filter_floors(gift_name=gift_name, authData=auth_token))
+        if floors:
+            return floors
+    except ImportError:
+        logger.debug("aportalsmp.filterFloors not available, using search() fallback")
+    except Exception as e:
+        logger.warning(f"Error using filterFloors: {e}, trying search() fallback")
+
+    items = await search_async(gift_name=gift_name, limit=100, sort="price_asc", authData=auth_token)
+    if isinstance(items, str):
+        logger.warning(f"Portals floors: search returned error string: {items}")
+        return None
+    return _floors_from_items(items)
+
+
+def _fetch_collection_floors_sync(gift_name: str, auth_token: str) -> Optional[CollectionFloors]:
+    try:
+        from aportalsmp.gifts import filterFloors as aportals_filter_floors
+        get_limiter('portals', 'stats').acquire_sync()
+        floors = _floors_from_filters(asyncio.run(aportals_filter_floors(gift_name=gift_name, authData=auth_token)))
+        if floors:
+            return floors
+    except ImportError:
+        logger.debug("aportalsmp.filterFloors not available, using search() fallback")
+    except Exception as e:
+        logger.warning(f"Error using filterFloors: {e}, trying search() fallback")
+
+    items = search(gift_name=gift_name, model=None, limit=100, sort="price_asc", authData=auth_token)
+    if isinstance(items, str):
+        logger.warning(f"Portals floors: search returned error string: {items}")
+        return None
+    return _floors_from_items(items)
+
+
+class PortalsFloorService:
+    """
+    Флоры коллекций Portals в памяти: TTL + stale-while-revalidate.
+    Свежий снимок отдается сразу, устаревший — тоже сразу, но с фоновым
+    обновлением; без снимка вызывающий ждет загрузку.
+    """
+
+    def __init__(self, ttl: float = PORTALS_FLOORS_TTL, stale_ttl: float = PORTALS_FLOORS_STALE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self._entries: Dict[str, CollectionFloors] = {}
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()  # ссылки на фоновые обновления, чтобы их не собрал GC
+        self._lock = threading.Lock()
+
+    def _lookup(self, key: str) -> Tuple[Optional[CollectionFloors], bool]:
+        """(снимок, нужно ли обновить)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, True
+        age = time.monotonic() - entry.fetched_at
+        if age > self.stale_ttl:
+            return None, True
+        return entry, age > self.ttl
+
+    def _store(self, key: str, floors: Optional[CollectionFloors]):
+        if floors is not None:
+            self._entries[key] = floors
+
+    def _claim(self, key: str) -> bool:
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _release(self, key: str):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    async def _refresh_async(self, key: str, gift_name: str, auth_token: str) -> Optional[CollectionFloors]:
+        async def _load():
+            floors = await _fetch_collection_floors_async(gift_name, auth_token)
+            self._store(key, floors)
+            return floors
+
+        if coalesce is not None:
+            return await coalesce('portals', 'collection_floors', gift_name, None, _load, ttl=0)
+        return await _load()
+
+    async def _background_refresh(self, key: str, gift_name: str, auth_token: str):
+        try:
+            await self._refresh_async(key, gift_name, auth_token)
+        except Exception as e:
+            logger.warning(f"Portals floors: background refresh failed for '{gift_name}': {e}")
+        finally:
+            self._release(key)
+
+    def _background_refresh_sync(self, key: str, gift_name: str, auth_token: str):
+        try:
+            self._store(key, _fetch_collection_floors_sync(gift_name, auth_token))
+        except Exception as e:
+            logger.warning(f"Portals floors: background refresh failed for '{gift_name}': {e}")
+        finally:
+            self._release(key)
+
+    async def get_async(self, gift_name: str, auth_token: str) -> Optional[CollectionFloors]:
+        key = _normalize_model(gift_name)
+        if not key:
+            return None
+        entry, stale = self._lookup(key)
+        if entry is not None:
+            if stale and self._claim(key):
+                task = asyncio.get_running_loop().create_task(self._background_refresh(key, gift_name, auth_token))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return entry
+        return await self._refresh_async(key, gift_name, auth_token)
+
+    def get(self, gift_name: str, auth_token: str) -> Optional[CollectionFloors]:
+        """Синхронный доступ (потоки, GUI)"""
+        key = _normalize_model(gift_name)
+        if not key:
+            return None
+        entry, stale = self._lookup(key)
+        if entry is not None:
+            if stale and self._claim(key):
+                threading.Thread(
+                    target=self._background_refresh_sync, args=(key, gift_name, auth_token), daemon=True
+                ).start()
+            return entry
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # Внутри работающего цикла блокироваться нельзя: грузим в фоне
+            if self._claim(key):
+                threading.Thread(
+                    target=self._background_refresh_sync, args=(key, gift_name, auth_token), daemon=True
+                ).start()
+            return None
+        floors = _fetch_collection_floors_sync(gift_name, auth_token)
+        self._store(key, floors)
+        return floors
+
+    def invalidate(self, gift_name: Optional[str] = None):
+        if gift_name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(_normalize_model(gift_name), None)
+
+
+floor_service = PortalsFloorService()
+
+
+async def _model_floor_by_search(gift_name: str, model: str, auth_token: str) -> Optional[float]:
+    """Флор модели поиском по конкретной модели (модели нет в неполном снимке)"""
+    model_clean = re.sub(r"\s*\([^)]*\)", "", model).strip() if model else ""
+    items = await search_async(
+        gift_name=gift_name,
+        model=model_clean if model_clean else model,
+        limit=100,
+        sort="price_asc",
+        authData=auth_token
+    )
+    if isinstance(items, str):
+        logger.error(f"search() returned error string: {items}")
+        return None
+    result = _min_item_price(items)
+    if result is not None:
+        logger.info(f"get_model_floor_price result from search: {result} TON")
+    else:
+        logger.warning(f"No valid prices found for '{gift_name}' / '{model}'")
+    return result
+
+
 async def get_model_floor_price(gift_name: str, model: str, auth_token: str) -> Optional[float]:
     """
     Получение флор-цены для конкретной модели подарка
     Использует filterFloors() из aportalsmp согласно документации:
     https://bleach-1.gitbook.io/aportalsmp
+    Флоры берутся из общего снимка коллекции (floor_service)
     
     Args:
         gift_name: Название подарка (без редкости в скобках)
@@ -365,107 +744,29 @@ async def get_model_floor_price(gift_name: str, model: str, auth_token: str) ->
         Флор-цена модели или None
     """
     try:
-        logger.info(f"get_model_floor_price called for '{gift_name}' / '{model}'")
-        
-        # Очищаем модель от редкости в скобках для поиска
-        model_clean = re.sub(r"\s*\([^)]*\)", "", model).strip() if model else ""
-        
-        # Пробуем использовать aportalsmp.filterFloors если доступен
-        try:
-            from aportalsmp.gifts import filterFloors
-            
-            # Используем filterFloors согласно документации
-            filters = await filterFloors(gift_name=gift_name, authData=auth_token)
-            
-            # Получаем флор модели через метод .model()
-            # Пробуем сначала с оригинальной моделью, потом с очищенной
-            model_floor = None
-            for model_to_try in [model, model_clean]:
-                if not model_to_try:
-                    continue
-                try:
-                    model_floor = filters.model(model_to_try)
-                    if model_floor is not None:
-                        break
-                except Exception:
-                    continue
-            
-            if model_floor is not None:
-                result = float(model_floor)
-                logger.info(f"get_model_floor_price result from filterFloors: {result} TON")
+        floors = await floor_service.get_async(gift_name, auth_token)
+        if floors is not None:
+            result = floors.model_floor(model)
+            if result is not None or floors.complete:
+                if result is None:
+                    logger.warning(f"Model '{model}' not found in filterFloors for gift '{gift_name}'")
                 return result
-            else:
-                logger.warning(f"filterFloors.model() returned None for gift '{gift_name}' / model '{model}'")
-                # Пробуем найти модель в .models dict
-                if hasattr(filters, 'models') and filters.models:
-                    model_lower = model_clean.lower()
-                    for model_name, floor_price in filters.models.items():
-                        model_name_clean = re.sub(r"\s*\([^)]*\)", "", model_name).strip().lower()
-                        if model_name_clean == model_lower or model_name.lower() == model_lower:
-                            result = float(floor_price)
-                            logger.info(f"get_model_floor_price result from filters.models: {result} TON (matched '{model_name}')")
-                            return result
-                    logger.warning(f"Model '{model}' not found in filters.models. Available models: {list(filters.models.keys())[:10]}")
-        except ImportError:
-            logger.info("aportalsmp.filterFloors not available, using search() fallback")
-        except Exception as e:
-            logger.warning(f"Error using filterFloors: {e}, trying search() fallback", exc_info=True)
-        
-        # Fallback на search() если filterFloors не доступен или не сработал
-        items = search(
-            gift_name=gift_name,
-            model=model_clean if model_clean else model,
-            limit=100,
-            sort="price_asc",
-            authData=auth_token
-        )
-        
-        logger.info(f"search() returned: type={type(items)}, is_str={isinstance(items, str)}, is_list={isinstance(items, list)}, len={len(items) if isinstance(items, list) else 'N/A'}")
-        
-        if isinstance(items, str):
-            logger.error(f"search() returned error string: {items}")
-            return None
-            
-        if not isinstance(items, list):
-            logger.error(f"search() returned non-list type: {type(items)}")
-            return None
-            
-        if not items:
-            logger.warning(f"No items found for '{gift_name}' / '{model}'")
-            return None
-        
-        # Находим минимальную цену (флор)
-        prices = []
-        for item in items:
-            if isinstance(item, dict):
-                price = item.get('price') or item.get('floor_price')
-            elif hasattr(item, 'price'):
-                price = item.price
-            elif hasattr(item, '__dict__'):
-                price = getattr(item, 'price', None)
-            else:
-                continue
-            
-            if price is not None:
-                try:
-                    price_float = float(price)
-                    if price_float > 0:
-                        prices.append(price_float)
-                except (ValueError, TypeError):
-                    continue
-        
-        if prices:
-            result = min(prices)
-            logger.info(f"get_model_floor_price result from search: {result} TON (from {len(prices)} prices)")
-            return result
-        else:
-            logger.warning(f"No valid prices found in {len(items)} items")
-            return None
+        return await _model_floor_by_search(gift_name, model, auth_token)
     except Exception as e:
         logger.error(f"Error getting model floor price: {e}", exc_info=True)
         return None
 
 
+async def get_gift_floor_price_async(gift_name: str, auth_token: str) -> Optional[float]:
+    """Корутинная версия get_gift_floor_price"""
+    try:
+        floors = await floor_service.get_async(gift_name, auth_token)
+        return floors.gift_floor if floors else None
+    except Exception as e:
+        logger.error(f"Error getting gift floor price: {e}", exc_info=True)
+        return None
+
+
 def get_gift_floor_price(gift_name: str, auth_token: str) -> Optional[float]:
     """
     Получение флор-цены для подарка (все модели)
@@ -479,143 +780,206 @@ def get_gift_floor_price(gift_name: str, auth_token: str) -> Optional[float]:
         Флор-цена подарка или None
     """
     try:
-        logger.info(f"get_gift_floor_price called for '{gift_name}'")
-        
-        # Пробуем использовать aportalsmp.filterFloors если доступен
-        try:
-            import asyncio
-            from aportalsmp.gifts import filterFloors
-            
-            # filterFloors - асинхронная функция
-            try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    # Если event loop уже запущен, используем run_coroutine_threadsafe или fallback
-                    filters = None
-                else:
-                    filters = loop.run_until_complete(filterFloors(gift_name=gift_name, authData=auth_token))
-            except RuntimeError:
-                # Если нет event loop, создаем новый
-                filters = asyncio.run(filterFloors(gift_name=gift_name, authData=auth_token))
-            
-            if filters:
-                # Получаем флор всей коллекции
-                # filterFloors возвращает объект, у которого может быть метод для получения флора коллекции
-                # Или можно получить все модели и найти минимальную цену
-                gift_floor = None
-                
-                # Пробуем разные методы для получения флора коллекции
-                methods_to_try = ['all', 'collection', 'gift', 'floor', 'min']
-                for method_name in methods_to_try:
-                    if hasattr(filters, method_name):
-                        try:
-                            method = getattr(filters, method_name)
-                            if callable(method):
-                                gift_floor = method()
-                            else:
-                                gift_floor = method
-                            if gift_floor is not None:
-                                break
-                        except Exception as e:
-                            logger.debug(f"Method {method_name}() failed: {e}")
-                            continue
-                
-                # Если методы не сработали, пробуем получить минимальную цену из всех моделей
-                if gift_floor is None and hasattr(filters, 'models'):
-                    try:
-                        models_dict = filters.models
-                        if models_dict:
-                            all_floors = [float(v) for v in models_dict.values() if v is not None]
-                            if all_floors:
-                                gift_floor = min(all_floors)
-                                logger.debug(f"Got gift floor from min of all models: {gift_floor}")
-                    except Exception as e:
-                        logger.debug(f"Error getting min from models: {e}")
-                
-                if gift_floor is not None:
-                    result = float(gift_floor)
-                    logger.info(f"get_gift_floor_price result from filterFloors: {result} TON")
-                    return result
-                else:
-                    logger.warning(f"filterFloors methods returned None for gift '{gift_name}', available attributes: {dir(filters)[:20]}")
-        except ImportError:
-            logger.info("aportalsmp.filterFloors not available, using search() fallback")
-        except Exception as e:
-            logger.warning(f"Error using filterFloors: {e}, trying search() fallback", exc_info=True)
-        
-        # Fallback на search() если filterFloors не доступен или не сработал
-        items = search(
-            gift_name=gift_name,
-            model=None,
-            limit=100,
-            sort="price_asc",
-            authData=auth_token
-        )
-        
-        logger.debug(f"get_gift_floor_price: search returned type: {type(items)}")
-        
-        # Обрабатываем разные форматы ответа
-        if isinstance(items, str):
-            logger.warning(f"get_gift_floor_price: search returned error string: {items}")
-            return None
-        
-        if isinstance(items, dict):
-            # Если dict, извлекаем results или items
-            if 'results' in items:
-                items = items.get('results') or []
-                logger.debug(f"get_gift_floor_price: extracted {len(items)} items from 'results'")
-            elif 'items' in items:
-                items = items.get('items') or []
-                logger.debug(f"get_gift_floor_price: extracted {len(items)} items from 'items'")
-            else:
-                logger.warning(f"get_gift_floor_price: dict without results/items: {list(items.keys())}")
-                return None
-        
-        if not isinstance(items, list):
-            logger.warning(f"get_gift_floor_price: items is not a list: {type(items)}")
-            return None
-            
-        if not items:
-            logger.warning(f"get_gift_floor_price: no items found for '{gift_name}'")
-            return None
-        
-        logger.debug(f"get_gift_floor_price: processing {len(items)} items")
-        
-        # Находим минимальную цену (флор)
-        prices = []
-        for item in items:
-            if isinstance(item, dict):
-                price = item.get('price') or item.get('floor_price')
-            elif hasattr(item, 'price'):
-                price = item.price
-            elif hasattr(item, '__dict__'):
-                price = getattr(item, 'price', None)
-            else:
-                continue
-            
-            if price is not None:
-                try:
-                    price_float = float(price)
-                    if price_float > 0:
-                        prices.append(price_float)
-                except (ValueError, TypeError):
-                    continue
-        
-        if prices:
-            result = min(prices)
-            logger.info(f"get_gift_floor_price result: {result} TON (from {len(prices)} valid prices out of {len(items)} items)")
-            return result
-        else:
-            logger.warning(f"get_gift_floor_price: no valid prices found in {len(items)} items")
-            return None
+        floors = floor_service.get(gift_name, auth_token)
+        return floors.gift_floor if floors else None
     except Exception as e:
         logger.error(f"Error getting gift floor price: {e}", exc_info=True)
         return None
 
 
+def get_floors(gift_name: str, model: Optional[str], auth_token: str) -> Tuple[Optional[float], Optional[float]]:
+    """(флор коллекции, флор модели) одним снимком — синхронный доступ для GUI"""
+    try:
+        floors = floor_service.get(gift_name, auth_token)
+    except Exception as e:
+        logger.warning(f"Error getting Portals floors for {gift_name}/{model}: {e}")
+        return None, None
+    if floors is None:
+        return None, None
+    return floors.gift_floor, floors.model_floor(model) if model and model != 'N/A' else None
+
+
+async def get_floors_async(gift_name: str, model: Optional[str], auth_token: str) -> Tuple[Optional[float], Optional[float]]:
+    """Корутинная версия get_floors"""
+    floors = await floor_service.get_async(gift_name, auth_token)
+    if floors is None:
+        return None, None
+    return floors.gift_floor, floors.model_floor(model) if model and model != 'N/A' else None
+
+
+# Параллельность загрузки историй отдельных NFT
+PORTALS_SALES_CONCURRENCY = int(os.getenv('PORTALS_SALES_CONCURRENCY', '6'))
+# Сколько держать историю продаж одного NFT (секунды)
+PORTALS_NFT_SALES_TTL = float(os.getenv('PORTALS_NFT_SALES_TTL', '300'))
+# Максимум записей в кешах историй (LRU: вытесняются давно не использованные)
+PORTALS_NFT_SALES_MAX = int(os.getenv('PORTALS_NFT_SALES_MAX', '5000'))
+PORTALS_MODEL_SALES_MAX = int(os.getenv('PORTALS_MODEL_SALES_MAX', '2000'))
+
+# id NFT -> (время записи, продажи)
+_nft_sales_cache: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+# (подарок, модель) -> (водяной знак — дата самой новой продажи, последние продажи)
+_model_sales_state: "OrderedDict[Tuple[str, str], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+# Кеши читаются и из потоков (синхронные вызовы через to_thread)
+_sales_cache_lock = threading.Lock()
+# Индекс endpoint истории, который ответил последним (остальные дают 404)
+_sales_endpoint_index = 0
+
+
+def _clean_gift_id(gift_id: str) -> str:
+    # Убираем префикс "gift_" если есть
+    return gift_id.split('_')[-1] if '_' in gift_id else gift_id
+
+
+def _lru_put(cache: OrderedDict, key, value, max_entries: int):
+    with _sales_cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_entries:
+            cache.popitem(last=False)
+
+
+def _lru_get(cache: OrderedDict, key):
+    with _sales_cache_lock:
+        entry = cache.get(key)
+        if entry is not None:
+            cache.move_to_end(key)
+        return entry
+
+
+def _cached_nft_sales(clean_id: str) -> Optional[List[Dict[str, Any]]]:
+    entry = _lru_get(_nft_sales_cache, clean_id)
+    if entry is None:
+        return None
+    stored_at, sales = entry
+    if time.monotonic() - stored_at > PORTALS_NFT_SALES_TTL:
+        with _sales_cache_lock:
+            _nft_sales_cache.pop(clean_id, None)
+        return None
+    return sales
+
+
+def _store_nft_sales(clean_id: str, sales: List[Dict[str, Any]]):
+    _lru_put(_nft_sales_cache, clean_id, (time.monotonic(), sales), PORTALS_NFT_SALES_MAX)
+
+
+# Возможные endpoints истории продаж
+_SALES_ENDPOINTS = [
+    "nfts/{id}/sales",
+    "nfts/{id}/history",
+    "sales?nft_id={id}",
+    "nft/{id}/sales",
+]
+
+
+def _sales_endpoints(clean_id: str) -> List[Tuple[int, str]]:
+    """Endpoints истории, начиная с последнего рабочего"""
+    order = list(range(_sales_endpoint_index, len(_SALES_ENDPOINTS))) + list(range(_sales_endpoint_index))
+    return [(i, PORTALS_API_URL + _SALES_ENDPOINTS[i].format(id=clean_id)) for i in order]
+
+
+def _remember_sales_endpoint(index: int):
+    global _sales_endpoint_index
+    _sales_endpoint_index = index
+
+
+def _parse_sales_data(data: Any) -> List[Dict[str, Any]]:
+    """Обрабатываем различные форматы ответа истории продаж"""
+    if isinstance(data, list):
+        return data
+    elif isinstance(data, dict):
+        for key in ("sales", "results", "data"):
+            if key in data:
+                value = data[key]
+                return value if isinstance(value, list) else []
+    return []
+
+
+def _sale_timestamp(sale: Dict[str, Any]) -> float:
+    date = sale.get('date') or sale.get('sold_at') or sale.get('created_at') or sale.get('timestamp') or 0
+    if isinstance(date, str):
+        try:
+            from datetime import datetime
+            return datetime.fromisoformat(date.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            return 0
+    try:
+        return float(date) if date else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+def _sale_key(sale: Dict[str, Any]) -> tuple:
+    # Дубликаты определяем по цене и дате
+    price = sale.get('price') or sale.get('amount') or sale.get('sale_price')
+    date = sale.get('date') or sale.get('sold_at') or sale.get('created_at')
+    return (price, date)
+
+
+def _item_gift_ids(items: Any) -> List[str]:
+    if isinstance(items, str) or not isinstance(items, list):
+        return []
+    ids = []
+    for item in items:
+        gift_id = None
+        if isinstance(item, dict):
+            gift_id = item.get('id') or item.get('gift_id') or item.get('nft_id')
+        elif hasattr(item, 'id'):
+            gift_id = item.id
+        if gift_id:
+            ids.append(str(gift_id))
+    return ids
+
+
+class _ModelSalesCollector:
+    """
+    Собирает продажи модели из историй NFT. Готов, когда найдено limit
+    уникальных продаж новее водяного знака прошлого запроса; старые продажи
+    добираются из сохраненного результата.
+    """
+
+    def __init__(self, gift_name: str, model: str, limit: int):
+        self.key = (gift_name.strip().lower(), (model or '').strip().lower())
+        self.limit = limit
+        self.watermark, self.previous = _lru_get(_model_sales_state, self.key) or (0.0, [])
+        self.sales: List[Dict[str, Any]] = []
+        self.seen: Set[tuple] = set()
+        self.fresh = 0
+
+    def add(self, sales: List[Dict[str, Any]]):
+        for sale in sales or []:
+            if not isinstance(sale, dict):
+                continue
+            key = _sale_key(sale)
+            if key in self.seen:
+                continue
+            self.seen.add(key)
+            self.sales.append(sale)
+            if _sale_timestamp(sale) > self.watermark:
+                self.fresh += 1
+
+    def done(self) -> bool:
+        return self.fresh >= self.limit
+
+    def result(self) -> List[Dict[str, Any]]:
+        merged = list(self.sales)
+        for sale in self.previous:
+            key = _sale_key(sale)
+            if key not in self.seen:
+                self.seen.add(key)
+                merged.append(sale)
+        # Сортируем по дате (новые первые) и берем последние limit
+        merged.sort(key=_sale_timestamp, reverse=True)
+        merged = merged[:max(self.limit, len(self.previous))]
+        if merged:
+            _lru_put(_model_sales_state, self.key, (max(self.watermark, _sale_timestamp(merged[0])), merged),
+                     PORTALS_MODEL_SALES_MAX)
+        return merged[:self.limit]
+
+
 def get_model_sales_history(gift_name: str, model: str, auth_token: str, limit: int = 3) -> List[Dict[str, Any]]:
     """
     Получение истории продаж для модели подарка (не конкретного экземпляра)
+    Истории NFT грузятся пачками по PORTALS_SALES_CONCURRENCY параллельно
     
     Args:
         gift_name: Название подарка
@@ -635,51 +999,45 @@ def get_model_sales_history(gift_name: str, model: str, auth_token: str, limit:
             sort="latest",
             authData=auth_token
         )
+        gift_ids = _item_gift_ids(items)
+        collector = _ModelSalesCollector(gift_name, model, limit)
         
-        if isinstance(items, str) or not isinstance(items, list):
-            return []
-        
-        # Собираем все продажи из всех подарков этой модели
-        all_sales = []
-        for item in items:
-            gift_id = None
-            if isinstance(item, dict):
-                gift_id = item.get('id') or item.get('gift_id') or item.get('nft_id')
-            elif hasattr(item, 'id'):
-                gift_id = item.id
-            
-            if gift_id:
-                # Получаем продажи для каждого подарка
-                sales = get_sales_history(str(gift_id), auth_token, limit=10)
-                all_sales.extend(sales)
-        
-        # Сортируем по дате (новые первые) и берем последние limit
-        def get_sale_date(sale):
-            date = sale.get('date') or sale.get('sold_at') or sale.get('created_at') or sale.get('timestamp') or 0
-            if isinstance(date, str):
-                try:
-                    from datetime import datetime
-                    return datetime.fromisoformat(date.replace('Z', '+00:00')).timestamp()
-                except:
-                    return 0
-            return float(date) if date else 0
+        with ThreadPoolExecutor(max_workers=max(1, PORTALS_SALES_CONCURRENCY)) as pool:
+            for start in range(0, len(gift_ids), PORTALS_SALES_CONCURRENCY):
+                batch = gift_ids[start:start + PORTALS_SALES_CONCURRENCY]
+                for sales in pool.map(lambda gift_id: get_sales_history(gift_id, auth_token, limit=10), batch):
+                    collector.add(sales)
+                if collector.done():
+                    break
         
-        all_sales.sort(key=get_sale_date, reverse=True)
+        return collector.result()
+    except Exception as e:
+        logger.error(f"Error getting model sales history: {e}")
+        return []
+
+
+async def get_model_sales_history_async(gift_name: str, model: str, auth_token: str, limit: int = 3) -> List[Dict[str, Any]]:
+    """Корутинная версия get_model_sales_history через общий пул соединений"""
+    if get_client is None:
+        return await asyncio.to_thread(get_model_sales_history, gift_name, model, auth_token, limit)
+    try:
+        items = await search_async(gift_name=gift_name, model=model, limit=50, sort="latest", authData=auth_token)
+        gift_ids = _item_gift_ids(items)
+        collector = _ModelSalesCollector(gift_name, model, limit)
         
-        # Убираем дубликаты по цене и дате
-        seen = set()
-        unique_sales = []
-        for sale in all_sales:
-            price = sale.get('price') or sale.get('amount') or sale.get('sale_price')
-            date = sale.get('date') or sale.get('sold_at') or sale.get('created_at')
-            key = (price, date)
-            if key not in seen:
-                seen.add(key)
-                unique_sales.append(sale)
-                if len(unique_sales) >= limit:
-                    break
+        for start in range(0, len(gift_ids), PORTALS_SALES_CONCURRENCY):
+            batch = gift_ids[start:start + PORTALS_SALES_CONCURRENCY]
+            results = await asyncio.gather(
+                *[get_sales_history_async(gift_id, auth_token, limit=10) for gift_id in batch],
+                return_exceptions=True
+            )
+            for sales in results:
+                if isinstance(sales, list):
+                    collector.add(sales)
+            if collector.done():
+                break
         
-        return unique_sales[:limit]
+        return collector.result()
     except Exception as e:
         logger.error(f"Error getting model sales history: {e}")
         return []
@@ -698,27 +1056,16 @@ def get_sales_history(gift_id: str, auth_token: str, limit: int = 10) -> List[Di
         Список продаж или пустой список в случае ошибки
     """
     try:
-        # Убираем префикс "gift_" если есть
-        clean_id = gift_id.split('_')[-1] if '_' in gift_id else gift_id
+        clean_id = _clean_gift_id(gift_id)
+        cached = _cached_nft_sales(clean_id)
+        if cached is not None:
+            return cached[:limit]
         
-        headers = {
-            "Authorization": auth_token if auth_token and auth_token.startswith('tma ') else (f"tma {auth_token}" if auth_token else ""),
-            "Accept": "application/json, text/plain, */*",
-            "Origin": "https://portal-market.com",
-            "Referer": "https://portal-market.com/",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
-        }
-        
-        # Пробуем разные возможные endpoints для истории продаж
-        endpoints = [
-            f"{PORTALS_API_URL}nfts/{clean_id}/sales",
-            f"{PORTALS_API_URL}nfts/{clean_id}/history",
-            f"{PORTALS_API_URL}sales?nft_id={clean_id}",
-            f"{PORTALS_API_URL}nft/{clean_id}/sales",
-        ]
-        
-        for endpoint in endpoints:
+        headers = _auth_headers(auth_token)
+        limiter = get_limiter('portals', 'history')
+        for endpoint_index, endpoint in _sales_endpoints(clean_id):
             try:
+                limiter.acquire_sync()
                 if hasattr(requests, 'Session') and hasattr(requests.Session, 'impersonate'):
                     response = requests.get(
                         endpoint,
@@ -733,25 +1080,12 @@ def get_sales_history(gift_id: str, auth_token: str, limit: int = 10) -> List[Di
                         timeout=30
                     )
                 
+                limiter.note_response(response.status_code, response.headers)
                 if response.status_code == 200:
-                    data = response.json()
-                    # Обрабатываем различные форматы ответа
-                    if isinstance(data, list):
-                        return data[:limit] if len(data) > limit else data
-                    elif isinstance(data, dict):
-                        if "sales" in data:
-                            sales = data["sales"]
-                            if isinstance(sales, list):
-                                return sales[:limit] if len(sales) > limit else sales
-                        elif "results" in data:
-                            results = data["results"]
-                            if isinstance(results, list):
-                                return results[:limit] if len(results) > limit else results
-                        elif "data" in data:
-                            data_content = data["data"]
-                            if isinstance(data_content, list):
-                                return data_content[:limit] if len(data_content) > limit else data_content
-                    return []
+                    _remember_sales_endpoint(endpoint_index)
+                    sales = _parse_sales_data(response.json())
+                    _store_nft_sales(clean_id, sales)
+                    return sales[:limit]
                 elif response.status_code == 404:
                     # Endpoint не найден, пробуем следующий
                     continue
@@ -765,3 +1099,32 @@ def get_sales_history(gift_id: str, auth_token: str, limit: int = 10) -> List[Di
         logger.error(f"Error in get_sales_history: {str(e)}")
         return []
 
+
+async def get_sales_history_async(gift_id: str, auth_token: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Корутинная версия get_sales_history (кеш истории по id NFT общий)"""
+    try:
+        clean_id = _clean_gift_id(gift_id)
+        cached = _cached_nft_sales(clean_id)
+        if cached is not None:
+            return cached[:limit]
+        
+        client = get_client('portals')
+        for endpoint_index, endpoint in _sales_endpoints(clean_id):
+            try:
+                response = await client.get(endpoint, headers=_auth_headers(auth_token), rate_class='history')
+                if response.status_code == 200:
+                    _remember_sales_endpoint(endpoint_index)
+                    sales = _parse_sales_data(response.json())
+                    _store_nft_sales(clean_id, sales)
+                    return sales[:limit]
+                elif response.status_code == 404:
+                    continue
+            except Exception as e:
+                logger.debug(f"Error trying endpoint {endpoint}: {e}")
+                continue
+        
+        logger.warning(f"Could not find sales history endpoint for gift_id={gift_id}")
+        return []
+    except Exception as e:
+        logger.error(f"Error in get_sales_history_async: {str(e)}")
+        return []
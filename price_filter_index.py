@@ -0,0 +1,125 @@
+"""
+Фильтры цен пользователей в памяти.
+
+Таблица user_price_filters читается целиком и раскладывается по
+(пользователь, подарок, модель). Проверка листинга идет без обращений к БД:
+сначала фильтр на модель, потом на весь подарок, потом общий фильтр
+пользователя (старая схема без gift_name или gift_name = 'ANY').
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from subscription_index import subscription_key
+
+logger = logging.getLogger(__name__)
+
+# Полная перезагрузка из БД (секунды): фильтры меняет и bot.py
+PRICE_FILTER_RELOAD = float(os.getenv('PRICE_FILTER_RELOAD', '300'))
+
+Key = Tuple[Optional[str], Optional[str]]
+Bounds = Tuple[Optional[float], Optional[float]]
+
+
+def _to_float(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PriceFilterIndex:
+    """Границы min/max по пользователю и ключу (подарок, модель)"""
+
+    def __init__(self):
+        self._filters: Dict[int, Dict[Key, Bounds]] = {}
+        self.loaded_at: Optional[float] = None
+        self._load_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def is_stale(self, max_age: float = PRICE_FILTER_RELOAD) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > max_age
+
+    def build(self, rows: Iterable[Dict[str, Any]]):
+        """Перестроить из строк user_price_filters (любой из двух схем)"""
+        self._filters = {}
+        for row in rows:
+            user_id = row.get('user_id')
+            if user_id is None:
+                continue
+            self.set(user_id, row.get('gift_name'), row.get('model'), row.get('min_price'), row.get('max_price'))
+        self.loaded_at = time.monotonic()
+        logger.info(f"[price_filters] Loaded filters for {len(self._filters)} users")
+
+    def set(self, user_id: int, gift_name: Optional[str], model: Optional[str],
+            min_price: Any, max_price: Any):
+        """Фильтр создан или изменен"""
+        key = subscription_key(gift_name, model)
+        self._filters.setdefault(user_id, {})[key] = (_to_float(min_price), _to_float(max_price))
+
+    def remove(self, user_id: int, gift_name: Optional[str] = None, model: Optional[str] = None):
+        """Фильтр удален"""
+        user_filters = self._filters.get(user_id)
+        if user_filters is None:
+            return
+        user_filters.pop(subscription_key(gift_name, model), None)
+        if not user_filters:
+            del self._filters[user_id]
+
+    def bounds(self, user_id: int, gift_name: str, model: Optional[str]) -> Optional[Bounds]:
+        """Самый точный фильтр пользователя для листинга или None"""
+        user_filters = self._filters.get(user_id)
+        if not user_filters:
+            return None
+        name_key, model_key = subscription_key(gift_name, model if model != 'N/A' else None)
+        if model_key is not None and (name_key, model_key) in user_filters:
+            return user_filters[(name_key, model_key)]
+        if (name_key, None) in user_filters:
+            return user_filters[(name_key, None)]
+        return user_filters.get((None, None))
+
+    def allows(self, user_id: int, gift_name: str, model: Optional[str], price: float) -> bool:
+        bounds = self.bounds(user_id, gift_name, model)
+        if bounds is None:
+            return True
+        min_price, max_price = bounds
+        if min_price is not None and price < min_price:
+            return False
+        if max_price is not None and price > max_price:
+            return False
+        return True
+
+    def filter_users(self, user_ids: Iterable[int], gift_name: str, model: Optional[str], price: float) -> List[int]:
+        """Пользователи, чьи фильтры пропускают листинг (один проход)"""
+        return [user_id for user_id in user_ids if self.allows(user_id, gift_name, model, price)]
+
+    async def ensure_loaded(self, loader: Callable[[], Awaitable[List[Dict[str, Any]]]]) -> bool:
+        """Загрузить фильтры, если их нет или они устарели; False — индекса нет"""
+        if not self.is_stale():
+            return True
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if not self.is_stale():
+                return True
+            try:
+                self.build(await loader())
+            except Exception as e:
+                logger.error(f"[price_filters] Failed to load filters: {e}", exc_info=True)
+                if self.ready:
+                    self.loaded_at = time.monotonic() - PRICE_FILTER_RELOAD + 60
+        return self.ready
+
+    def invalidate(self):
+        self.loaded_at = None
+
+
+price_filter_index = PriceFilterIndex()
@@ -0,0 +1,218 @@
+"""
+Token-bucket лимитер запросов к маркетплейсам.
+
+Один лимитер на пару (маркетплейс, класс эндпоинта): search, stats, history.
+Общий для всех вызывающих (бот, воркеры, ParserService, GUI), работает и из
+корутин (acquire), и из потоков (acquire_sync).
+
+Лимиты переопределяются через env: RATE_LIMIT_<MARKETPLACE>_<CLASS>="<rate>/<burst>",
+например RATE_LIMIT_TONNEL_SEARCH="0.5/1" — 0.5 запроса в секунду, burst 1.
+"""
+
+import asyncio
+import email.utils
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (rate запросов/сек, burst) по умолчанию
+DEFAULT_LIMITS: Dict[Tuple[str, str], Tuple[float, int]] = {
+    ('portals', 'search'): (5.0, 5),
+    ('portals', 'stats'): (2.0, 2),
+    ('portals', 'history'): (3.0, 3),
+    ('tonnel', 'search'): (0.5, 1),  # раньше — фиксированный интервал 2 секунды
+    ('tonnel', 'stats'): (0.2, 1),
+    ('tonnel', 'history'): (0.5, 2),
+    ('mrkt', 'search'): (2.0, 3),
+    ('mrkt', 'stats'): (1.0, 2),
+    ('mrkt', 'history'): (2.0, 2),
+    ('getgems', 'search'): (2.0, 4),
+    ('getgems', 'stats'): (1.0, 2),
+    ('getgems', 'history'): (2.0, 4),
+}
+FALLBACK_LIMIT: Tuple[float, int] = (1.0, 1)
+
+# Пауза после 429 без заголовка Retry-After (секунды)
+DEFAULT_RETRY_AFTER = 2.0
+# Верхняя граница для Retry-After, чтобы кривой заголовок не остановил мониторинг надолго
+MAX_RETRY_AFTER = 60.0
+
+# Функция сна для синхронных вызовов (GUI подставляет eventlet.sleep)
+_sync_sleep: Callable[[float], None] = time.sleep
+# Поток, в котором действует подмена (eventlet без monkey patching живет в одном потоке ОС)
+_sync_sleep_thread: Optional[int] = None
+
+# Наблюдатели за ожиданием: callback(limiter_name, wait_seconds)
+_wait_observers: List[Callable[[str, float], None]] = []
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах (число секунд или HTTP-дата)"""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+        return max(0.0, dt.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _limit_from_env(marketplace: str, endpoint: str) -> Optional[Tuple[float, int]]:
+    raw = os.getenv(f"RATE_LIMIT_{marketplace.upper()}_{endpoint.upper()}")
+    if not raw:
+        return None
+    try:
+        rate_str, _, burst_str = raw.partition('/')
+        rate = float(rate_str)
+        burst = int(burst_str) if burst_str else 1
+        if rate <= 0 or burst < 1:
+            raise ValueError(raw)
+        return rate, burst
+    except ValueError:
+        logger.warning(f"[ratelimit] Invalid RATE_LIMIT_{marketplace.upper()}_{endpoint.upper()}={raw!r}, using default")
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket в форме GCRA: каждый запрос резервирует слот, ожидание
+    считается под блокировкой, а спим уже без нее.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int = 1):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._interval = 1.0 / rate
+        self._tolerance = (self.burst - 1) * self._interval
+        self._tat = time.monotonic()  # theoretical arrival time
+        self._lock = threading.Lock()
+        # Статистика
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.throttled = 0
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now)
+            wait = max(0.0, tat - self._tolerance - now)
+            self._tat = tat + self._interval
+            self.acquired += 1
+            if wait > 0:
+                self.waited += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+        if wait > 0:
+            for observer in _wait_observers:
+                try:
+                    observer(self.name, wait)
+                except Exception:
+                    pass
+        return wait
+
+    async def acquire(self):
+        """Дождаться слота (из корутины)"""
+        wait = self._reserve()
+        if wait > 0:
+            logger.debug(f"[ratelimit] {self.name}: waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self):
+        """Дождаться слота (из потока / синхронного кода)"""
+        wait = self._reserve()
+        if wait > 0:
+            logger.debug(f"[ratelimit] {self.name}: waiting {wait:.2f}s")
+            sleep_sync(wait)
+
+    def penalize(self, retry_after: Optional[float] = None):
+        """Получили 429: никого не пускать ближайшие retry_after секунд"""
+        delay = DEFAULT_RETRY_AFTER if retry_after is None else min(retry_after, MAX_RETRY_AFTER)
+        with self._lock:
+            self.throttled += 1
+            self._tat = max(self._tat, time.monotonic() + delay + self._tolerance)
+        logger.warning(f"[ratelimit] {self.name}: rate limited, pausing {delay:.1f}s")
+
+    def note_response(self, status_code: int, headers: Optional[Dict[str, str]] = None):
+        """Учесть ответ сервера (429 + Retry-After)"""
+        if status_code != 429:
+            return
+        retry_after = None
+        if headers:
+            retry_after = parse_retry_after(headers.get('Retry-After') or headers.get('retry-after'))
+        self.penalize(retry_after)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'acquired': self.acquired,
+            'waited': self.waited,
+            'total_wait': round(self.total_wait, 3),
+            'max_wait': round(self.max_wait, 3),
+            'throttled': self.throttled,
+        }
+
+
+_limiters: Dict[Tuple[str, str], TokenBucket] = {}
+_registry_lock = threading.Lock()
+
+
+def get_limiter(marketplace: str, endpoint: str = 'search') -> TokenBucket:
+    """Общий лимитер для (маркетплейс, класс эндпоинта)"""
+    key = (marketplace, endpoint)
+    limiter = _limiters.get(key)
+    if limiter is not None:
+        return limiter
+    with _registry_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            rate, burst = _limit_from_env(marketplace, endpoint) or DEFAULT_LIMITS.get(key, FALLBACK_LIMIT)
+            limiter = TokenBucket(f"{marketplace}:{endpoint}", rate, burst)
+            _limiters[key] = limiter
+    return limiter
+
+
+def is_rate_limit_error(error: object) -> bool:
+    """Похоже ли сообщение об ошибке библиотеки на 429"""
+    msg = str(error)
+    return "429" in msg or "Too Many Requests" in msg or "CloudFlare" in msg
+
+
+def set_sync_sleep(func: Callable[[float], None]):
+    """
+    Подменить функцию сна для acquire_sync (например, eventlet.sleep).
+    Подмена действует в вызвавшем потоке, фоновые потоки спят через time.sleep.
+    """
+    global _sync_sleep, _sync_sleep_thread
+    _sync_sleep = func
+    _sync_sleep_thread = threading.get_ident()
+
+
+def sleep_sync(seconds: float):
+    """Сон в синхронном коде через текущую функцию сна"""
+    if _sync_sleep_thread is None or _sync_sleep_thread == threading.get_ident():
+        _sync_sleep(seconds)
+    else:
+        time.sleep(seconds)
+
+
+def add_wait_observer(callback: Callable[[str, float], None]):
+    """Подписаться на ожидания лимитеров (для метрик)"""
+    _wait_observers.append(callback)
+
+
+def get_stats() -> Dict[str, Dict[str, float]]:
+    """Статистика всех лимитеров"""
+    return {limiter.name: limiter.stats() for limiter in list(_limiters.values())}
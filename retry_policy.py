@@ -0,0 +1,237 @@
+"""
+Единая политика повторов для оберток маркетплейсов.
+
+Экспоненциальная задержка с джиттером, правила по классу ошибки
+(429, ошибки соединения, 5xx, 400), общий бюджет повторов на процесс
+и счетчики повторов по эндпоинтам. В корутинах ждет через asyncio.sleep,
+в синхронном коде — через rate_limiter.sleep_sync (в GUI это eventlet.sleep).
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from rate_limiter import parse_retry_after, sleep_sync
+
+logger = logging.getLogger(__name__)
+
+# Классы ошибок
+RATE_LIMIT = 'rate_limit'
+CONNECTION = 'connection'
+SERVER = 'server'
+BAD_REQUEST = 'bad_request'
+OTHER = 'other'
+
+
+@dataclass(frozen=True)
+class RetryRule:
+    retry: bool
+    base_delay: float = 1.0
+
+
+# Правила по умолчанию: 400 не повторяем (вызывающий делает fallback)
+DEFAULT_RULES: Dict[str, RetryRule] = {
+    RATE_LIMIT: RetryRule(retry=True, base_delay=2.0),
+    CONNECTION: RetryRule(retry=True, base_delay=0.5),
+    SERVER: RetryRule(retry=True, base_delay=1.0),
+    BAD_REQUEST: RetryRule(retry=False),
+    OTHER: RetryRule(retry=False),
+}
+
+MAX_ATTEMPTS = 3
+MAX_DELAY = 10.0
+
+
+class RetryableHTTPStatus(Exception):
+    """Ответ с кодом, который стоит классифицировать (429, 5xx, 400)"""
+
+    def __init__(self, status_code: int, retry_after: Optional[float] = None, message: str = ""):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(message or f"HTTP status {status_code}")
+
+
+def check_retryable_status(status_code: int, headers: Optional[Dict[str, str]] = None):
+    """Бросить RetryableHTTPStatus для 429 и 5xx, чтобы ответ ушел на повтор"""
+    if status_code == 429 or status_code >= 500:
+        retry_after = parse_retry_after((headers or {}).get('Retry-After') or (headers or {}).get('retry-after'))
+        raise RetryableHTTPStatus(status_code, retry_after)
+
+
+def classify_error(error: BaseException) -> str:
+    """Определить класс ошибки по исключению или тексту ошибки библиотеки"""
+    if isinstance(error, RetryableHTTPStatus):
+        if error.status_code == 429:
+            return RATE_LIMIT
+        if error.status_code >= 500:
+            return SERVER
+        if error.status_code == 400:
+            return BAD_REQUEST
+        return OTHER
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return CONNECTION
+    msg = str(error)
+    if "429" in msg or "Too Many Requests" in msg or "CloudFlare" in msg:
+        return RATE_LIMIT
+    if ("Failed to connect" in msg or "Could not connect" in msg or "curl: (7)" in msg
+            or "Could not resolve host" in msg or "timed out" in msg or "Connection" in msg):
+        return CONNECTION
+    if "400" in msg or "Bad Request" in msg:
+        return BAD_REQUEST
+    return OTHER
+
+
+class RetryBudget:
+    """
+    Общий бюджет повторов: в скользящем окне повторов не больше ratio от числа
+    запросов (но минимум min_retries), чтобы при деградации API не умножать нагрузку.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10, window: float = 10.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._requests = 0
+        self._retries = 0
+
+    def _roll(self):
+        now = time.monotonic()
+        if now - self._window_start >= self.window:
+            self._window_start = now
+            self._requests = 0
+            self._retries = 0
+
+    def record_request(self):
+        with self._lock:
+            self._roll()
+            self._requests += 1
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            self._roll()
+            if self._retries >= max(self.min_retries, int(self._requests * self.ratio)):
+                return False
+            self._retries += 1
+            return True
+
+
+retry_budget = RetryBudget()
+
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def _count(endpoint: str, field: str):
+    with _stats_lock:
+        stats = _stats.setdefault(endpoint, {'calls': 0, 'retries': 0, 'exhausted': 0, 'budget_denied': 0})
+        stats[field] += 1
+
+
+def get_retry_stats() -> Dict[str, Dict[str, int]]:
+    """Счетчики повторов по эндпоинтам"""
+    with _stats_lock:
+        return {k: dict(v) for k, v in _stats.items()}
+
+
+class RetryPolicy:
+    """Политика повторов: число попыток, задержки и правила по классам ошибок"""
+
+    def __init__(
+        self,
+        max_attempts: int = MAX_ATTEMPTS,
+        max_delay: float = MAX_DELAY,
+        rules: Optional[Dict[str, RetryRule]] = None,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.max_delay = max_delay
+        self.rules = rules or DEFAULT_RULES
+        self.budget = budget or retry_budget
+
+    def backoff(self, kind: str, attempt: int, error: BaseException) -> float:
+        """Задержка перед повтором (equal jitter), не меньше Retry-After"""
+        rule = self.rules.get(kind, DEFAULT_RULES[OTHER])
+        cap = min(self.max_delay, rule.base_delay * (2 ** attempt))
+        delay = cap / 2 + random.uniform(0, cap / 2)
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def next_delay(
+        self, endpoint: str, attempt: int, error: BaseException, retry_on: Optional[Iterable[str]]
+    ) -> Optional[float]:
+        """Задержка перед следующей попыткой или None, если повторять нельзя"""
+        kind = classify_error(error)
+        rule = self.rules.get(kind, DEFAULT_RULES[OTHER])
+        allowed = rule.retry if retry_on is None else kind in retry_on
+        if not allowed:
+            return None
+        if attempt >= self.max_attempts - 1:
+            _count(endpoint, 'exhausted')
+            logger.warning(f"[retry] {endpoint}: giving up after {self.max_attempts} attempts ({kind}): {error}")
+            return None
+        if not self.budget.try_spend():
+            _count(endpoint, 'budget_denied')
+            logger.warning(f"[retry] {endpoint}: retry budget exhausted ({kind}): {error}")
+            return None
+        _count(endpoint, 'retries')
+        delay = self.backoff(kind, attempt, error)
+        logger.warning(f"[retry] {endpoint}: {kind}, retry {attempt + 1}/{self.max_attempts - 1} in {delay:.2f}s")
+        return delay
+
+
+default_policy = RetryPolicy()
+
+
+async def retry_async(
+    endpoint: str,
+    func: Callable[[], Awaitable[Any]],
+    policy: Optional[RetryPolicy] = None,
+    retry_on: Optional[Iterable[str]] = None,
+) -> Any:
+    """
+    Выполнить корутину с повторами. func — фабрика корутины без аргументов.
+    Последняя ошибка пробрасывается, классифицировать ее можно через classify_error.
+    """
+    policy = policy or default_policy
+    attempt = 0
+    while True:
+        _count(endpoint, 'calls')
+        policy.budget.record_request()
+        try:
+            return await func()
+        except Exception as e:
+            delay = policy.next_delay(endpoint, attempt, e, retry_on)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def retry_sync(
+    endpoint: str,
+    func: Callable[[], Any],
+    policy: Optional[RetryPolicy] = None,
+    retry_on: Optional[Iterable[str]] = None,
+) -> Any:
+    """Синхронный вариант retry_async"""
+    policy = policy or default_policy
+    attempt = 0
+    while True:
+        _count(endpoint, 'calls')
+        policy.budget.record_request()
+        try:
+            return func()
+        except Exception as e:
+            delay = policy.next_delay(endpoint, attempt, e, retry_on)
+            if delay is None:
+                raise
+            sleep_sync(delay)
+            attempt += 1
@@ -0,0 +1,181 @@
+"""
+Хранилище уже увиденных id листингов.
+
+Порядок вставки (FIFO), вытеснение самых старых по размеру и по TTL,
+проверка принадлежности за O(1). Состояние периодически сохраняется в
+JSON-файл, поэтому после рестарта монитор стартует "теплым": старые
+листинги не приходят повторно и полный baseline не нужен.
+
+Используется монитором bot.py, воркерами src/bot и monitoring_loop GUI.
+У каждого процесса свои файлы (scope), чтобы они не перетирали друг друга.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Каталог для файлов состояния
+SEEN_IDS_DIR = os.getenv('SEEN_IDS_DIR', 'data')
+# Максимум id на маркетплейс
+SEEN_IDS_MAX = int(os.getenv('SEEN_IDS_MAX', '5000'))
+# Сколько помнить id (секунды)
+SEEN_IDS_TTL = float(os.getenv('SEEN_IDS_TTL', str(24 * 3600)))
+# Как часто сохранять на диск (секунды)
+SEEN_IDS_SAVE_INTERVAL = float(os.getenv('SEEN_IDS_SAVE_INTERVAL', '30'))
+# Состояние свежее этого (секунды) считается теплым: baseline не нужен
+SEEN_IDS_WARM_WINDOW = float(os.getenv('SEEN_IDS_WARM_WINDOW', '900'))
+
+
+class SeenIdStore:
+    """Множество id с порядком вставки, лимитом размера и TTL"""
+
+    def __init__(self, name: str, max_size: int = SEEN_IDS_MAX, ttl: Optional[float] = SEEN_IDS_TTL,
+                 path: Optional[str] = None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        # id -> время первого появления (time.time())
+        self._ids: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        # Когда состояние последний раз пополнялось (time.time(), после load — время сохранения)
+        self._touched_at = 0.0
+        # True — первый проход монитора только запоминает id, ничего не рассылая
+        self.needs_baseline = True
+        if path:
+            self.load()
+
+    @property
+    def warm(self) -> bool:
+        """Состояние свежее: можно продолжать без baseline"""
+        return bool(self._ids) and time.time() - self._touched_at <= SEEN_IDS_WARM_WINDOW
+
+    def _expired(self, seen_at: float, now: float) -> bool:
+        return self.ttl is not None and now - seen_at > self.ttl
+
+    def _evict(self, now: float):
+        while self._ids:
+            oldest_id, seen_at = next(iter(self._ids.items()))
+            if len(self._ids) > self.max_size or self._expired(seen_at, now):
+                del self._ids[oldest_id]
+            else:
+                break
+
+    def __contains__(self, item_id: str) -> bool:
+        with self._lock:
+            seen_at = self._ids.get(item_id)
+            if seen_at is None:
+                return False
+            if self._expired(seen_at, time.time()):
+                del self._ids[item_id]
+                return False
+            return True
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, item_id: str) -> bool:
+        """Запомнить id; True — он новый. Повторное добавление не двигает id в очереди"""
+        now = time.time()
+        with self._lock:
+            if item_id in self._ids and not self._expired(self._ids[item_id], now):
+                return False
+            self._ids.pop(item_id, None)
+            self._ids[item_id] = now
+            self._dirty = True
+            self._touched_at = now
+            self._evict(now)
+        return True
+
+    def update(self, item_ids: Iterable[str]):
+        for item_id in item_ids:
+            self.add(item_id)
+
+    def discard(self, item_id: str):
+        with self._lock:
+            if self._ids.pop(item_id, None) is not None:
+                self._dirty = True
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._dirty = True
+        self.needs_baseline = True
+
+    # --- сохранение ---
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            now = time.time()
+            ids = OrderedDict(
+                (str(item_id), float(seen_at)) for item_id, seen_at in data.get('ids', [])
+                if not self._expired(float(seen_at), now)
+            )
+            with self._lock:
+                self._ids = ids
+                self._evict(now)
+            self._touched_at = float(data.get('saved_at') or 0)
+            self.needs_baseline = not self.warm
+            logger.info(f"[seen] {self.name}: loaded {len(self._ids)} ids (warm={self.warm})")
+        except Exception as e:
+            logger.warning(f"[seen] {self.name}: failed to load {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            payload = {'saved_at': time.time(), 'ids': list(self._ids.items())}
+            self._dirty = False
+        self._last_save = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"[seen] {self.name}: failed to save {self.path}: {e}")
+
+    def maybe_save(self, interval: float = SEEN_IDS_SAVE_INTERVAL):
+        """Сохранить, если есть изменения и прошло interval секунд"""
+        if self._dirty and time.monotonic() - self._last_save >= interval:
+            self.save()
+
+
+_stores: Dict[str, SeenIdStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_seen_store(scope: str, marketplace: str, max_size: int = SEEN_IDS_MAX) -> SeenIdStore:
+    """Общее хранилище для (процесс, маркетплейс) с файлом data/seen_<scope>_<marketplace>.json"""
+    name = f"{scope}_{marketplace}"
+    store = _stores.get(name)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(name)
+            if store is None:
+                path = os.path.join(SEEN_IDS_DIR, f"seen_{name}.json")
+                store = SeenIdStore(name, max_size=max_size, path=path)
+                _stores[name] = store
+    return store
+
+
+def save_all(force: bool = False):
+    """Сохранить все хранилища (force — не дожидаясь интервала)"""
+    for store in list(_stores.values()):
+        if force:
+            store.save()
+        else:
+            store.maybe_save()
@@ -0,0 +1,151 @@
+"""
+Склейка одинаковых запросов к маркетплейсам (single-flight).
+
+Ключ — (маркетплейс, операция, нормализованное название, нормализованная модель).
+Параллельные вызовы с одним ключом ждут один и тот же запрос, а результат
+какое-то время держится в коротком кеше: пачка из N одинаковых листингов
+стоит одного запроса к API.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько держать результат (секунды)
+SINGLE_FLIGHT_TTL = float(os.getenv('SINGLE_FLIGHT_TTL', '30'))
+# Максимум записей в кеше результатов
+SINGLE_FLIGHT_MAX_ENTRIES = int(os.getenv('SINGLE_FLIGHT_MAX_ENTRIES', '2000'))
+
+Key = Tuple[str, str, str, str]
+
+
+def normalize_part(value: Optional[str]) -> str:
+    """Название/модель без пометок редкости в скобках, в нижнем регистре"""
+    if not value:
+        return ''
+    value = re.sub(r"\s*\([^)]*\)", "", str(value))
+    return re.sub(r"\s+", " ", value).strip().lower()
+
+
+def make_key(marketplace: str, operation: str, name: Optional[str] = None, model: Optional[str] = None) -> Key:
+    return (marketplace.lower(), operation, normalize_part(name), normalize_part(model))
+
+
+class SingleFlight:
+    """Запросы в полете (по event loop) + короткий кеш результатов"""
+
+    def __init__(self, ttl: float = SINGLE_FLIGHT_TTL, max_entries: int = SINGLE_FLIGHT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._results: Dict[Key, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        # Future привязаны к циклу: gui/server.py создает свои циклы
+        self._inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Key, asyncio.Task]]" = weakref.WeakKeyDictionary()
+        # Статистика
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    def get_cached(self, key: Key) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._results[key]
+                return False, None
+            return True, value
+
+    def _store(self, key: Key, value: Any, ttl: float):
+        if ttl <= 0:
+            return
+        with self._lock:
+            if len(self._results) >= self.max_entries:
+                now = time.monotonic()
+                for k in [k for k, (exp, _) in self._results.items() if exp < now]:
+                    del self._results[k]
+                # Все еще полно — выкидываем самые старые записи
+                while len(self._results) >= self.max_entries:
+                    del self._results[next(iter(self._results))]
+            self._results[key] = (time.monotonic() + ttl, value)
+
+    async def do(self, key: Key, factory: Callable[[], Awaitable[Any]], ttl: Optional[float] = None) -> Any:
+        """
+        Выполнить factory() один раз на ключ. Ошибки, None и строки-ошибки не кешируются,
+        ошибка достается всем, кто ждал этот запрос.
+        """
+        found, value = self.get_cached(key)
+        if found:
+            self.hits += 1
+            return value
+
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.get(loop)
+        if inflight is None:
+            inflight = {}
+            self._inflight[loop] = inflight
+
+        task = inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            ttl = self.ttl if ttl is None else ttl
+
+            async def _run():
+                try:
+                    result = await factory()
+                    # None и строка — это ошибка внутри обертки, такое не кешируем
+                    if result is not None and not isinstance(result, str):
+                        self._store(key, result, ttl)
+                    return result
+                finally:
+                    inflight.pop(key, None)
+
+            task = loop.create_task(_run())
+            inflight[key] = task
+
+        # shield: таймаут одного вызывающего не отменяет запрос для остальных
+        return await asyncio.shield(task)
+
+    def invalidate(self, key: Optional[Key] = None):
+        with self._lock:
+            if key is None:
+                self._results.clear()
+            else:
+                self._results.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'coalesced': self.coalesced,
+            'misses': self.misses,
+            'cached': len(self._results),
+        }
+
+
+_flight = SingleFlight()
+
+
+async def coalesce(
+    marketplace: str,
+    operation: str,
+    name: Optional[str],
+    model: Optional[str],
+    factory: Callable[[], Awaitable[Any]],
+    ttl: Optional[float] = None,
+) -> Any:
+    """Общий single-flight для флоров, истории продаж и поиска самого дешевого листинга"""
+    return await _flight.do(make_key(marketplace, operation, name, model), factory, ttl)
+
+
+def get_stats() -> Dict[str, int]:
+    return _flight.stats()
@@ -53,11 +53,15 @@ class Settings(BaseSettings):
     
     # Performance
     MAX_CONCURRENT_TASKS: int = 10  # Увеличено для параллельной обработки
+    NEW_GIFTS_QUEUE_SIZE: int = 500  # Максимум листингов в очереди обработки
+    NEW_GIFTS_QUEUE_POLICY: str = "drop_oldest"  # drop_oldest / drop_newest
     DB_POOL_SIZE: int = 10
     DB_MAX_OVERFLOW: int = 20
     
     # Cache
     CACHE_TTL: int = 300  # 5 minutes
+    CACHE_L1_MAXSIZE: int = 2048  # Записей в локальном кеше
+    CACHE_L1_MAX_BYTES: int = 32 * 1024 * 1024  # Приблизительный объем локального кеша
     USE_REDIS: bool = False
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
@@ -115,9 +119,13 @@ if not HAS_PYDANTIC:
         NEW_GIFTS_CHECK_INTERVAL = int(os.getenv("NEW_GIFTS_CHECK_INTERVAL", "1"))
         PRICE_CHECK_INTERVAL = int(os.getenv("PRICE_CHECK_INTERVAL", "10"))
         MAX_CONCURRENT_TASKS = int(os.getenv("MAX_CONCURRENT_TASKS", "3"))
+        NEW_GIFTS_QUEUE_SIZE = int(os.getenv("NEW_GIFTS_QUEUE_SIZE", "500"))
+        NEW_GIFTS_QUEUE_POLICY = os.getenv("NEW_GIFTS_QUEUE_POLICY", "drop_oldest")
         DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
         DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
         CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+        CACHE_L1_MAXSIZE = int(os.getenv("CACHE_L1_MAXSIZE", "2048"))
+        CACHE_L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", str(32 * 1024 * 1024)))
         USE_REDIS = os.getenv("USE_REDIS", "false").lower() == "true"
         REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
         REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
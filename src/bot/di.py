@@ -23,6 +23,8 @@ class Container:
         self._db_service: Optional[DatabaseService] = None
         self._cache_service: Optional[CacheService] = None
         self._parser_service: Optional[ParserService] = None
+        self._send_scheduler = None
+        self._notification_dedup = None
     
     async def init_bot(self) -> Bot:
         """Инициализация бота"""
@@ -67,7 +69,9 @@ class Container:
                 redis_host=settings.REDIS_HOST,
                 redis_port=settings.REDIS_PORT,
                 redis_db=settings.REDIS_DB,
-                ttl=settings.CACHE_TTL
+                ttl=settings.CACHE_TTL,
+                l1_maxsize=settings.CACHE_L1_MAXSIZE,
+                l1_max_bytes=settings.CACHE_L1_MAX_BYTES
             )
             await self._cache_service.init()
         return self._cache_service
@@ -79,8 +83,35 @@ class Container:
             self._parser_service = ParserService(cache)
         return self._parser_service
     
+    async def get_send_scheduler(self):
+        """Планировщик исходящих сообщений (лимиты Telegram); None — модуль недоступен"""
+        if self._send_scheduler is None:
+            try:
+                from telegram_sender import TelegramSendScheduler, PhotoFileIdCache
+            except ImportError:
+                return None
+            bot = await self.init_bot()
+            # file_id картинок переживают рестарт, если CacheService работает через Redis
+            photo_cache = PhotoFileIdCache(await self.get_cache_service())
+            self._send_scheduler = TelegramSendScheduler(bot, photo_cache=photo_cache)
+        return self._send_scheduler
+    
+    async def get_notification_dedup(self):
+        """Дедупликация уведомлений между репликами; None — модуль недоступен"""
+        if self._notification_dedup is None:
+            try:
+                from notification_dedup import NotificationDedup
+            except ImportError:
+                return None
+            pool = await self.init_db_pool()
+            self._notification_dedup = NotificationDedup(pool)
+        return self._notification_dedup
+    
     async def shutdown(self):
         """Закрытие всех соединений"""
+        if self._send_scheduler:
+            await self._send_scheduler.stop()
+        
         if self._db_pool:
             self._db_pool.close()
             await self._db_pool.wait_closed()
@@ -88,6 +119,12 @@ class Container:
         if self._cache_service:
             await self._cache_service.close()
         
+        try:
+            from marketplace_http import close_all_clients
+            await close_all_clients()
+        except ImportError:
+            pass
+        
         if self._bot:
             await self._bot.session.close()
 
@@ -248,14 +248,13 @@ async def add_gift_to_db(callback: types.CallbackQuery, state: FSMContext, gift_
         await callback.answer("❌ Выберите хотя бы один маркетплейс в настройках", show_alert=True)
         return
     
-    # Добавляем подарок для каждого включенного маркетплейса
-    for marketplace in enabled_marketplaces:
-        await gift_repo.add(
-            user_id=callback.from_user.id,
-            name=gift_name,
-            model=model,
-            marketplace=marketplace
-        )
+    # Добавляем подарок для всех включенных маркетплейсов одним запросом
+    await gift_repo.add_many(
+        user_id=callback.from_user.id,
+        name=gift_name,
+        model=model,
+        marketplaces=enabled_marketplaces
+    )
     
     model_text = f" ({model})" if model else ""
     await callback.answer(f"✅ Подарок {gift_name}{model_text} добавлен")
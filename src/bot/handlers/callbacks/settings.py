@@ -29,7 +29,7 @@ async def callback_toggle_marketplace(callback: types.CallbackQuery):
     enabled = await marketplace_repo.get_enabled(callback.from_user.id)
     new_state = marketplace not in enabled
     
-    # Переключаем
+    # Переключаем только этот маркетплейс: upsert одной строки не затирает параллельные изменения
     await marketplace_repo.toggle(callback.from_user.id, marketplace, new_state)
     
     # Обновляем клавиатуру
@@ -27,15 +27,8 @@ async def admin_add_user_id(message: types.Message, state: FSMContext):
     try:
         user_id = int(message.text.strip())
         
-        # Добавляем в allowed_users
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute("""
-                    INSERT INTO allowed_users (user_id)
-                    VALUES (%s)
-                    ON DUPLICATE KEY UPDATE user_id = user_id
-                """, (user_id,))
-                await conn.commit()
+        # Добавляем в allowed_users (и в кеш прав)
+        await user_repo.add_allowed_user(user_id)
         
         await message.answer(f"✅ Пользователь {user_id} добавлен в список разрешенных")
         
@@ -62,13 +55,9 @@ async def admin_remove_user_id(message: types.Message, state: FSMContext):
     
     try:
         user_id = int(message.text.strip())
-        pool = await container.init_db_pool()
         
-        # Удаляем из allowed_users
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute("DELETE FROM allowed_users WHERE user_id = %s", (user_id,))
-                await conn.commit()
+        # Удаляем из allowed_users (и из кеша прав)
+        await user_repo.remove_allowed_user(user_id)
         
         await message.answer(f"✅ Пользователь {user_id} удален из списка разрешенных")
         
@@ -17,6 +17,7 @@ from .middlewares.throttling import ThrottlingMiddleware
 from .middlewares.errors import ErrorMiddleware
 from .middlewares.access import AccessControlMiddleware
 from .handlers import register_all_handlers
+from .repositories.user_repo import UserRepository
 
 logging.basicConfig(
     level=getattr(logging, settings.LOG_LEVEL),
@@ -38,6 +39,9 @@ async def on_startup(bot: Bot):
     db_service = await container.get_db_service()
     await db_service.init_schema()
     
+    # Права доступа в память: апдейты проверяются без запросов к БД
+    await UserRepository(await container.init_db_pool()).preload_access()
+    
     logger.info("Bot started successfully")
 
 
@@ -1,6 +1,6 @@
 """Репозитории для работы с БД"""
 
-from .base import BaseRepository
+from .base import BaseRepository, UnitOfWork
 from .user_repo import UserRepository
 from .gift_repo import GiftRepository
 from .marketplace_repo import MarketplaceRepository
@@ -8,6 +8,7 @@ from .price_filter_repo import PriceFilterRepository
 
 __all__ = [
     "BaseRepository",
+    "UnitOfWork",
     "UserRepository",
     "GiftRepository",
     "MarketplaceRepository",
@@ -2,13 +2,81 @@
 Базовый репозиторий с общими методами
 """
 
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterable, Sequence
 import aiomysql
 from abc import ABC, abstractmethod
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Сколько строк/значений IN (...) отправлять одним запросом
+BULK_CHUNK_SIZE = 500
+
+
+def _chunks(items: Sequence, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class UnitOfWork:
+    """
+    Транзакция на одном соединении пула: commit при выходе без ошибки,
+    rollback при исключении.
+
+        async with repo.transaction() as uow:
+            await uow.execute(...)
+            await uow.execute_many(...)
+    """
+    
+    def __init__(self, pool: aiomysql.Pool):
+        self.pool = pool
+        self.conn = None
+        self.cur = None
+    
+    async def __aenter__(self) -> "UnitOfWork":
+        self.conn = await self.pool.acquire()
+        try:
+            await self.conn.begin()
+            self.cur = await self.conn.cursor(aiomysql.DictCursor)
+        except Exception:
+            self.pool.release(self.conn)
+            raise
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.conn.commit()
+            else:
+                await self.conn.rollback()
+        finally:
+            await self.cur.close()
+            self.pool.release(self.conn)
+            self.conn = None
+            self.cur = None
+        return False
+    
+    async def execute(self, query: str, params: Optional[Sequence] = None) -> int:
+        """Выполнить запрос, вернуть число затронутых строк"""
+        await self.cur.execute(query, params)
+        return self.cur.rowcount
+    
+    async def execute_many(self, query: str, rows: Sequence[Sequence], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        """executemany пачками; INSERT ... VALUES aiomysql сам склеивает в многострочный"""
+        affected = 0
+        for chunk in _chunks(list(rows), chunk_size):
+            await self.cur.executemany(query, chunk)
+            affected += max(self.cur.rowcount, 0)
+        return affected
+    
+    async def fetch_one(self, query: str, params: Optional[Sequence] = None) -> Optional[Dict[str, Any]]:
+        await self.cur.execute(query, params)
+        return await self.cur.fetchone()
+    
+    async def fetch_all(self, query: str, params: Optional[Sequence] = None) -> List[Dict[str, Any]]:
+        await self.cur.execute(query, params)
+        return list(await self.cur.fetchall())
+
 
 class BaseRepository(ABC):
     """Базовый класс для репозиториев"""
@@ -51,5 +119,84 @@ class BaseRepository(ABC):
         except Exception as e:
             logger.error(f"Database error in {self.__class__.__name__}: {e}", exc_info=True)
             raise
-
-
+    
+    def transaction(self) -> UnitOfWork:
+        """Несколько запросов одной транзакцией на одном соединении"""
+        return UnitOfWork(self.pool)
+    
+    async def execute_many(self, query: str, rows: Iterable[Sequence], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        """Один и тот же запрос для многих строк — одна транзакция, пачки по chunk_size"""
+        rows = list(rows)
+        if not rows:
+            return 0
+        try:
+            async with self.transaction() as uow:
+                return await uow.execute_many(query, rows, chunk_size)
+        except Exception as e:
+            logger.error(f"Database error in {self.__class__.__name__}: {e}", exc_info=True)
+            raise
+    
+    async def upsert_many(
+        self,
+        table: str,
+        columns: Sequence[str],
+        rows: Iterable[Sequence],
+        update_columns: Optional[Sequence[str]] = None,
+        chunk_size: int = BULK_CHUNK_SIZE
+    ) -> int:
+        """
+        Многострочный INSERT ... ON DUPLICATE KEY UPDATE.
+        update_columns не заданы — INSERT IGNORE (существующие строки не трогаем).
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        row_sql = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        column_sql = ", ".join(columns)
+        affected = 0
+        try:
+            async with self.transaction() as uow:
+                for chunk in _chunks(rows, chunk_size):
+                    values_sql = ", ".join([row_sql] * len(chunk))
+                    params = [value for row in chunk for value in row]
+                    if update_columns:
+                        updates = ", ".join(f"{c} = VALUES({c})" for c in update_columns)
+                        query = f"INSERT INTO {table} ({column_sql}) VALUES {values_sql} ON DUPLICATE KEY UPDATE {updates}"
+                    else:
+                        query = f"INSERT IGNORE INTO {table} ({column_sql}) VALUES {values_sql}"
+                    affected += await uow.execute(query, params)
+        except Exception as e:
+            logger.error(f"Database error in {self.__class__.__name__}: {e}", exc_info=True)
+            raise
+        return affected
+    
+    async def fetch_in(
+        self,
+        query: str,
+        values: Iterable[Any],
+        params_before: Sequence = (),
+        params_after: Sequence = (),
+        chunk_size: int = BULK_CHUNK_SIZE
+    ) -> List[Dict[str, Any]]:
+        """
+        SELECT с большим IN-списком пачками. В query место списка — {placeholders}:
+            "SELECT ... WHERE user_id IN ({placeholders}) AND enabled = TRUE"
+        """
+        values = list(dict.fromkeys(values))
+        if not values:
+            return []
+        results: List[Dict[str, Any]] = []
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cur:
+                    for chunk in _chunks(values, chunk_size):
+                        placeholders = ','.join(['%s'] * len(chunk))
+                        await cur.execute(
+                            query.format(placeholders=placeholders),
+                            tuple(params_before) + tuple(chunk) + tuple(params_after)
+                        )
+                        results.extend(await cur.fetchall())
+        except Exception as e:
+            logger.error(f"Database error in {self.__class__.__name__}: {e}", exc_info=True)
+            raise
+        return results
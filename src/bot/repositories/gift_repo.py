@@ -2,13 +2,19 @@
 Репозиторий для работы с подарками
 """
 
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Set, Tuple, Iterable
 from ..models.entities import Gift
 from .base import BaseRepository
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Индекс подписок (общий для процесса)
+try:
+    from subscription_index import subscription_index
+except ImportError:
+    subscription_index = None
+
 
 class GiftRepository(BaseRepository):
     """Репозиторий подарков"""
@@ -30,6 +36,8 @@ class GiftRepository(BaseRepository):
             gift.marketplace,
             gift.model_floor_price
         ))
+        if subscription_index is not None:
+            subscription_index.add(gift.user_id, gift.name, gift.model)
         return await self.execute("SELECT LAST_INSERT_ID()", fetch=True)
     
     async def get_by_user(self, user_id: int, page: int = 0, per_page: int = 15) -> List[Dict]:
@@ -75,6 +83,8 @@ class GiftRepository(BaseRepository):
                 DELETE FROM gifts 
                 WHERE user_id = %s AND name = %s
             """, (user_id, gift_name))
+        if subscription_index is not None:
+            subscription_index.remove(user_id, gift_name, model)
         return True
     
     async def add(self, user_id: int, name: str, model: Optional[str] = None, marketplace: str = 'portals') -> bool:
@@ -90,8 +100,25 @@ class GiftRepository(BaseRepository):
         except Exception:
             # Подарок уже существует, игнорируем
             pass
+        if subscription_index is not None:
+            subscription_index.add(user_id, name, model_value)
         return True
     
+    async def get_all_subscriptions(self) -> List[Dict]:
+        """Все подписки (user_id, name, model) для индекса подписок"""
+        return await self.fetch_all("SELECT user_id, name, model FROM gifts")
+    
+    async def get_subscribers(self, gift_name: str, model: Optional[str]) -> Optional[Set[int]]:
+        """
+        Пользователи, подписанные на листинг (по индексу подписок).
+        None — индекс недоступен, вызывающий проверяет подписки по старинке.
+        """
+        if subscription_index is None:
+            return None
+        if not await subscription_index.ensure_loaded(self.get_all_subscriptions):
+            return None
+        return subscription_index.match(gift_name, model)
+    
     async def get_by_name_and_model(self, name: str, model: Optional[str], user_id: int) -> Optional[Gift]:
         """Получить подарок по имени и модели"""
         if model:
@@ -126,3 +153,30 @@ class GiftRepository(BaseRepository):
                 WHERE id = %s
             """, (price, gift_id))
 
+    
+    async def get_tracked(self) -> List[Dict]:
+        """Все отслеживаемые подарки для проверки цен"""
+        return await self.fetch_all("SELECT * FROM gifts")
+    
+    async def update_prices(self, updates: List[Tuple]) -> int:
+        """
+        Обновить цены пачкой (executemany, одна транзакция).
+        updates: (price, floor_price, photo_url, model_rarity, model_floor_price,
+                  name, model, user_id, marketplace)
+        """
+        return await self.execute_many("""
+            UPDATE gifts
+            SET price = %s, floor_price = %s, photo_url = %s, model_rarity = %s, model_floor_price = %s
+            WHERE name = %s AND model = %s AND user_id = %s AND marketplace = %s
+        """, updates)
+    
+    async def add_many(self, user_id: int, name: str, model: Optional[str], marketplaces: Iterable[str]) -> int:
+        """Добавить подарок сразу на несколько маркетплейсов одним INSERT"""
+        model_value = model if model is not None else ''
+        rows = [(name, model_value, user_id, marketplace, 0, 0) for marketplace in marketplaces]
+        added = await self.upsert_many(
+            'gifts', ('name', 'model', 'user_id', 'marketplace', 'price', 'floor_price'), rows
+        )
+        if subscription_index is not None and rows:
+            subscription_index.add(user_id, name, model_value)
+        return added
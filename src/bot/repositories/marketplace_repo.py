@@ -30,16 +30,32 @@ class MarketplaceRepository(BaseRepository):
         """, (user_id, marketplace, enabled, enabled))
         return True
     
+    async def set_many(self, user_id: int, states: Dict[str, bool]) -> bool:
+        """Записать состояние нескольких маркетплейсов одним запросом"""
+        await self.upsert_many(
+            'user_marketplaces', ('user_id', 'marketplace', 'enabled'),
+            [(user_id, marketplace, enabled) for marketplace, enabled in states.items()],
+            update_columns=('enabled',)
+        )
+        return True
+    
+    async def get_settings_for_users(self, user_ids: List[int]) -> Dict[int, Dict[str, bool]]:
+        """Все настройки маркетплейсов для списка пользователей: user_id -> {marketplace: enabled}"""
+        results = await self.fetch_in("""
+            SELECT user_id, marketplace, enabled FROM user_marketplaces
+            WHERE user_id IN ({placeholders})
+        """, user_ids)
+        settings: Dict[int, Dict[str, bool]] = {}
+        for r in results:
+            settings.setdefault(r['user_id'], {})[r['marketplace']] = bool(r['enabled'])
+        return settings
+    
     async def get_all_enabled_for_users(self, user_ids: List[int]) -> Dict[int, Set[str]]:
         """Получить включенные маркетплейсы для списка пользователей (батчинг)"""
-        if not user_ids:
-            return {}
-        
-        placeholders = ','.join(['%s'] * len(user_ids))
-        results = await self.fetch_all(f"""
+        results = await self.fetch_in("""
             SELECT user_id, marketplace FROM user_marketplaces 
             WHERE user_id IN ({placeholders}) AND enabled = TRUE
-        """, tuple(user_ids))
+        """, user_ids)
         
         # Группируем по user_id
         user_marketplaces = {}
@@ -50,4 +66,3 @@ class MarketplaceRepository(BaseRepository):
             user_marketplaces[user_id].add(r['marketplace'])
         
         return user_marketplaces
-
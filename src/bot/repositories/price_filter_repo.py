@@ -2,13 +2,20 @@
 Репозиторий для работы с фильтрами цен
 """
 
-from typing import Optional, List
+import aiomysql
+from typing import Optional, List, Iterable
 from ..models.entities import PriceFilter
 from .base import BaseRepository
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Фильтры цен в памяти (общие для процесса)
+try:
+    from price_filter_index import price_filter_index
+except ImportError:
+    price_filter_index = None
+
 
 class PriceFilterRepository(BaseRepository):
     """Репозиторий фильтров цен"""
@@ -24,13 +31,31 @@ class PriceFilterRepository(BaseRepository):
                 updated_at = CURRENT_TIMESTAMP
         """, (
             price_filter.user_id,
-            price_filter.gift_name,
-            price_filter.model,
+            price_filter.gift_name or 'ANY',
+            price_filter.model or '',
             price_filter.min_price,
             price_filter.max_price
         ))
+        if price_filter_index is not None:
+            price_filter_index.set(
+                price_filter.user_id, price_filter.gift_name, price_filter.model,
+                price_filter.min_price, price_filter.max_price
+            )
         return price_filter.user_id
     
+    async def get_all(self) -> List[dict]:
+        """Все фильтры цен (для индекса в памяти)"""
+        return await self.fetch_all("SELECT * FROM user_price_filters")
+    
+    async def _index_ready(self) -> bool:
+        return price_filter_index is not None and await price_filter_index.ensure_loaded(self.get_all)
+    
+    async def filter_users(self, user_ids: Iterable[int], gift_name: str, model: Optional[str], price: float) -> List[int]:
+        """Пользователи, чьи фильтры цены пропускают листинг"""
+        if await self._index_ready():
+            return price_filter_index.filter_users(user_ids, gift_name, model, price)
+        return [user_id for user_id in user_ids if await self.should_process(user_id, gift_name, model, price)]
+    
     async def get_by_gift(self, user_id: int, gift_name: str, model: Optional[str] = None) -> Optional[dict]:
         """Получить фильтр для подарка"""
         # Сначала пробуем старую схему (только user_id) - она более распространена
@@ -56,7 +81,7 @@ class PriceFilterRepository(BaseRepository):
                         else:
                             await cur.execute("""
                                 SELECT * FROM user_price_filters 
-                                WHERE user_id = %s AND gift_name = %s AND model IS NULL
+                                WHERE user_id = %s AND gift_name = %s AND (model IS NULL OR model = '')
                             """, (user_id, gift_name))
                         return await cur.fetchone()
                     except Exception:
@@ -70,6 +95,9 @@ class PriceFilterRepository(BaseRepository):
     async def should_process(self, user_id: int, gift_name: str, model: Optional[str], price: float) -> bool:
         """Проверить, должен ли подарок быть обработан с учетом фильтра"""
         try:
+            if await self._index_ready():
+                return price_filter_index.allows(user_id, gift_name, model, price)
+            
             filter_obj = await self.get_by_gift(user_id, gift_name, model)
             
             if not filter_obj:
@@ -2,13 +2,19 @@
 Репозиторий для работы с пользователями
 """
 
-from typing import Optional, List
+from typing import Optional, List, Set, Tuple
 from ..models.entities import User
 from .base import BaseRepository
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Права доступа в памяти (общие для процесса)
+try:
+    from access_cache import access_cache
+except ImportError:
+    access_cache = None
+
 
 class UserRepository(BaseRepository):
     """Репозиторий пользователей"""
@@ -47,8 +53,23 @@ class UserRepository(BaseRepository):
         results = await self.fetch_all("SELECT * FROM bot_users")
         return [User(**r) for r in results]
     
+    async def get_access_lists(self) -> Tuple[Set[int], Set[int]]:
+        """Все id админов и разрешенных пользователей (для кеша прав)"""
+        admins = await self.fetch_all("SELECT user_id FROM admins")
+        allowed = await self.fetch_all("SELECT user_id FROM allowed_users")
+        return {r['user_id'] for r in admins}, {r['user_id'] for r in allowed}
+    
+    async def _access_ready(self) -> bool:
+        return access_cache is not None and await access_cache.ensure_loaded(self.get_access_lists)
+    
+    async def preload_access(self) -> bool:
+        """Загрузить права в память заранее (на старте)"""
+        return await self._access_ready()
+    
     async def is_admin(self, user_id: int) -> bool:
         """Проверить, является ли пользователь админом"""
+        if await self._access_ready():
+            return access_cache.is_admin(user_id)
         result = await self.fetch_one(
             "SELECT 1 FROM admins WHERE user_id = %s",
             (user_id,)
@@ -57,6 +78,9 @@ class UserRepository(BaseRepository):
     
     async def is_allowed(self, user_id: int) -> bool:
         """Проверить, разрешен ли доступ пользователю"""
+        if await self._access_ready():
+            return access_cache.is_allowed(user_id)
+        
         # Проверяем админа
         if await self.is_admin(user_id):
             return True
@@ -112,6 +136,8 @@ class UserRepository(BaseRepository):
                 username = VALUES(username),
                 updated_at = CURRENT_TIMESTAMP
         """, (user_id, username))
+        if access_cache is not None:
+            access_cache.grant(user_id)
         return True
     
     async def remove_allowed_user(self, user_id: int) -> bool:
@@ -120,6 +146,8 @@ class UserRepository(BaseRepository):
             "DELETE FROM allowed_users WHERE user_id = %s",
             (user_id,)
         )
+        if access_cache is not None:
+            access_cache.revoke(user_id)
         return True
     
     async def list_allowed_users(self) -> List[dict]:
@@ -3,91 +3,227 @@
 """
 
 import asyncio
-from typing import Optional, Any
+import dataclasses
+import hashlib
+import inspect
+from collections import OrderedDict
+from decimal import Decimal
+from enum import Enum
+from typing import Optional, Any, Awaitable, Callable, Dict, Iterable, List, Tuple
 from functools import wraps
 import logging
 import json
-from datetime import datetime, timedelta
+import sys
+import time
 
 logger = logging.getLogger(__name__)
 
+# Ключей в одном MGET/пайплайне
+REDIS_BATCH_SIZE = 500
+# TTL пустых результатов и ошибок по умолчанию (секунды)
+NEGATIVE_TTL = 30
+
+
+class CachedLoadError(Exception):
+    """Загрузка недавно упала, ошибка взята из кеша до истечения negative_ttl"""
+
+
+def _is_empty(value: Any) -> bool:
+    """None и пустые коллекции — кешируются на короткий negative_ttl"""
+    return value is None or (isinstance(value, (list, tuple, set, dict)) and not value)
+
+
+def _normalize_arg(value: Any) -> Any:
+    """
+    Аргумент в JSON-совместимый вид, не зависящий от адресов объектов и порядка.
+    Неподдерживаемые типы — TypeError (self/cls декоратор отбрасывает сам).
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_normalize_arg(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_normalize_arg(item) for item in value), key=repr)
+    if isinstance(value, dict):
+        return {str(k): _normalize_arg(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, Enum):
+        return _normalize_arg(value.value)
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        # Сущности — по полям: разные объекты с разными полями дают разные ключи
+        return {'__type__': type(value).__qualname__,
+                'fields': _normalize_arg({f.name: getattr(value, f.name) for f in dataclasses.fields(value)})}
+    dump = getattr(value, 'model_dump', None) or getattr(value, 'dict', None)
+    if callable(dump) and hasattr(value, '__fields__'):
+        # pydantic v2 / v1
+        return {'__type__': type(value).__qualname__, 'fields': _normalize_arg(dump())}
+    # Иначе ключ либо склеил бы разные аргументы, либо зависел бы от адреса объекта
+    raise TypeError(f"Unsupported argument type for cache key: {type(value).__qualname__}")
+
+
+def make_cache_key(prefix: str, *parts: Any) -> str:
+    """Ключ "prefix:sha1" из нормализованных частей: одинаковый между процессами и рестартами"""
+    payload = json.dumps([_normalize_arg(part) for part in parts], sort_keys=True,
+                         separators=(',', ':'), ensure_ascii=False)
+    return f"{prefix}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+
+def _approx_size(value: Any, depth: int = 0) -> int:
+    """Приблизительный размер значения в байтах (без обхода глубже 3 уровней)"""
+    size = sys.getsizeof(value)
+    if depth >= 3:
+        return size
+    if isinstance(value, dict):
+        size += sum(_approx_size(k, depth + 1) + _approx_size(v, depth + 1) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_approx_size(item, depth + 1) for item in value)
+    return size
+
+
+def _namespace(key: str) -> str:
+    """Пространство имен ключа: все до первого ':'"""
+    return key.split(':', 1)[0]
+
+
 # LRU Cache для локального кеширования
 class LRUCache:
-    """Простой LRU кеш"""
+    """
+    LRU кеш на OrderedDict: get/set/delete за O(1).
+    Записи истекают по TTL (лениво при get и периодической чисткой),
+    размер ограничен числом записей и приблизительным объемом в байтах.
+    Счетчики hit/miss/eviction ведутся по пространствам имен (префикс ключа до ':').
+    """
     
-    def __init__(self, maxsize: int = 128):
+    def __init__(self, maxsize: int = 128, max_bytes: Optional[int] = None,
+                 sweep_interval: float = 60.0):
         self.maxsize = maxsize
-        self.cache = {}
-        self.access_order = []
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        # key -> (value, expire_at (monotonic) или None, size)
+        self.cache: "OrderedDict[str, Tuple[Any, Optional[float], int]]" = OrderedDict()
+        self.bytes = 0
+        self._next_sweep = time.monotonic() + sweep_interval
+        self._stats: Dict[str, Dict[str, int]] = {}
+    
+    def _count(self, key: str, counter: str, amount: int = 1):
+        ns = self._stats.get(_namespace(key))
+        if ns is None:
+            ns = self._stats[_namespace(key)] = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+        ns[counter] += amount
+    
+    def _remove(self, key: str) -> bool:
+        entry = self.cache.pop(key, None)
+        if entry is None:
+            return False
+        self.bytes -= entry[2]
+        return True
+    
+    def _maybe_sweep(self, now: float):
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self._clean_expired(now)
     
     def get(self, key: str) -> Optional[Any]:
         """Получить значение из кеша"""
-        if key in self.cache:
-            # Обновляем порядок доступа
-            if key in self.access_order:
-                self.access_order.remove(key)
-            self.access_order.append(key)
-            return self.cache[key]['value']
-        return None
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        entry = self.cache.get(key)
+        if entry is None:
+            self._count(key, 'misses')
+            return None
+        value, expire_at, _ = entry
+        if expire_at is not None and expire_at <= now:
+            self._remove(key)
+            self._count(key, 'expired')
+            self._count(key, 'misses')
+            return None
+        self.cache.move_to_end(key)
+        self._count(key, 'hits')
+        return value
     
     def set(self, key: str, value: Any, ttl: Optional[int] = None):
         """Установить значение в кеш"""
-        expire_at = None
-        if ttl:
-            expire_at = datetime.now() + timedelta(seconds=ttl)
-        
-        # Если ключ уже есть, обновляем
-        if key in self.cache:
-            self.cache[key] = {'value': value, 'expire_at': expire_at}
-            if key in self.access_order:
-                self.access_order.remove(key)
-            self.access_order.append(key)
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        expire_at = now + ttl if ttl else None
+        size = _approx_size(key) + _approx_size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Одно значение больше всего кеша — не кешируем
+            self._remove(key)
             return
         
-        # Если кеш полон, удаляем самый старый
-        if len(self.cache) >= self.maxsize:
-            oldest = self.access_order.pop(0)
-            del self.cache[oldest]
+        self._remove(key)
+        self.cache[key] = (value, expire_at, size)
+        self.bytes += size
         
-        self.cache[key] = {'value': value, 'expire_at': expire_at}
-        self.access_order.append(key)
+        # Вытесняем самые давно использованные
+        while len(self.cache) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            oldest, (_, _, oldest_size) = self.cache.popitem(last=False)
+            self.bytes -= oldest_size
+            self._count(oldest, 'evictions')
     
     def delete(self, key: str):
         """Удалить ключ из кеша"""
-        if key in self.cache:
-            del self.cache[key]
-            if key in self.access_order:
-                self.access_order.remove(key)
+        self._remove(key)
     
     def clear(self):
         """Очистить кеш"""
         self.cache.clear()
-        self.access_order.clear()
+        self.bytes = 0
     
-    def _clean_expired(self):
+    def _clean_expired(self, now: Optional[float] = None):
         """Очистить истекшие записи"""
-        now = datetime.now()
-        expired = []
-        for key, data in self.cache.items():
-            if data['expire_at'] and data['expire_at'] < now:
-                expired.append(key)
-        
+        now = now if now is not None else time.monotonic()
+        expired = [key for key, (_, expire_at, _) in self.cache.items()
+                   if expire_at is not None and expire_at <= now]
         for key in expired:
-            self.delete(key)
+            self._remove(key)
+            self._count(key, 'expired')
+    
+    def __len__(self) -> int:
+        return len(self.cache)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Размер и счетчики по пространствам имен"""
+        return {
+            'entries': len(self.cache),
+            'bytes': self.bytes,
+            'maxsize': self.maxsize,
+            'max_bytes': self.max_bytes,
+            'namespaces': {ns: dict(counters) for ns, counters in self._stats.items()},
+        }
 
 
 class CacheService:
     """Сервис кеширования с поддержкой Redis"""
     
     def __init__(self, use_redis: bool = False, redis_host: str = "localhost", 
-                 redis_port: int = 6379, redis_db: int = 0, ttl: int = 300):
+                 redis_port: int = 6379, redis_db: int = 0, ttl: int = 300,
+                 l1_maxsize: int = 512, l1_max_bytes: Optional[int] = None):
         self.use_redis = use_redis
         self.redis_host = redis_host
         self.redis_port = redis_port
         self.redis_db = redis_db
         self.ttl = ttl
-        self.lru_cache = LRUCache(maxsize=512)
+        self.lru_cache = LRUCache(maxsize=l1_maxsize, max_bytes=l1_max_bytes)
         self.redis_client = None
+        # Фоновые обновления (stale-while-revalidate): ключ -> задача
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        # Обращения к ключу с последнего обновления (для refresh-ahead)
+        self._key_hits: Dict[str, int] = {}
+        self.swr_stale_served = 0
+        self.swr_refreshes = 0
+        self.swr_refresh_errors = 0
+        # Загрузки get_or_load в полете: ключ -> задача
+        self._loading: Dict[str, asyncio.Task] = {}
+        self.load_calls = 0
+        self.load_coalesced = 0
+        self.load_negative_hits = 0
     
     async def init(self):
         """Инициализация Redis если нужно"""
@@ -106,6 +242,21 @@ class CacheService:
                 logger.warning(f"Failed to connect to Redis: {e}, using LRU cache only")
                 self.use_redis = False
     
+    def _fill_l1(self, key: str, value: Any, pttl: Optional[int]):
+        """
+        Положить значение из Redis в L1 не дольше, чем оно проживет в Redis:
+        короткие TTL (негативный кеш) не растягиваются до self.ttl
+        """
+        if pttl is None or pttl == -1:
+            # Ключ без срока в Redis
+            ttl = self.ttl
+        elif pttl <= 0:
+            # Уже истек (или удален между командами) — в L1 не кладем
+            return
+        else:
+            ttl = min(self.ttl, pttl / 1000)
+        self.lru_cache.set(key, value, ttl)
+    
     async def get(self, key: str) -> Optional[Any]:
         """Получить значение из кеша"""
         # Проверяем LRU кеш
@@ -116,11 +267,15 @@ class CacheService:
         # Проверяем Redis
         if self.use_redis and self.redis_client:
             try:
-                data = await self.redis_client.get(key)
+                # Значение и оставшийся TTL за один round-trip
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.get(key)
+                pipe.pttl(key)
+                data, pttl = await pipe.execute()
                 if data:
                     value = json.loads(data)
                     # Сохраняем в LRU для быстрого доступа
-                    self.lru_cache.set(key, value, self.ttl)
+                    self._fill_l1(key, value, pttl)
                     return value
             except Exception as e:
                 logger.error(f"Redis get error: {e}")
@@ -142,6 +297,74 @@ class CacheService:
             except Exception as e:
                 logger.error(f"Redis set error: {e}")
     
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Значения нескольких ключей: L1, остальные одним MGET (+PTTL в том же пайплайне).
+        В результате только найденные ключи; найденное в Redis кладется в L1.
+        """
+        result: Dict[str, Any] = {}
+        misses: List[str] = []
+        for key in dict.fromkeys(keys):
+            value = self.lru_cache.get(key)
+            if value is not None:
+                result[key] = value
+            else:
+                misses.append(key)
+        
+        if misses and self.use_redis and self.redis_client:
+            try:
+                for chunk_start in range(0, len(misses), REDIS_BATCH_SIZE):
+                    chunk = misses[chunk_start:chunk_start + REDIS_BATCH_SIZE]
+                    pipe = self.redis_client.pipeline(transaction=False)
+                    pipe.mget(chunk)
+                    for key in chunk:
+                        pipe.pttl(key)
+                    values, *pttls = await pipe.execute()
+                    for key, data, pttl in zip(chunk, values, pttls):
+                        if data:
+                            value = json.loads(data)
+                            self._fill_l1(key, value, pttl)
+                            result[key] = value
+            except Exception as e:
+                logger.error(f"Redis mget error: {e}")
+        
+        return result
+    
+    async def set_many(self, items: Dict[str, Any], ttl: Optional[int] = None):
+        """Записать несколько ключей: в L1 и одним пайплайном в Redis"""
+        if not items:
+            return
+        ttl = ttl or self.ttl
+        
+        for key, value in items.items():
+            self.lru_cache.set(key, value, ttl)
+        
+        if self.use_redis and self.redis_client:
+            try:
+                pairs = list(items.items())
+                for chunk_start in range(0, len(pairs), REDIS_BATCH_SIZE):
+                    # Без MULTI/EXEC: атомарность не нужна, только один round-trip
+                    pipe = self.redis_client.pipeline(transaction=False)
+                    for key, value in pairs[chunk_start:chunk_start + REDIS_BATCH_SIZE]:
+                        pipe.setex(key, ttl, json.dumps(value))
+                    await pipe.execute()
+            except Exception as e:
+                logger.error(f"Redis pipeline set error: {e}")
+    
+    async def delete_many(self, keys: Iterable[str]):
+        """Удалить несколько ключей (одна команда DEL)"""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return
+        for key in keys:
+            self.lru_cache.delete(key)
+        
+        if self.use_redis and self.redis_client:
+            try:
+                await self.redis_client.delete(*keys)
+            except Exception as e:
+                logger.error(f"Redis delete error: {e}")
+    
     async def delete(self, key: str):
         """Удалить ключ из кеша"""
         self.lru_cache.delete(key)
@@ -162,38 +385,193 @@ class CacheService:
             except Exception as e:
                 logger.error(f"Redis clear error: {e}")
     
+    def stats(self) -> Dict[str, Any]:
+        """Метрики локального (L1) кеша"""
+        stats = self.lru_cache.stats()
+        stats['swr'] = {
+            'stale_served': self.swr_stale_served,
+            'refreshes': self.swr_refreshes,
+            'refresh_errors': self.swr_refresh_errors,
+            'in_flight': len(self._refreshing),
+        }
+        stats['loader'] = {
+            'loads': self.load_calls,
+            'coalesced': self.load_coalesced,
+            'negative_hits': self.load_negative_hits,
+            'in_flight': len(self._loading),
+        }
+        return stats
+    
+    # --- загрузка с негативным кешем ---
+    
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: Optional[int] = None,
+        negative_ttl: int = NEGATIVE_TTL,
+        is_empty: Callable[[Any], bool] = _is_empty
+    ) -> Any:
+        """
+        Значение ключа или результат loader(); параллельные промахи ждут одну загрузку.
+        Пустой результат (is_empty) и ошибка кешируются на negative_ttl
+        (0 — не кешировать), закешированная ошибка поднимается как CachedLoadError.
+        """
+        entry = await self.get(key)
+        if isinstance(entry, dict):
+            if 'error' in entry:
+                self.load_negative_hits += 1
+                raise CachedLoadError(entry['error'])
+            if 'value' in entry:
+                if entry.get('empty'):
+                    self.load_negative_hits += 1
+                return entry['value']
+        
+        task = self._loading.get(key)
+        if task is not None and not task.done():
+            self.load_coalesced += 1
+        else:
+            async def _run():
+                self.load_calls += 1
+                try:
+                    value = await loader()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if negative_ttl > 0:
+                        await self.set(key, {'error': f"{type(e).__name__}: {e}"}, negative_ttl)
+                    raise
+                else:
+                    if not is_empty(value):
+                        await self.set(key, {'value': value}, ttl)
+                    elif negative_ttl > 0:
+                        await self.set(key, {'value': value, 'empty': True}, negative_ttl)
+                    return value
+                finally:
+                    self._loading.pop(key, None)
+            
+            task = asyncio.get_running_loop().create_task(_run())
+            # Ошибку получат ожидающие; здесь только помечаем ее полученной
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._loading[key] = task
+        
+        # shield: отмена одного вызывающего не отменяет загрузку для остальных
+        return await asyncio.shield(task)
+    
+    # --- stale-while-revalidate ---
+    
+    async def _store_envelope(self, key: str, value: Any, soft_ttl: int, hard_ttl: int):
+        envelope = {'value': value, 'fresh_until': time.time() + soft_ttl}
+        await self.set(key, envelope, hard_ttl)
+    
+    def _refresh(self, key: str, loader: Callable[[], Awaitable[Any]],
+                 soft_ttl: int, hard_ttl: int) -> asyncio.Task:
+        """Одно обновление ключа за раз: повторные вызовы получают ту же задачу"""
+        task = self._refreshing.get(key)
+        if task is not None and not task.done():
+            return task
+        
+        async def _run():
+            try:
+                value = await loader()
+                await self._store_envelope(key, value, soft_ttl, hard_ttl)
+                self.swr_refreshes += 1
+                return value
+            except Exception as e:
+                self.swr_refresh_errors += 1
+                logger.warning(f"Cache refresh failed for {key}: {e}")
+                raise
+            finally:
+                self._refreshing.pop(key, None)
+                self._key_hits.pop(key, None)
+        
+        task = asyncio.get_running_loop().create_task(_run())
+        # Ошибку фонового обновления уже залогировали
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._refreshing[key] = task
+        return task
+    
+    async def get_or_refresh(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        soft_ttl: int,
+        hard_ttl: Optional[int] = None,
+        refresh_ahead: float = 0.0,
+        refresh_ahead_hits: int = 3
+    ) -> Any:
+        """
+        Значение с мягким и жестким TTL.
+        До soft_ttl значение свежее; после — отдается устаревшее, а одно
+        обновление идет в фоне; после hard_ttl ключа нет и loader ждут.
+        refresh_ahead (доля soft_ttl): популярный ключ (не меньше
+        refresh_ahead_hits обращений) обновляется в фоне еще до устаревания.
+        """
+        hard_ttl = hard_ttl or soft_ttl * 10
+        envelope = await self.get(key)
+        if isinstance(envelope, dict) and 'fresh_until' in envelope:
+            left = envelope['fresh_until'] - time.time()
+            if left <= 0:
+                self.swr_stale_served += 1
+                self._refresh(key, loader, soft_ttl, hard_ttl)
+            elif refresh_ahead > 0:
+                hits = self._key_hits.get(key, 0) + 1
+                self._key_hits[key] = hits
+                if hits >= refresh_ahead_hits and left <= soft_ttl * refresh_ahead:
+                    self._refresh(key, loader, soft_ttl, hard_ttl)
+            return envelope['value']
+        
+        # Промах: ждем загрузку (одну на всех ожидающих)
+        return await asyncio.shield(self._refresh(key, loader, soft_ttl, hard_ttl))
+    
+    async def warm(self, key: str, loader: Callable[[], Awaitable[Any]],
+                   soft_ttl: int, hard_ttl: Optional[int] = None):
+        """Заполнить ключ заранее (ошибка не пробрасывается)"""
+        try:
+            await self.get_or_refresh(key, loader, soft_ttl, hard_ttl)
+        except Exception as e:
+            logger.warning(f"Cache warm-up failed for {key}: {e}")
+    
     async def close(self):
         """Закрыть соединения"""
+        for task in list(self._refreshing.values()) + list(self._loading.values()):
+            task.cancel()
         if self.redis_client:
             await self.redis_client.close()
 
 
-def cached(ttl: int = 300, key_prefix: str = ""):
-    """Декоратор для кеширования результатов функции"""
+def cached(ttl: int = 300, key_prefix: str = "", negative_ttl: int = NEGATIVE_TTL,
+           is_empty: Callable[[Any], bool] = _is_empty):
+    """
+    Декоратор для кеширования результатов async-функции через CacheService.
+    Ключ — хеш нормализованных аргументов (self/cls не входят), пустые
+    результаты и ошибки живут negative_ttl, параллельные промахи склеиваются.
+    """
     def decorator(func):
+        signature = inspect.signature(func)
+        prefix = key_prefix or "cached"
+        
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            # Формируем ключ кеша
-            cache_key = f"{key_prefix}:{func.__name__}:{str(args)}:{str(kwargs)}"
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = list(bound.arguments.items())
+            if arguments and arguments[0][0] in ('self', 'cls'):
+                arguments = arguments[1:]
+            try:
+                cache_key = make_cache_key(f"{prefix}:{func.__qualname__}", dict(arguments))
+            except TypeError as e:
+                # Аргумент без стабильного ключа — вызываем без кеша, а не падаем
+                logger.debug(f"[cache] {func.__qualname__} called uncached: {e}")
+                return await func(*args, **kwargs)
             
-            # Получаем сервис кеша из контекста (нужно передавать через DI)
-            # Для упрощения используем глобальный экземпляр
+            # Сервис кеша берем из DI-контейнера (импорт здесь — иначе цикл импортов)
             from ..di import container
             cache_service = await container.get_cache_service()
             
-            # Пытаемся получить из кеша
-            cached_value = await cache_service.get(cache_key)
-            if cached_value is not None:
-                return cached_value
-            
-            # Выполняем функцию
-            result = await func(*args, **kwargs)
-            
-            # Сохраняем в кеш
-            await cache_service.set(cache_key, result, ttl)
-            
-            return result
+            return await cache_service.get_or_load(
+                cache_key, lambda: func(*args, **kwargs),
+                ttl=ttl, negative_ttl=negative_ttl, is_empty=is_empty
+            )
         return wrapper
     return decorator
-
-
@@ -8,6 +8,12 @@ from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+# Версионные миграции (общие с bot.py)
+try:
+    from db_migrations import run_migrations
+except ImportError:
+    run_migrations = None
+
 
 class DatabaseService:
     """Сервис для инициализации и управления БД"""
@@ -17,6 +23,9 @@ class DatabaseService:
     
     async def init_schema(self):
         """Инициализация схемы БД"""
+        if run_migrations is not None:
+            await run_migrations(self.pool)
+            return
         try:
             async with self.pool.acquire() as conn:
                 async with conn.cursor() as cur:
@@ -21,14 +21,26 @@ except ImportError:
         update_auth = None
 
 try:
-    from tonnelmp_wrapper import search_tonnel
+    from tonnelmp_wrapper import search_tonnel, search_tonnel_async
 except ImportError:
     search_tonnel = None
+    search_tonnel_async = None
 
 try:
-    from mrktmp_wrapper import search_mrkt
+    from mrktmp_wrapper import search_mrkt, search_mrkt_async
 except ImportError:
     search_mrkt = None
+    search_mrkt_async = None
+
+try:
+    from mrktmp_wrapper import collect_mrkt_listings
+except ImportError:
+    collect_mrkt_listings = None
+
+try:
+    from rate_limiter import get_limiter
+except ImportError:
+    get_limiter = None
 
 try:
     from getgems_wrapper import search_getgems
@@ -36,6 +48,15 @@ except ImportError:
     search_getgems = None
 
 
+# Мягкий/жесткий TTL (секунды): после мягкого отдаем устаревшее и обновляем в фоне
+GIFT_NAMES_SOFT_TTL = 600
+GIFT_NAMES_HARD_TTL = 6 * 3600
+MODELS_SOFT_TTL = 300
+MODELS_HARD_TTL = 3600
+
+ALL_MARKETPLACES = ['portals', 'tonnel', 'mrkt', 'getgems']
+
+
 class ParserService:
     """Сервис для парсинга подарков"""
     
@@ -47,14 +68,8 @@ class ParserService:
         """Получить все уникальные названия подарков с маркетплейса"""
         cache_key = f"gift_names:{marketplace}"
         
-        # Проверяем кеш
-        cached = await self.cache.get(cache_key)
-        if cached is not None:
-            return set(cached)
-        
-        gift_names = set()
-        
-        try:
+        async def _load() -> List[str]:
+            gift_names = set()
             if marketplace == 'portals' and search:
                 gift_names = await self._get_portals_gift_names()
             elif marketplace == 'tonnel' and search_tonnel:
@@ -63,13 +78,18 @@ class ParserService:
                 gift_names = await self._get_mrkt_gift_names()
             elif marketplace == 'getgems' and search_getgems:
                 gift_names = await self._get_getgems_gift_names()
+            return list(gift_names)
+        
+        # Свежие 10 минут, потом отдаются устаревшие, пока обход идет в фоне
+        try:
+            names = await self.cache.get_or_refresh(
+                cache_key, _load,
+                soft_ttl=GIFT_NAMES_SOFT_TTL, hard_ttl=GIFT_NAMES_HARD_TTL, refresh_ahead=0.2
+            )
         except Exception as e:
             logger.error(f"Error getting gift names from {marketplace}: {e}", exc_info=True)
-        
-        # Сохраняем в кеш
-        await self.cache.set(cache_key, list(gift_names), ttl=600)  # 10 минут
-        
-        return gift_names
+            return set()
+        return set(names)
     
     async def _get_portals_gift_names(self) -> Set[str]:
         """Получить названия подарков с Portals"""
@@ -108,6 +128,8 @@ class ParserService:
                     "Referer": "https://portal-market.com/",
                 }
                 
+                if get_limiter:
+                    await get_limiter('portals', 'search').acquire()
                 if hasattr(requests_lib, 'Session') and hasattr(requests_lib.Session, 'impersonate'):
                     session = requests_lib.Session(impersonate="chrome110")
                     response = session.get(collections_url, headers=headers, timeout=30)
@@ -137,6 +159,8 @@ class ParserService:
                     
                     for _ in range(10):  # Максимум 1000 подарков
                         if inspect.iscoroutinefunction(search):
+                            if get_limiter:
+                                await get_limiter('portals', 'search').acquire()
                             items = await search(limit=limit, offset=offset, sort="price_asc", authData=portals_auth)
                         else:
                             items = await asyncio.to_thread(search, limit=limit, offset=offset, sort="price_asc", authData=portals_auth)
@@ -213,6 +237,8 @@ class ParserService:
                         "user_auth": settings.TONNEL_AUTH or "",
                     }
                     
+                    if get_limiter:
+                        await get_limiter('tonnel', 'search').acquire()
                     if hasattr(requests_lib, 'Session') and hasattr(requests_lib.Session, 'impersonate'):
                         session = requests_lib.Session(impersonate="chrome131")
                         response = session.post(url, headers=headers, json=json_data, timeout=30)
@@ -251,7 +277,13 @@ class ParserService:
         gift_names = set()
         if search_mrkt and settings.MRKT_AUTH:
             try:
-                items = search_mrkt(limit=100, sort="price_asc", auth_token=settings.MRKT_AUTH)
+                if collect_mrkt_listings:
+                    # Все страницы по курсору, а не только первые 20 лотов
+                    items = await collect_mrkt_listings(sort="price_asc", auth_token=settings.MRKT_AUTH)
+                elif search_mrkt_async:
+                    items = await search_mrkt_async(limit=100, sort="price_asc", auth_token=settings.MRKT_AUTH)
+                else:
+                    items = await asyncio.to_thread(search_mrkt, limit=100, sort="price_asc", auth_token=settings.MRKT_AUTH)
                 if isinstance(items, dict):
                     items = items.get('gifts') or items.get('results') or []
                 elif not isinstance(items, list):
@@ -301,36 +333,37 @@ class ParserService:
             return set()
         
         cache_key = f"models:{gift_name}:{marketplace or 'all'}"
+        marketplaces = [marketplace] if marketplace else ALL_MARKETPLACES
         
-        # Проверяем кеш
-        cached = await self.cache.get(cache_key)
-        if cached is not None:
-            return set(cached)
-        
-        models = set()
-        marketplaces = [marketplace] if marketplace else ['portals', 'tonnel', 'mrkt', 'getgems']
-        
-        for mp in marketplaces:
-            try:
-                if mp == 'portals' and search:
-                    mp_models = await self._get_portals_models(gift_name)
-                elif mp == 'tonnel' and search_tonnel:
-                    mp_models = await self._get_tonnel_models(gift_name)
-                elif mp == 'mrkt' and search_mrkt:
-                    mp_models = await self._get_mrkt_models(gift_name)
-                elif mp == 'getgems' and search_getgems:
-                    mp_models = await self._get_getgems_models(gift_name)
-                else:
-                    continue
-                
-                models.update(mp_models)
-            except Exception as e:
-                logger.error(f"Error getting models from {mp} for {gift_name}: {e}")
-        
-        # Сохраняем в кеш
-        await self.cache.set(cache_key, list(models), ttl=300)
+        async def _load() -> List[str]:
+            models = set()
+            for mp in marketplaces:
+                try:
+                    if mp == 'portals' and search:
+                        mp_models = await self._get_portals_models(gift_name)
+                    elif mp == 'tonnel' and search_tonnel:
+                        mp_models = await self._get_tonnel_models(gift_name)
+                    elif mp == 'mrkt' and search_mrkt:
+                        mp_models = await self._get_mrkt_models(gift_name)
+                    elif mp == 'getgems' and search_getgems:
+                        mp_models = await self._get_getgems_models(gift_name)
+                    else:
+                        continue
+                    
+                    models.update(mp_models)
+                except Exception as e:
+                    logger.error(f"Error getting models from {mp} for {gift_name}: {e}")
+            return list(models)
         
-        return models
+        try:
+            models = await self.cache.get_or_refresh(
+                cache_key, _load,
+                soft_ttl=MODELS_SOFT_TTL, hard_ttl=MODELS_HARD_TTL, refresh_ahead=0.2
+            )
+        except Exception as e:
+            logger.error(f"Error getting models for {gift_name}: {e}", exc_info=True)
+            return set()
+        return set(models)
     
     async def _get_portals_models(self, gift_name: str) -> Set[str]:
         """Получить модели с Portals"""
@@ -350,6 +383,8 @@ class ParserService:
             if portals_auth and search:
                 try:
                     if inspect.iscoroutinefunction(search):
+                        if get_limiter:
+                            await get_limiter('portals', 'search').acquire()
                         items = await search(gift_name=gift_name, limit=100, sort="price_asc", authData=portals_auth)
                     else:
                         items = await asyncio.to_thread(search, gift_name=gift_name, limit=100, sort="price_asc", authData=portals_auth)
@@ -384,7 +419,10 @@ class ParserService:
             return models
         
         try:
-            items = search_tonnel(gift_name=gift_name, limit=100, sort="price_asc", authData=settings.TONNEL_AUTH)
+            if search_tonnel_async:
+                items = await search_tonnel_async(gift_name=gift_name, limit=100, sort="price_asc", authData=settings.TONNEL_AUTH)
+            else:
+                items = await asyncio.to_thread(search_tonnel, gift_name=gift_name, limit=100, sort="price_asc", authData=settings.TONNEL_AUTH)
             if isinstance(items, dict):
                 items = items.get('results') or items.get('items') or items.get('gifts') or []
             elif not isinstance(items, list):
@@ -408,7 +446,12 @@ class ParserService:
             return models
         
         try:
-            items = search_mrkt(gift_name=gift_name, limit=100, sort="price_asc", auth_token=settings.MRKT_AUTH)
+            if collect_mrkt_listings:
+                items = await collect_mrkt_listings(gift_name=gift_name, sort="price_asc", auth_token=settings.MRKT_AUTH)
+            elif search_mrkt_async:
+                items = await search_mrkt_async(gift_name=gift_name, limit=100, sort="price_asc", auth_token=settings.MRKT_AUTH)
+            else:
+                items = await asyncio.to_thread(search_mrkt, gift_name=gift_name, limit=100, sort="price_asc", auth_token=settings.MRKT_AUTH)
             if isinstance(items, dict):
                 items = items.get('gifts') or items.get('results') or items.get('items') or []
             elif not isinstance(items, list):
@@ -449,11 +492,26 @@ class ParserService:
             logger.error(f"Error getting models from GetGems for {gift_name}: {e}")
         return models
     
+    async def warm_up(self):
+        """Заполнить кеш названий подарков заранее, чтобы первый пользователь не ждал обхода"""
+        await self._prefetch_gift_names(ALL_MARKETPLACES)
+        for marketplace in ALL_MARKETPLACES:
+            await self.get_all_gift_names_from_marketplace(marketplace)
+        logger.info("[gifts] Gift names cache warmed up")
+    
+    async def _prefetch_gift_names(self, marketplaces: List[str]):
+        """Поднять названия всех маркетплейсов из Redis в L1 одним MGET"""
+        try:
+            await self.cache.get_many([f"gift_names:{mp}" for mp in marketplaces])
+        except Exception as e:
+            logger.debug(f"Gift names prefetch failed: {e}")
+    
     async def get_all_gift_names(self) -> Set[str]:
         """Получить все уникальные названия подарков со всех маркетплейсов"""
         all_names = set()
         
-        for marketplace in ['portals', 'tonnel', 'mrkt', 'getgems']:
+        await self._prefetch_gift_names(ALL_MARKETPLACES)
+        for marketplace in ALL_MARKETPLACES:
             names = await self.get_all_gift_names_from_marketplace(marketplace)
             all_names.update(names)
             await asyncio.sleep(0.05)  # Оптимизированная задержка между маркетплейсами
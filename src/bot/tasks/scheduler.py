@@ -40,6 +40,32 @@ async def new_gifts_tracker():
             await asyncio.sleep(1)  # Минимальная задержка при ошибке
 
 
+async def tonnel_stats_refresher():
+    """Фоновое обновление снимка filterStats Tonnel, чтобы флоры читались из памяти"""
+    try:
+        from tonnelmp_wrapper import refresh_tonnel_stats_async, TONNEL_STATS_REFRESH
+    except ImportError:
+        return
+    
+    while True:
+        try:
+            await refresh_tonnel_stats_async(settings.TONNEL_AUTH)
+            await asyncio.sleep(TONNEL_STATS_REFRESH)
+        except Exception as e:
+            logger.error(f"Error in tonnel_stats_refresher: {e}", exc_info=True)
+            await asyncio.sleep(10)
+
+
+async def cache_warmup():
+    """Первичное заполнение кеша названий подарков (обход маркетплейсов не в обработчике)"""
+    from ..di import container
+    try:
+        parser_service = await container.get_parser_service()
+        await parser_service.warm_up()
+    except Exception as e:
+        logger.error(f"Error in cache_warmup: {e}", exc_info=True)
+
+
 async def start_background_tasks():
     """Запуск всех фоновых задач"""
     logger.info("Starting background tasks...")
@@ -49,6 +75,10 @@ async def start_background_tasks():
     task2 = asyncio.create_task(new_gifts_tracker())
     
     background_tasks.extend([task1, task2])
+    background_tasks.append(asyncio.create_task(cache_warmup()))
+    
+    if settings.TONNEL_AUTH:
+        background_tasks.append(asyncio.create_task(tonnel_stats_refresher()))
     
     logger.info(f"Started {len(background_tasks)} background tasks")
 
@@ -63,5 +93,15 @@ async def stop_background_tasks():
     await asyncio.gather(*background_tasks, return_exceptions=True)
     
     background_tasks.clear()
+    
+    from ..tasks.workers import new_gifts_queue
+    if new_gifts_queue is not None:
+        await new_gifts_queue.stop()
+    
+    try:
+        from seen_store import save_all
+        save_all(force=True)
+    except ImportError:
+        pass
     logger.info("Background tasks stopped")
 
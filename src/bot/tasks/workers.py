@@ -6,7 +6,8 @@ import asyncio
 import inspect
 import logging
 import re
-from typing import Dict, List, Set, Optional
+import time
+from typing import Dict, Iterable, List, Set, Optional
 from datetime import datetime
 
 from ..di import container
@@ -15,15 +16,12 @@ from ..repositories.gift_repo import GiftRepository
 from ..repositories.marketplace_repo import MarketplaceRepository
 from ..repositories.price_filter_repo import PriceFilterRepository
 from ..services.parser import ParserService
-from ..utils.formatters import format_gift_message
+from ..services.cache import make_cache_key
+from ..utils.formatters import format_gift_message, format_price_drop_message
 from ..config import settings
 
 logger = logging.getLogger(__name__)
 
-# Rate limiting для Tonnel API (последнее время запроса)
-_tonnel_last_request_time = 0.0
-TONNEL_MIN_REQUEST_INTERVAL = 2.0  # Минимальный интервал между запросами к Tonnel (секунды)
-
 # Импорты маркетплейсов
 try:
     from aportalsmp import search, update_auth, get_model_floor_price, get_gift_floor_price
@@ -36,6 +34,37 @@ except ImportError:
         get_model_floor_price = None
         get_gift_floor_price = None
 
+# Общий лимитер запросов к маркетплейсам
+try:
+    from rate_limiter import get_limiter
+except ImportError:
+    get_limiter = None
+
+# Общая политика повторов
+try:
+    from retry_policy import retry_async, RetryableHTTPStatus, RATE_LIMIT
+except ImportError:
+    retry_async = None
+    RetryableHTTPStatus = None
+    RATE_LIMIT = None
+
+# Склейка одинаковых запросов флоров/истории продаж
+try:
+    from single_flight import coalesce
+except ImportError:
+    coalesce = None
+
+# Корутинные версии оберток (общий пул HTTP-соединений)
+try:
+    from portalsmp import search_async as portals_search_async
+except ImportError:
+    portals_search_async = None
+
+try:
+    from portalsmp import get_gift_floor_price_async as portals_gift_floor_async
+except ImportError:
+    portals_gift_floor_async = None
+
 try:
     from tonnelmp_wrapper import (
         search_tonnel, 
@@ -49,6 +78,19 @@ except ImportError:
     get_tonnel_gift_floor_price = None
     get_tonnel_model_sales_history = None
 
+try:
+    from tonnelmp_wrapper import (
+        search_tonnel_async,
+        get_tonnel_model_floor_price_async,
+        get_tonnel_gift_floor_price_async,
+        get_tonnel_model_sales_history_async
+    )
+except ImportError:
+    search_tonnel_async = None
+    get_tonnel_model_floor_price_async = None
+    get_tonnel_gift_floor_price_async = None
+    get_tonnel_model_sales_history_async = None
+
 try:
     from mrktmp_wrapper import (
         search_mrkt,
@@ -60,10 +102,46 @@ except ImportError:
     get_mrkt_model_floor_price = None
     get_mrkt_gift_floor_price = None
 
+try:
+    from mrktmp_wrapper import (
+        search_mrkt_async,
+        get_mrkt_model_floor_price_async,
+        get_mrkt_gift_floor_price_async
+    )
+except ImportError:
+    search_mrkt_async = None
+    get_mrkt_model_floor_price_async = None
+    get_mrkt_gift_floor_price_async = None
+
+# Ограниченная очередь обработки новых листингов
+try:
+    from work_queue import BoundedWorkQueue, merge_users
+except ImportError:
+    BoundedWorkQueue = None
+    merge_users = None
+
+# Увиденные листинги: FIFO/TTL и сохранение между рестартами
+try:
+    from seen_store import get_seen_store, save_all as save_seen_ids
+except ImportError:
+    get_seen_store = None
+    save_seen_ids = None
+
+# Сколько держать флор в кеше и сколько помнить, что флора нет (секунды)
+FLOOR_CACHE_TTL = 30
+FLOOR_NEGATIVE_TTL = 15
+
+
+def _floor_missing(value) -> bool:
+    """None или строка-ошибка из обертки маркетплейса"""
+    return value is None or isinstance(value, str)
+
+
 # Глобальные переменные для отслеживания новых подарков
-new_gifts_last_ids: Dict[str, Set[str]] = {}
+new_gifts_last_ids: Dict[str, Set[str]] = {}  # marketplace -> SeenIdStore (или set без seen_store)
 processing_semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_TASKS)
 auth_token = None
+new_gifts_queue = None
 
 
 async def should_process_gift_for_user(user_id: int, gift_name: str, model: str, price: float) -> bool:
@@ -73,6 +151,13 @@ async def should_process_gift_for_user(user_id: int, gift_name: str, model: str,
         gift_repo = GiftRepository(pool)
         price_filter_repo = PriceFilterRepository(pool)
         
+        # Быстрый путь: индекс подписок вместо выборки подарков пользователя
+        subscribers = await gift_repo.get_subscribers(gift_name, model)
+        if subscribers is not None:
+            if user_id not in subscribers:
+                return False
+            return await price_filter_repo.should_process(user_id, gift_name, model, price)
+        
         # Получаем выбранные подарки пользователя
         try:
             user_gifts = await gift_repo.get_by_user(user_id, page=0, per_page=1000)
@@ -126,6 +211,7 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List[
     Обработка нового подарка для мониторинга
     """
     try:
+        detected_at = time.time()
         pool = await container.init_db_pool()
         gift_repo = GiftRepository(pool)
         price_filter_repo = PriceFilterRepository(pool)
@@ -192,9 +278,16 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List[
         
         # Фильтруем пользователей по выбранным подаркам и фильтрам цены
         filtered_users = []
-        for user_id in users:
-            if await should_process_gift_for_user(user_id, name, model, price_ton):
-                filtered_users.append(user_id)
+        subscribers = await gift_repo.get_subscribers(name, model)
+        if subscribers is not None:
+            # Одна проверка по индексу подписок и фильтрам цен в памяти на весь листинг
+            filtered_users = await price_filter_repo.filter_users(
+                [user_id for user_id in users if user_id in subscribers], name, model, price_ton
+            )
+        else:
+            for user_id in users:
+                if await should_process_gift_for_user(user_id, name, model, price_ton):
+                    filtered_users.append(user_id)
         
         if not filtered_users:
             return
@@ -222,6 +315,14 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List[
                         logger.warning(f"[monitor] MRKT gift_id '{gift_id}' is not a valid hash, trying to find hash in other fields")
                         gift_id = None
         
+        # Дедупликация между репликами: каждый (пользователь, листинг) уведомляет одна реплика
+        dedup = await container.get_notification_dedup()
+        if dedup is not None and gift_id:
+            filtered_users = await dedup.claim(marketplace, gift_id, filtered_users)
+            if not filtered_users:
+                logger.debug(f"[monitor] {marketplace}: {gift_id} already notified by another replica")
+                return
+        
         gift_number = item.get('external_collection_number') or item.get('number') or item.get('giftNumber') or 'N/A'
         
         # Получаем редкость модели
@@ -246,6 +347,21 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List[
         # Создаем задачи для параллельного выполнения
         tasks = []
         
+        cache_service = await container.get_cache_service()
+        
+        def _coalesced(mp: str, operation: str, model_key: Optional[str], factory):
+            # Одинаковые листинги в одной пачке делят один запрос к API
+            if coalesce is not None:
+                request = lambda: coalesce(mp, operation, name_clean_for_search, model_key, factory)
+            else:
+                request = factory
+            if operation in ('model_floor', 'gift_floor'):
+                # Флор общий для реплик, отсутствие флора помнится FLOOR_NEGATIVE_TTL
+                key = make_cache_key('floor', mp, operation, name_clean_for_search.lower(), (model_key or '').lower())
+                return cache_service.get_or_load(key, request, ttl=FLOOR_CACHE_TTL,
+                                                 negative_ttl=FLOOR_NEGATIVE_TTL, is_empty=_floor_missing)
+            return request()
+        
         # Флор модели
         if marketplace == 'portals' and get_model_floor_price:
             global auth_token
@@ -255,31 +371,44 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List[
                 portals_auth = auth_token
             if portals_auth:
                 if inspect.iscoroutinefunction(get_model_floor_price):
-                    tasks.append(('model_floor', get_model_floor_price(name_clean_for_search, model_clean, portals_auth)))
+                    tasks.append(('model_floor', _coalesced(marketplace, 'model_floor', model_clean, lambda: get_model_floor_price(name_clean_for_search, model_clean, portals_auth))))
                 else:
-                    tasks.append(('model_floor', asyncio.to_thread(get_model_floor_price, name_clean_for_search, model_clean, portals_auth)))
+                    tasks.append(('model_floor', _coalesced(marketplace, 'model_floor', model_clean, lambda: asyncio.to_thread(get_model_floor_price, name_clean_for_search, model_clean, portals_auth))))
+        elif marketplace == 'tonnel' and get_tonnel_model_floor_price_async and settings.TONNEL_AUTH:
+            tasks.append(('model_floor', _coalesced(marketplace, 'model_floor', model_clean, lambda: get_tonnel_model_floor_price_async(name_clean_for_search, model_clean, settings.TONNEL_AUTH))))
         elif marketplace == 'tonnel' and get_tonnel_model_floor_price and settings.TONNEL_AUTH:
-            tasks.append(('model_floor', asyncio.to_thread(get_tonnel_model_floor_price, name_clean_for_search, model_clean, settings.TONNEL_AUTH)))
+            tasks.append(('model_floor', _coalesced(marketplace, 'model_floor', model_clean, lambda: asyncio.to_thread(get_tonnel_model_floor_price, name_clean_for_search, model_clean, settings.TONNEL_AUTH))))
+        elif marketplace == 'mrkt' and get_mrkt_model_floor_price_async and settings.MRKT_AUTH:
+            tasks.append(('model_floor', _coalesced(marketplace, 'model_floor', model_clean, lambda: get_mrkt_model_floor_price_async(name_clean_for_search, model_clean, settings.MRKT_AUTH))))
         elif marketplace == 'mrkt' and get_mrkt_model_floor_price and settings.MRKT_AUTH:
-            tasks.append(('model_floor', asyncio.to_thread(get_mrkt_model_floor_price, name_clean_for_search, model_clean, settings.MRKT_AUTH)))
+            tasks.append(('model_floor', _coalesced(marketplace, 'model_floor', model_clean, lambda: asyncio.to_thread(get_mrkt_model_floor_price, name_clean_for_search, model_clean, settings.MRKT_AUTH))))
         
         # Флор подарка
         if marketplace == 'portals' and get_gift_floor_price:
             portals_auth = settings.PORTALS_AUTH or auth_token
             if portals_auth:
-                if inspect.iscoroutinefunction(get_gift_floor_price):
-                    tasks.append(('gift_floor', get_gift_floor_price(name_clean_for_search, portals_auth)))
+                if portals_gift_floor_async:
+                    tasks.append(('gift_floor', _coalesced(marketplace, 'gift_floor', None, lambda: portals_gift_floor_async(name_clean_for_search, portals_auth))))
+                elif inspect.iscoroutinefunction(get_gift_floor_price):
+                    tasks.append(('gift_floor', _coalesced(marketplace, 'gift_floor', None, lambda: get_gift_floor_price(name_clean_for_search, portals_auth))))
                 else:
-                    tasks.append(('gift_floor', asyncio.to_thread(get_gift_floor_price, name_clean_for_search, portals_auth)))
+                    tasks.append(('gift_floor', _coalesced(marketplace, 'gift_floor', None, lambda: asyncio.to_thread(get_gift_floor_price, name_clean_for_search, portals_auth))))
+        elif marketplace == 'tonnel' and get_tonnel_gift_floor_price_async and settings.TONNEL_AUTH:
+            tasks.append(('gift_floor', _coalesced(marketplace, 'gift_floor', None, lambda: get_tonnel_gift_floor_price_async(name_clean_for_search, settings.TONNEL_AUTH))))
         elif marketplace == 'tonnel' and get_tonnel_gift_floor_price and settings.TONNEL_AUTH:
-            tasks.append(('gift_floor', asyncio.to_thread(get_tonnel_gift_floor_price, name_clean_for_search, settings.TONNEL_AUTH)))
+            tasks.append(('gift_floor', _coalesced(marketplace, 'gift_floor', None, lambda: asyncio.to_thread(get_tonnel_gift_floor_price, name_clean_for_search, settings.TONNEL_AUTH))))
+        elif marketplace == 'mrkt' and get_mrkt_gift_floor_price_async and settings.MRKT_AUTH:
+            tasks.append(('gift_floor', _coalesced(marketplace, 'gift_floor', None, lambda: get_mrkt_gift_floor_price_async(name_clean_for_search, settings.MRKT_AUTH))))
         elif marketplace == 'mrkt' and get_mrkt_gift_floor_price and settings.MRKT_AUTH:
-            tasks.append(('gift_floor', asyncio.to_thread(get_mrkt_gift_floor_price, name_clean_for_search, settings.MRKT_AUTH)))
+            tasks.append(('gift_floor', _coalesced(marketplace, 'gift_floor', None, lambda: asyncio.to_thread(get_mrkt_gift_floor_price, name_clean_for_search, settings.MRKT_AUTH))))
         
         # История продаж (только если модель не N/A) - запускаем отдельно с большим таймаутом
         model_sales_task = None
-        if get_tonnel_model_sales_history and settings.TONNEL_AUTH and model_clean and model_clean != 'N/A':
-            model_sales_task = asyncio.to_thread(get_tonnel_model_sales_history, name_clean_for_search, model_clean, settings.TONNEL_AUTH, 5)
+        if settings.TONNEL_AUTH and model_clean and model_clean != 'N/A':
+            if get_tonnel_model_sales_history_async:
+                model_sales_task = _coalesced('tonnel', 'model_sales', model_clean, lambda: get_tonnel_model_sales_history_async(name_clean_for_search, model_clean, settings.TONNEL_AUTH, 5))
+            elif get_tonnel_model_sales_history:
+                model_sales_task = _coalesced('tonnel', 'model_sales', model_clean, lambda: asyncio.to_thread(get_tonnel_model_sales_history, name_clean_for_search, model_clean, settings.TONNEL_AUTH, 5))
         
         # Выполняем все задачи параллельно с таймаутом для ускорения
         if tasks:
@@ -343,9 +472,22 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List[
         )
         
         # Отправляем уведомления пользователям
-        bot = await container.init_bot()
         photo_url = item.get('photo_url') or item.get('image_url') or item.get('image')
         
+        sender = await container.get_send_scheduler()
+        if sender is not None:
+            # Общий лимит и лимит на чат Telegram, повтор после RetryAfter
+            for user_id in filtered_users:
+                if photo_url:
+                    sender.send_photo(user_id, photo_url, caption=caption, created_at=detected_at,
+                                      reply_markup=keyboard, parse_mode="HTML")
+                else:
+                    sender.send_message(user_id, caption, created_at=detected_at,
+                                        reply_markup=keyboard, parse_mode="HTML")
+            sender_stats_log(sender)
+            return
+        
+        bot = await container.init_bot()
         for user_id in filtered_users:
             try:
                 if photo_url:
@@ -370,9 +512,57 @@ async def process_new_gift_monitoring(item: Dict, marketplace: str, users: List[
 
 
 async def process_new_gift_monitoring_with_semaphore(item: Dict, marketplace: str, users: List[int]):
-    """Обертка для обработки подарка - запускаем сразу без семафора для максимальной скорости"""
-    # Запускаем обработку сразу без ожидания семафора
-    await process_new_gift_monitoring(item, marketplace, users)
+    """Обертка для обработки подарка с ограничением параллелизма"""
+    async with processing_semaphore:
+        await process_new_gift_monitoring(item, marketplace, users)
+
+
+_sender_last_log = 0.0
+
+
+def sender_stats_log(sender, interval: float = 60.0):
+    """Метрики доставки в лог не чаще раза в минуту"""
+    global _sender_last_log
+    now = time.monotonic()
+    if now - _sender_last_log >= interval:
+        _sender_last_log = now
+        logger.info(f"[telegram] {sender.stats()}")
+
+
+async def prefetch_photo_file_ids(items: Iterable[Dict]):
+    """Загрузить file_id картинок пачки листингов в память планировщика отправки"""
+    try:
+        sender = await container.get_send_scheduler()
+        if sender is None or sender.photo_cache is None:
+            return
+        urls = [item.get('photo_url') or item.get('image_url') or item.get('image') for item in items]
+        await sender.photo_cache.prefetch(urls)
+    except Exception as e:
+        logger.debug(f"[monitor] file_id prefetch failed: {e}")
+
+
+def get_new_gifts_queue():
+    """Очередь обработки новых листингов (воркеры стартуют при первой задаче)"""
+    global new_gifts_queue
+    if new_gifts_queue is None and BoundedWorkQueue is not None:
+        new_gifts_queue = BoundedWorkQueue(
+            'new_gifts',
+            process_new_gift_monitoring,
+            workers=settings.MAX_CONCURRENT_TASKS,
+            maxsize=settings.NEW_GIFTS_QUEUE_SIZE,
+            policy=settings.NEW_GIFTS_QUEUE_POLICY,
+            merge=merge_users,
+        )
+    return new_gifts_queue
+
+
+def enqueue_new_gift(item: Dict, marketplace: str, users: List[int], key: str):
+    """Поставить листинг в очередь; без work_queue — прежний запуск задачи под семафором"""
+    queue = get_new_gifts_queue()
+    if queue is not None:
+        queue.submit(item, marketplace, users, key=key)
+    else:
+        asyncio.create_task(process_new_gift_monitoring_with_semaphore(item, marketplace, users))
 
 
 async def check_new_gifts():
@@ -397,7 +587,7 @@ async def check_new_gifts():
         # Инициализируем множества для отслеживания ID
         for mp in ['portals', 'tonnel', 'mrkt']:
             if mp not in new_gifts_last_ids:
-                new_gifts_last_ids[mp] = set()
+                new_gifts_last_ids[mp] = get_seen_store('workers', mp) if get_seen_store else set()
         
         # Получаем маркетплейсы для проверки
         async with pool.acquire() as conn:
@@ -436,27 +626,15 @@ async def check_new_gifts():
             logger.debug("[monitor] No marketplaces to check")
             return
         
-        # Получаем настройки маркетплейсов для всех пользователей заранее
+        # Получаем настройки маркетплейсов для всех пользователей заранее (один запрос)
+        user_settings = await marketplace_repo.get_settings_for_users(users_to_notify)
         marketplace_users_cache = {}
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                for mp in marketplaces_to_check:
-                    placeholders = ','.join(['%s'] * len(users_to_notify))
-                    await cur.execute(f"""
-                        SELECT user_id FROM user_marketplaces 
-                        WHERE user_id IN ({placeholders}) AND marketplace = %s AND enabled = TRUE
-                    """, users_to_notify + [mp])
-                    results = await cur.fetchall()
-                    marketplace_users_cache[mp] = {row[0] for row in results}
-                    
-                    # Добавляем пользователей без настроек (по умолчанию включены все)
-                    await cur.execute(f"""
-                        SELECT DISTINCT user_id FROM user_marketplaces WHERE user_id IN ({placeholders})
-                    """, users_to_notify)
-                    users_with_settings = {row[0] for row in await cur.fetchall()}
-                    for user_id in users_to_notify:
-                        if user_id not in users_with_settings:
-                            marketplace_users_cache[mp].add(user_id)
+        for mp in marketplaces_to_check:
+            # Пользователи без настроек — по умолчанию включены все маркетплейсы
+            marketplace_users_cache[mp] = {
+                user_id for user_id in users_to_notify
+                if user_id not in user_settings or user_settings[user_id].get(mp, False)
+            }
         
         # Обрабатываем каждый маркетплейс
         async def process_marketplace(marketplace: str):
@@ -477,74 +655,65 @@ async def check_new_gifts():
                             portals_auth = auth_token
                     
                     if portals_auth:
-                        max_retries = 3
-                        for attempt in range(max_retries):
-                            try:
-                                if inspect.iscoroutinefunction(search):
-                                    items = await search(limit=999, sort="latest", authData=portals_auth)
-                                else:
-                                    items = await asyncio.to_thread(search, limit=999, sort="latest", authData=portals_auth)
-                                
-                                if isinstance(items, str):
-                                    if "429" in items and attempt < max_retries - 1:
-                                        await asyncio.sleep(0.5)  # Минимальная задержка при rate limit
-                                        continue
-                                    logger.error(f"Portals search returned error: {items}")
-                                    break
-                                
-                                if isinstance(items, dict):
-                                    items = items.get('results') or items.get('items') or []
-                                elif not isinstance(items, list):
-                                    if hasattr(items, '__iter__'):
-                                        items = list(items)
-                                    else:
-                                        break
-                                
-                                # Конвертируем объекты в словари
-                                if items and not isinstance(items[0], dict):
-                                    converted = []
-                                    for item in items:
-                                        if isinstance(item, dict):
-                                            converted.append(item)
-                                        elif hasattr(item, '__dict__'):
-                                            converted.append(item.__dict__)
-                                        elif hasattr(item, 'id'):
-                                            item_dict = {}
-                                            for attr in ['id', 'name', 'model', 'price', 'floor_price', 
-                                                        'external_collection_number', 'model_rarity', 'photo_url']:
-                                                if hasattr(item, attr):
-                                                    item_dict[attr] = getattr(item, attr)
-                                            if item_dict:
-                                                converted.append(item_dict)
-                                    if converted:
-                                        items = converted
-                                
-                                break
-                            except Exception as e:
-                                if "429" in str(e) and attempt < max_retries - 1:
-                                    await asyncio.sleep(0.5)  # Минимальная задержка при rate limit
-                                    continue
-                                logger.error(f"Error fetching Portals items: {e}")
+                        async def _fetch_portals():
+                            if inspect.iscoroutinefunction(search):
+                                # aportalsmp ходит в API сам, лимитер берем здесь
+                                if get_limiter:
+                                    await get_limiter('portals', 'search').acquire()
+                                result = await search(limit=999, sort="latest", authData=portals_auth)
+                            elif portals_search_async:
+                                result = await portals_search_async(limit=999, sort="latest", authData=portals_auth)
+                            else:
+                                result = await asyncio.to_thread(search, limit=999, sort="latest", authData=portals_auth)
+                            if isinstance(result, str) and "429" in result and RetryableHTTPStatus:
+                                raise RetryableHTTPStatus(429, message=result)
+                            return result
+                        
+                        try:
+                            if retry_async:
+                                items = await retry_async('portals:search', _fetch_portals, retry_on={RATE_LIMIT})
+                            else:
+                                items = await _fetch_portals()
+                            
+                            if isinstance(items, str):
+                                logger.error(f"Portals search returned error: {items}")
                                 items = []
-                                break
+                            elif isinstance(items, dict):
+                                items = items.get('results') or items.get('items') or []
+                            elif not isinstance(items, list):
+                                items = list(items) if hasattr(items, '__iter__') else []
+                            
+                            # Конвертируем объекты в словари
+                            if items and not isinstance(items[0], dict):
+                                converted = []
+                                for item in items:
+                                    if isinstance(item, dict):
+                                        converted.append(item)
+                                    elif hasattr(item, '__dict__'):
+                                        converted.append(item.__dict__)
+                                    elif hasattr(item, 'id'):
+                                        item_dict = {}
+                                        for attr in ['id', 'name', 'model', 'price', 'floor_price', 
+                                                    'external_collection_number', 'model_rarity', 'photo_url']:
+                                            if hasattr(item, attr):
+                                                item_dict[attr] = getattr(item, attr)
+                                        if item_dict:
+                                            converted.append(item_dict)
+                                if converted:
+                                    items = converted
+                        except Exception as e:
+                            logger.error(f"Error fetching Portals items: {e}")
+                            items = []
                 
                 elif marketplace == 'tonnel' and search_tonnel and settings.TONNEL_AUTH:
                     try:
-                        # Rate limiting: ждем минимум 2 секунды между запросами к Tonnel
-                        global _tonnel_last_request_time
-                        import time
-                        current_time = time.time()
-                        time_since_last = current_time - _tonnel_last_request_time
-                        if time_since_last < TONNEL_MIN_REQUEST_INTERVAL:
-                            wait_time = TONNEL_MIN_REQUEST_INTERVAL - time_since_last
-                            logger.debug(f"[monitor] Rate limiting Tonnel: waiting {wait_time:.2f}s")
-                            await asyncio.sleep(wait_time)
-                        _tonnel_last_request_time = time.time()
-                        
+                        # Rate limiting Tonnel — в общем лимитере внутри обертки
                         logger.debug(f"[monitor] Fetching Tonnel items...")
                         # Проверяем, асинхронная ли функция
                         if inspect.iscoroutinefunction(search_tonnel):
                             items = await search_tonnel(limit=999, sort="latest", authData=settings.TONNEL_AUTH)
+                        elif search_tonnel_async:
+                            items = await search_tonnel_async(limit=999, sort="latest", authData=settings.TONNEL_AUTH)
                         else:
                             items = await asyncio.to_thread(search_tonnel, limit=999, sort="latest", authData=settings.TONNEL_AUTH)
                         
@@ -581,6 +750,8 @@ async def check_new_gifts():
                             # Для MRKT максимум 20 подарков за запрос, используем latest для новых
                             if inspect.iscoroutinefunction(search_mrkt):
                                 items = await search_mrkt(limit=20, sort="latest", auth_token=settings.MRKT_AUTH)
+                            elif search_mrkt_async:
+                                items = await search_mrkt_async(limit=20, sort="latest", auth_token=settings.MRKT_AUTH)
                             else:
                                 items = await asyncio.to_thread(search_mrkt, limit=20, sort="latest", auth_token=settings.MRKT_AUTH)
                             
@@ -619,8 +790,14 @@ async def check_new_gifts():
                 
                 logger.info(f"[monitor] {marketplace}: Got {len(items)} items to process")
                 
+                # Холодный старт (нет свежего сохраненного состояния): первый проход только
+                # запоминает текущие листинги, чтобы не разослать их как новые
+                seen_ids = new_gifts_last_ids[marketplace]
+                baseline = getattr(seen_ids, 'needs_baseline', False)
+                
                 # Обрабатываем новые подарки
                 new_count = 0
+                new_items = []
                 for item in items:
                     item_dict = None
                     if isinstance(item, dict):
@@ -668,6 +845,8 @@ async def check_new_gifts():
                     # Проверяем, новый ли это подарок
                     if gift_id_str not in new_gifts_last_ids[marketplace]:
                         new_gifts_last_ids[marketplace].add(gift_id_str)
+                        if baseline:
+                            continue
                         new_count += 1
                         
                         logger.debug(f"[monitor] {marketplace}: New gift found - ID: {gift_id}, name: {item_dict.get('name') or item_dict.get('gift_name') or item_dict.get('collectionName')}")
@@ -677,14 +856,24 @@ async def check_new_gifts():
                         
                         if filtered_users:
                             logger.debug(f"[monitor] {marketplace}: Processing gift for {len(filtered_users)} users")
-                            asyncio.create_task(process_new_gift_monitoring_with_semaphore(item_dict, marketplace, filtered_users))
+                            new_items.append((item_dict, filtered_users, gift_id_str))
                         else:
                             logger.debug(f"[monitor] {marketplace}: No users to notify for this gift")
                         
-                        # Ограничиваем размер множества
-                        if len(new_gifts_last_ids[marketplace]) > 1000:
+                        # Ограничиваем размер множества (SeenIdStore вытесняет старые id сам)
+                        if isinstance(new_gifts_last_ids[marketplace], set) and len(new_gifts_last_ids[marketplace]) > 1000:
                             new_gifts_last_ids[marketplace] = set(list(new_gifts_last_ids[marketplace])[-1000:])
                 
+                if new_items:
+                    # file_id картинок всех новых листингов — одним запросом к кешу
+                    await prefetch_photo_file_ids(item for item, _, _ in new_items)
+                    for item_dict, filtered_users, gift_id_str in new_items:
+                        enqueue_new_gift(item_dict, marketplace, filtered_users, gift_id_str)
+                
+                if baseline:
+                    seen_ids.needs_baseline = False
+                    logger.info(f"[monitor] {marketplace}: baseline of {len(seen_ids)} listings recorded")
+                
             except Exception as e:
                 logger.error(f"[monitor] Error checking {marketplace}: {e}", exc_info=True)
         
@@ -695,6 +884,10 @@ async def check_new_gifts():
             logger.info(f"[monitor] Created {len(tasks)} tasks, executing...")
             await asyncio.gather(*tasks, return_exceptions=True)
             logger.info(f"[monitor] All marketplace tasks completed")
+            if new_gifts_queue is not None:
+                new_gifts_queue.log_stats()
+            if save_seen_ids:
+                save_seen_ids()
         else:
             logger.warning("[monitor] No tasks to process - no marketplaces to check")
     
@@ -702,9 +895,205 @@ async def check_new_gifts():
         logger.error(f"Error in check_new_gifts: {e}", exc_info=True)
 
 
+def _snapshot_from_item(item) -> Optional[Dict]:
+    """Цена, флор и данные для ссылки из самого дешевого листинга (dict или PortalsGift)"""
+    if item is None:
+        return None
+    if not isinstance(item, dict):
+        item = {attr: getattr(item, attr) for attr in (
+            'id', 'price', 'floor_price', 'photo_url', 'model_rarity', 'rarity',
+            'model_rarity_name', 'rarity_name'
+        ) if hasattr(item, attr)}
+    try:
+        # Нет цены/флора — None (NULL в БД): inf драйвер MySQL не пропускает
+        price = float(item['price']) if item.get('price') else None
+        floor = float(item['floor_price']) if item.get('floor_price') else None
+    except (TypeError, ValueError):
+        return None
+    if price is None and floor is None:
+        return None
+    return {
+        'price': price,
+        'floor_price': floor,
+        'photo_url': item.get('photo_url'),
+        'model_rarity': (item.get('model_rarity') or item.get('rarity') or
+                         item.get('model_rarity_name') or item.get('rarity_name')),
+        'gift_id': (item.get('mrkt_hash') or item.get('hash') or item.get('hash_id') or
+                    item.get('token') or item.get('uuid') or item.get('app_id') or item.get('id')),
+    }
+
+
+async def _fetch_price_snapshot(marketplace: str, name: str, model: str) -> Optional[Dict]:
+    """Один запрос листингов + флор модели для ключа (маркетплейс, подарок, модель)"""
+    global auth_token
+    items = None
+    auth = None
+    if marketplace == 'tonnel':
+        auth = settings.TONNEL_AUTH
+        if not auth:
+            return None
+        if search_tonnel_async:
+            items = await search_tonnel_async(gift_name=name, model=model, limit=1, sort="price_asc", authData=auth)
+        elif search_tonnel:
+            items = await asyncio.to_thread(search_tonnel, gift_name=name, model=model, limit=1, sort="price_asc", authData=auth)
+    elif marketplace == 'mrkt':
+        auth = settings.MRKT_AUTH
+        if not auth:
+            return None
+        if search_mrkt_async:
+            items = await search_mrkt_async(gift_name=name, model=model, limit=1, sort="price_asc", auth_token=auth)
+        elif search_mrkt:
+            items = await asyncio.to_thread(search_mrkt, gift_name=name, model=model, limit=1, sort="price_asc", auth_token=auth)
+    else:
+        auth = settings.PORTALS_AUTH or auth_token
+        if not auth and update_auth:
+            auth_token = await update_auth(settings.API_ID, settings.API_HASH)
+            auth = auth_token
+        if not auth or not search:
+            return None
+        if inspect.iscoroutinefunction(search):
+            if get_limiter:
+                await get_limiter('portals', 'search').acquire()
+            items = await search(gift_name=name, model=model, limit=1, sort="price_asc", authData=auth)
+        elif portals_search_async:
+            items = await portals_search_async(gift_name=name, model=model, limit=1, sort="price_asc", authData=auth)
+        else:
+            items = await asyncio.to_thread(search, gift_name=name, model=model, limit=1, sort="price_asc", authData=auth)
+    
+    if isinstance(items, str):
+        logger.error(f"[prices] API error for {name} ({model}) on {marketplace}: {items}")
+        if marketplace == 'portals' and "auth" in items.lower():
+            auth_token = None
+        return None
+    if not isinstance(items, list) or not items:
+        logger.debug(f"[prices] No items found for {name} ({model}) on {marketplace}")
+        return None
+    
+    snapshot = _snapshot_from_item(items[0])
+    if snapshot is None:
+        return None
+    
+    # Флор модели для сравнения
+    snapshot['model_floor'] = None
+    try:
+        if marketplace == 'portals' and get_model_floor_price:
+            if inspect.iscoroutinefunction(get_model_floor_price):
+                snapshot['model_floor'] = await get_model_floor_price(name, model, auth)
+            else:
+                snapshot['model_floor'] = await asyncio.to_thread(get_model_floor_price, name, model, auth)
+        elif marketplace == 'tonnel' and get_tonnel_model_floor_price_async:
+            snapshot['model_floor'] = await get_tonnel_model_floor_price_async(name, model, auth)
+        elif marketplace == 'mrkt' and get_mrkt_model_floor_price_async:
+            snapshot['model_floor'] = await get_mrkt_model_floor_price_async(name, model, auth)
+    except Exception as e:
+        logger.error(f"[prices] Error getting model floor price for {name} / {model} on {marketplace}: {e}")
+    return snapshot
+
+
 async def check_prices():
     """
-    Проверка изменения цен на отслеживаемые подарки
+    Проверка изменения цен на отслеживаемые подарки.
+    Подписки группируются по (маркетплейс, подарок, модель): каждый ключ
+    запрашивается один раз, результат раздается всем подписчикам, а
+    изменения пишутся одной пачкой.
     """
-    # TODO: Реализовать проверку цен
-    logger.debug("Price check not implemented yet")
+    try:
+        pool = await container.init_db_pool()
+        gift_repo = GiftRepository(pool)
+        rows = await gift_repo.get_tracked()
+    except Exception as e:
+        logger.error(f"[prices] Error loading tracked gifts: {e}", exc_info=True)
+        return
+    
+    groups: Dict[tuple, List[Dict]] = {}
+    for row in rows:
+        name = row.get('name')
+        model = row.get('model')
+        # "ANY" и пустая модель — подписки мониторинга, а не отслеживание цены
+        if not name or name.upper() == 'ANY' or not model or model.upper() == 'ANY':
+            continue
+        marketplace = row.get('marketplace') or 'portals'
+        groups.setdefault((marketplace, name, model), []).append(row)
+    
+    if not groups:
+        return
+    
+    semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_TASKS)
+    
+    async def _fetch(key):
+        async with semaphore:
+            try:
+                return key, await _fetch_price_snapshot(*key)
+            except Exception as e:
+                logger.error(f"[prices] Error checking price for {key[1]} ({key[2]}) on {key[0]}: {e}", exc_info=True)
+                return key, None
+    
+    started = time.monotonic()
+    snapshots = await asyncio.gather(*[_fetch(key) for key in groups])
+    
+    updates = []
+    notifications = []
+    for (marketplace, name, model), snapshot in snapshots:
+        if snapshot is None:
+            continue
+        new_price = snapshot['price']
+        new_floor = snapshot['floor_price']
+        new_model_floor = snapshot['model_floor']
+        for row in groups[(marketplace, name, model)]:
+            old_price = float(row.get('price') or 0)
+            old_floor = float(row.get('floor_price') or 0)
+            old_model_floor = row.get('model_floor_price')
+            old_model_floor = float(old_model_floor) if old_model_floor is not None else old_floor
+            
+            if not old_price and not old_floor:
+                # Только что добавленный подарок: запоминаем цены без уведомления
+                notify = False
+            else:
+                # Пропавшее значение не сравниваем
+                price_dropped = new_price is not None and new_price < old_price
+                floor_dropped = new_floor is not None and new_floor < old_floor
+                model_floor_dropped = (new_model_floor is not None and bool(old_model_floor)
+                                       and new_model_floor < old_model_floor)
+                notify = price_dropped or floor_dropped or model_floor_dropped
+                if not notify:
+                    continue
+                notifications.append((row['user_id'], format_price_drop_message(
+                    marketplace, name, model, snapshot['gift_id'],
+                    price_change=(old_price, new_price) if price_dropped else None,
+                    floor_change=(old_floor, new_floor) if floor_dropped else None,
+                    model_floor_change=(old_model_floor, new_model_floor) if model_floor_dropped else None
+                ), snapshot['photo_url']))
+            
+            updates.append((
+                new_price, new_floor, snapshot['photo_url'], snapshot['model_rarity'], new_model_floor,
+                name, model, row['user_id'], marketplace
+            ))
+    
+    if updates:
+        try:
+            await gift_repo.update_prices(updates)
+        except Exception as e:
+            logger.error(f"[prices] Error saving {len(updates)} price updates: {e}", exc_info=True)
+    
+    if notifications:
+        sender = await container.get_send_scheduler()
+        bot = None if sender is not None else await container.init_bot()
+        for user_id, (caption, keyboard), photo_url in notifications:
+            if sender is not None:
+                if photo_url:
+                    sender.send_photo(user_id, photo_url, caption=caption, reply_markup=keyboard)
+                else:
+                    sender.send_message(user_id, caption + "\n(Фото недоступно)", reply_markup=keyboard)
+                continue
+            try:
+                if photo_url:
+                    await bot.send_photo(chat_id=user_id, photo=photo_url, caption=caption, reply_markup=keyboard)
+                else:
+                    await bot.send_message(chat_id=user_id, text=caption + "\n(Фото недоступно)", reply_markup=keyboard)
+            except Exception as e:
+                logger.error(f"[prices] Error sending price notification to {user_id}: {e}")
+    
+    logger.debug(
+        f"[prices] {len(rows)} rows, {len(groups)} unique keys, {len(updates)} updates, "
+        f"{len(notifications)} notifications in {time.monotonic() - started:.1f}s"
+    )
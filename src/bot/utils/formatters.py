@@ -211,3 +211,51 @@ def format_gift_message(
     
     return caption, keyboard
 
+
+def format_price_drop_message(
+    marketplace: str,
+    name: str,
+    model: str,
+    gift_id: Optional[str],
+    price_change: Optional[Tuple[float, float]] = None,
+    floor_change: Optional[Tuple[float, float]] = None,
+    model_floor_change: Optional[Tuple[float, float]] = None
+) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """
+    Сообщение о снижении цены/флора отслеживаемого подарка (как в bot.py::check_prices)
+    """
+    marketplace_names = {
+        'portals': 'Portals',
+        'tonnel': 'Tonnel',
+        'mrkt': 'MRKT'
+    }
+    marketplace_name = marketplace_names.get(marketplace, 'Portals')
+    
+    caption = (
+        f"📦 Название: {name}\n"
+        f"🎨 Модель: {model}\n"
+    )
+    if price_change:
+        caption += f"💰 Старая цена: {price_change[0]:.2f} TON → Новая: {price_change[1]:.2f} TON\n"
+    if floor_change:
+        caption += f"📊 Старый флор: {floor_change[0]:.2f} TON → Новый: {floor_change[1]:.2f} TON\n"
+    if model_floor_change:
+        caption += f"📊 Старый флор модели: {model_floor_change[0]:.2f} TON → Новый: {model_floor_change[1]:.2f} TON\n"
+    caption += f"🏪 Маркетплейс: {marketplace_name}"
+    
+    url = None
+    if gift_id and str(gift_id) != 'None':
+        if marketplace == 'portals':
+            url = f"https://t.me/portals/market?startapp=gift_{gift_id}"
+        elif marketplace == 'tonnel':
+            url = f"https://t.me/tonnel_network_bot/gift?startapp={gift_id}"
+        elif marketplace == 'mrkt':
+            url = f"https://t.me/mrkt/app?startapp={str(gift_id).replace('-', '')}"
+    
+    keyboard = None
+    if url:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text=f"🔗 Открыть в {marketplace_name}", url=url)
+        ]])
+    
+    return caption, keyboard
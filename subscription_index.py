@@ -0,0 +1,152 @@
+"""
+Инвертированный индекс подписок на подарки.
+
+Строится из таблицы gifts (user_id, name, model) и отвечает на вопрос
+"кому интересен этот листинг" парой обращений к словарям вместо запроса
+в БД на каждого пользователя. Ключи нормализуются так же, как раньше
+в should_process_gift_for_user: без пометок в скобках, в нижнем регистре.
+
+name == "ANY" — любой подарок, model == "ANY" (или пустая) — любая модель.
+Листинг без модели ('N/A') подходит только подпискам на любую модель.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Полная перезагрузка из БД (секунды): подписки могут менять и другие процессы
+SUBSCRIPTION_INDEX_RELOAD = float(os.getenv('SUBSCRIPTION_INDEX_RELOAD', '300'))
+
+ANY = "ANY"
+
+# (название, модель); None — "любой"
+Key = Tuple[Optional[str], Optional[str]]
+
+
+def normalize_name(value: str) -> str:
+    """Название/модель без пометок в скобках, в нижнем регистре"""
+    return re.sub(r"\s*\([^)]*\)", "", value).strip().lower()
+
+
+def subscription_key(name: Optional[str], model: Optional[str]) -> Key:
+    """Ключ подписки из строки таблицы gifts"""
+    name_key = None if not name or name == ANY else normalize_name(name)
+    model_key = None if not model or model == ANY else normalize_name(model)
+    return name_key, model_key
+
+
+class SubscriptionIndex:
+    """Подписчики по названию (любая модель) и по паре (название, модель)"""
+
+    def __init__(self):
+        self._by_name: Dict[Optional[str], Set[int]] = {}
+        self._by_model: Dict[Key, Set[int]] = {}
+        self._user_keys: Dict[int, Set[Key]] = {}
+        self.loaded_at: Optional[float] = None
+        self._load_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def is_stale(self, max_age: float = SUBSCRIPTION_INDEX_RELOAD) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > max_age
+
+    def _link(self, user_id: int, key: Key):
+        keys = self._user_keys.setdefault(user_id, set())
+        if key in keys:
+            return
+        keys.add(key)
+        name_key, model_key = key
+        if model_key is None:
+            self._by_name.setdefault(name_key, set()).add(user_id)
+        else:
+            self._by_model.setdefault(key, set()).add(user_id)
+
+    def _unlink(self, user_id: int, key: Key):
+        name_key, model_key = key
+        bucket_map = self._by_name if model_key is None else self._by_model
+        bucket_key = name_key if model_key is None else key
+        bucket = bucket_map.get(bucket_key)
+        if bucket is not None:
+            bucket.discard(user_id)
+            if not bucket:
+                del bucket_map[bucket_key]
+
+    def build(self, rows: Iterable[Dict[str, Any]]):
+        """Перестроить индекс из строк gifts (user_id, name, model)"""
+        self._by_name = {}
+        self._by_model = {}
+        self._user_keys = {}
+        count = 0
+        for row in rows:
+            user_id = row.get('user_id')
+            if user_id is None:
+                continue
+            self._link(user_id, subscription_key(row.get('name'), row.get('model')))
+            count += 1
+        self.loaded_at = time.monotonic()
+        logger.info(f"[subscriptions] Index built: {count} rows, {len(self._user_keys)} users")
+
+    def add(self, user_id: int, name: Optional[str], model: Optional[str]):
+        """Подписка добавлена"""
+        self._link(user_id, subscription_key(name, model))
+
+    def remove(self, user_id: int, name: Optional[str], model: Optional[str] = None):
+        """Подписка удалена; без model — все модели этого подарка (как DELETE в репозитории)"""
+        keys = self._user_keys.get(user_id)
+        if not keys:
+            return
+        name_key, model_key = subscription_key(name, model)
+        for key in [k for k in keys if k[0] == name_key and (not model or k[1] == model_key)]:
+            keys.discard(key)
+            self._unlink(user_id, key)
+        if not keys:
+            del self._user_keys[user_id]
+
+    def match(self, gift_name: str, model: Optional[str]) -> Set[int]:
+        """Все пользователи, подписанные на этот листинг"""
+        name_key = normalize_name(gift_name or '')
+        result = set(self._by_name.get(None, ()))
+        result.update(self._by_name.get(name_key, ()))
+        if model and model != 'N/A':
+            model_key = normalize_name(model)
+            result.update(self._by_model.get((name_key, model_key), ()))
+            result.update(self._by_model.get((None, model_key), ()))
+        return result
+
+    def has_subscriptions(self, user_id: int) -> bool:
+        return bool(self._user_keys.get(user_id))
+
+    async def ensure_loaded(self, loader: Callable[[], Awaitable[List[Dict[str, Any]]]]) -> bool:
+        """
+        Загрузить индекс, если он пуст или устарел. loader возвращает строки gifts.
+        При ошибке остается прежний индекс; False — индекса нет вовсе.
+        """
+        if not self.is_stale():
+            return True
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if not self.is_stale():
+                return True
+            try:
+                self.build(await loader())
+            except Exception as e:
+                logger.error(f"[subscriptions] Failed to load index: {e}", exc_info=True)
+                if self.ready:
+                    # Работаем на старом индексе, повторная попытка через минуту
+                    self.loaded_at = time.monotonic() - SUBSCRIPTION_INDEX_RELOAD + 60
+        return self.ready
+
+    def invalidate(self):
+        """Перечитать индекс из БД при следующем обращении"""
+        self.loaded_at = None
+
+
+subscription_index = SubscriptionIndex()
@@ -0,0 +1,481 @@
+"""
+Планировщик исходящих сообщений Telegram.
+
+Держит общий лимит бота (~30 сообщений/сек) и интервал на чат (~1 сек),
+при TelegramRetryAfter ставит чат на паузу на retry_after и повторяет
+отправку, а не теряет уведомление. Из очереди первыми уходят более
+свежие листинги; слишком старые уведомления отбрасываются.
+
+Картинки: после первой успешной отправки URL запоминается file_id фото,
+дальше Telegram получает file_id и не скачивает картинку заново.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+try:
+    from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+except ImportError:
+    TelegramBadRequest = TelegramForbiddenError = TelegramRetryAfter = None
+
+# Общий лимит бота (сообщений в секунду) и burst
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))
+TELEGRAM_GLOBAL_BURST = int(os.getenv('TELEGRAM_GLOBAL_BURST', '25'))
+# Минимальный интервал между сообщениями в один чат (секунды)
+TELEGRAM_CHAT_INTERVAL = float(os.getenv('TELEGRAM_CHAT_INTERVAL', '1.0'))
+# Уведомление старше этого (секунды) уже неинтересно — отбрасываем
+TELEGRAM_SEND_MAX_AGE = float(os.getenv('TELEGRAM_SEND_MAX_AGE', '120'))
+# Максимум сообщений в очереди
+TELEGRAM_SEND_QUEUE_SIZE = int(os.getenv('TELEGRAM_SEND_QUEUE_SIZE', '5000'))
+# Одновременных запросов к Bot API
+TELEGRAM_SEND_CONCURRENCY = int(os.getenv('TELEGRAM_SEND_CONCURRENCY', '10'))
+# Попыток на сообщение (с учетом повторов после RetryAfter)
+TELEGRAM_SEND_ATTEMPTS = 3
+# Сколько хранить file_id картинки (секунды) и сколько держать в памяти
+TELEGRAM_FILE_ID_TTL = int(os.getenv('TELEGRAM_FILE_ID_TTL', str(30 * 24 * 3600)))
+TELEGRAM_FILE_ID_LOCAL_MAX = int(os.getenv('TELEGRAM_FILE_ID_LOCAL_MAX', '5000'))
+# Сколько ждать, пока первая отправка той же картинки вернет file_id (секунды)
+TELEGRAM_FILE_ID_WAIT = 10.0
+
+SendFactory = Callable[[], Awaitable[Any]]
+
+
+class _Message:
+    __slots__ = ('chat_id', 'send', 'fallback', 'created_at', 'enqueued_at', 'attempts')
+
+    def __init__(self, chat_id: int, send: SendFactory, fallback: Optional[SendFactory], created_at: float):
+        self.chat_id = chat_id
+        self.send = send
+        self.fallback = fallback
+        self.created_at = created_at
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    if TelegramRetryAfter is not None and isinstance(error, TelegramRetryAfter):
+        return float(error.retry_after)
+    return None
+
+
+class PhotoFileIdCache:
+    """
+    URL картинки -> file_id, полученный от Telegram при первой отправке.
+    backend — объект с async get/set/delete (CacheService: Redis или LRU),
+    без него file_id живут только в памяти процесса.
+    """
+
+    def __init__(self, backend=None, ttl: int = TELEGRAM_FILE_ID_TTL, max_local: int = TELEGRAM_FILE_ID_LOCAL_MAX):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_local = max_local
+        self._local: "OrderedDict[str, str]" = OrderedDict()
+        # Первая отправка картинки в полете: остальные ждут ее file_id
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return "tg_file_id:" + hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _remember(self, key: str, file_id: str):
+        self._local[key] = file_id
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_local:
+            self._local.popitem(last=False)
+
+    async def get(self, url: str) -> Optional[str]:
+        key = self._key(url)
+        file_id = self._local.get(key)
+        if file_id is None and self.backend is not None:
+            try:
+                file_id = await self.backend.get(key)
+            except Exception as e:
+                logger.debug(f"[telegram] file_id cache get error: {e}")
+            if file_id:
+                self._remember(key, file_id)
+        if file_id:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return file_id or None
+
+    async def prefetch(self, urls: Iterable[str]) -> int:
+        """
+        Подтянуть file_id пачки картинок одним запросом к backend (get_many),
+        чтобы отправки цикла брали их из памяти. Возвращает число найденных.
+        """
+        get_many = getattr(self.backend, 'get_many', None)
+        if get_many is None:
+            return 0
+        keys = [key for key in dict.fromkeys(self._key(url) for url in urls if url) if key not in self._local]
+        if not keys:
+            return 0
+        try:
+            found = await get_many(keys)
+        except Exception as e:
+            logger.debug(f"[telegram] file_id cache prefetch error: {e}")
+            return 0
+        for key, file_id in found.items():
+            if file_id:
+                self._remember(key, file_id)
+        return len(found)
+
+    async def set(self, url: str, file_id: str):
+        key = self._key(url)
+        self._remember(key, file_id)
+        if self.backend is not None:
+            try:
+                await self.backend.set(key, file_id, self.ttl)
+            except Exception as e:
+                logger.debug(f"[telegram] file_id cache set error: {e}")
+
+    async def delete(self, url: str):
+        key = self._key(url)
+        self._local.pop(key, None)
+        if self.backend is not None:
+            try:
+                await self.backend.delete(key)
+            except Exception as e:
+                logger.debug(f"[telegram] file_id cache delete error: {e}")
+
+    async def resolve(self, url: str) -> Tuple[Optional[str], bool]:
+        """
+        (file_id, owner): file_id из кеша или от идущей первой отправки.
+        owner=True — file_id нет, вызывающий отправляет по URL и должен вызвать done().
+        """
+        file_id = await self.get(url)
+        if file_id:
+            return file_id, False
+        pending = self._pending.get(url)
+        if pending is not None:
+            try:
+                file_id = await asyncio.wait_for(asyncio.shield(pending), TELEGRAM_FILE_ID_WAIT)
+            except Exception:
+                file_id = None
+            return file_id, False
+        self._pending[url] = asyncio.get_running_loop().create_future()
+        return None, True
+
+    def done(self, url: str, file_id: Optional[str]):
+        pending = self._pending.pop(url, None)
+        if pending is not None and not pending.done():
+            pending.set_result(file_id)
+
+
+async def migrate_telegram_file_ids(cur):
+    """telegram_file_ids: хранилище file_id для MySQLFileIdStore"""
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS telegram_file_ids (
+            cache_key VARCHAR(64) NOT NULL PRIMARY KEY,
+            file_id VARCHAR(255) NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            INDEX idx_expires_at (expires_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+
+class MySQLFileIdStore:
+    """
+    Backend PhotoFileIdCache поверх aiomysql-пула (для bot.py без Redis):
+    file_id переживают перезапуск и общие для всех реплик.
+    """
+
+    def __init__(self, pool, prune_interval: float = 3600.0):
+        self.pool = pool
+        self.prune_interval = prune_interval
+        self._last_prune = time.monotonic()
+
+    async def get(self, key: str) -> Optional[str]:
+        found = await self.get_many([key])
+        return found.get(key)
+
+    async def get_many(self, keys: List[str]) -> Dict[str, str]:
+        if not keys:
+            return {}
+        placeholders = ','.join(['%s'] * len(keys))
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"SELECT cache_key, file_id FROM telegram_file_ids "
+                    f"WHERE cache_key IN ({placeholders}) AND expires_at > NOW()",
+                    list(keys)
+                )
+                return {row[0]: row[1] for row in await cur.fetchall()}
+
+    async def set(self, key: str, value: str, ttl: int):
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    INSERT INTO telegram_file_ids (cache_key, file_id, expires_at)
+                    VALUES (%s, %s, NOW() + INTERVAL %s SECOND)
+                    ON DUPLICATE KEY UPDATE file_id = VALUES(file_id), expires_at = VALUES(expires_at)
+                """, (key, value, int(ttl)))
+                if time.monotonic() - self._last_prune >= self.prune_interval:
+                    self._last_prune = time.monotonic()
+                    await cur.execute("DELETE FROM telegram_file_ids WHERE expires_at <= NOW()")
+                await conn.commit()
+
+    async def delete(self, key: str):
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("DELETE FROM telegram_file_ids WHERE cache_key = %s", (key,))
+                await conn.commit()
+
+
+def _photo_file_id(message) -> Optional[str]:
+    """file_id самого большого размера фото из ответа send_photo"""
+    photos = getattr(message, 'photo', None)
+    if photos:
+        return photos[-1].file_id
+    return None
+
+
+class TelegramSendScheduler:
+    """
+    Очередь сообщений с приоритетом по свежести листинга.
+    Чат, которому еще рано писать, откладывается, не блокируя остальных.
+    """
+
+    def __init__(
+        self,
+        bot,
+        rate: float = TELEGRAM_GLOBAL_RATE,
+        burst: int = TELEGRAM_GLOBAL_BURST,
+        chat_interval: float = TELEGRAM_CHAT_INTERVAL,
+        max_age: float = TELEGRAM_SEND_MAX_AGE,
+        max_queue: int = TELEGRAM_SEND_QUEUE_SIZE,
+        concurrency: int = TELEGRAM_SEND_CONCURRENCY,
+        photo_cache: Optional[PhotoFileIdCache] = None,
+    ):
+        self.bot = bot
+        self.photo_cache = photo_cache
+        self.chat_interval = chat_interval
+        self.max_age = max_age
+        self.max_queue = max_queue
+        self._bucket = TokenBucket('telegram:send', rate, burst)
+        self._concurrency = asyncio.Semaphore(concurrency)
+        self._seq = itertools.count()
+        # Готовые к отправке: (-created_at, seq, msg) — свежие первыми
+        self._ready: List[Tuple[float, int, _Message]] = []
+        # Отложенные до освобождения чата: (ready_at, seq, msg)
+        self._delayed: List[Tuple[float, int, _Message]] = []
+        self._chat_next: Dict[int, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._inflight = set()
+        # Метрики
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retried = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    # --- постановка в очередь ---
+
+    def _ensure_started(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.get_running_loop().create_task(self._run())
+
+    def _depth(self) -> int:
+        return len(self._ready) + len(self._delayed)
+
+    def submit(self, chat_id: int, send: SendFactory, fallback: Optional[SendFactory] = None,
+               created_at: Optional[float] = None) -> bool:
+        """
+        Поставить отправку в очередь. send/fallback — фабрики корутин вызова Bot API,
+        fallback используется при TelegramBadRequest (например, битая картинка).
+        created_at — время листинга (time.time()), по нему считается свежесть.
+        """
+        self._ensure_started()
+        msg = _Message(chat_id, send, fallback, created_at or time.time())
+        if self._depth() >= self.max_queue:
+            # Переполнение: вытесняем самое старое из готовых, если новое свежее
+            if self._ready and max(self._ready)[0] > -msg.created_at:
+                self._ready.remove(max(self._ready))
+                heapq.heapify(self._ready)
+                self._drop('queue full')
+            else:
+                self._drop('queue full')
+                return False
+        heapq.heappush(self._ready, (-msg.created_at, next(self._seq), msg))
+        self._wakeup.set()
+        return True
+
+    def send_message(self, chat_id: int, text: str, created_at: Optional[float] = None, **kwargs) -> bool:
+        return self.submit(chat_id, lambda: self.bot.send_message(chat_id=chat_id, text=text, **kwargs),
+                           created_at=created_at)
+
+    def send_photo(self, chat_id: int, photo: str, caption: Optional[str] = None,
+                   created_at: Optional[float] = None, fallback_to_text: bool = True, **kwargs) -> bool:
+        """Фото с подписью; если Telegram не принял картинку — та же подпись текстом"""
+        fallback = None
+        if fallback_to_text and caption:
+            fallback = lambda: self.bot.send_message(chat_id=chat_id, text=caption, **kwargs)
+        return self.submit(
+            chat_id,
+            lambda: self._send_photo(chat_id, photo, caption, kwargs),
+            fallback=fallback,
+            created_at=created_at,
+        )
+
+    async def _send_photo(self, chat_id: int, photo: str, caption: Optional[str], kwargs: Dict[str, Any]):
+        """send_photo с подстановкой file_id вместо URL"""
+        cache = self.photo_cache
+        if cache is None or not isinstance(photo, str) or not photo.startswith('http'):
+            return await self.bot.send_photo(chat_id=chat_id, photo=photo, caption=caption, **kwargs)
+
+        file_id, owner = await cache.resolve(photo)
+        if file_id:
+            try:
+                return await self.bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, **kwargs)
+            except Exception as e:
+                if TelegramBadRequest is None or not isinstance(e, TelegramBadRequest):
+                    raise
+                # file_id больше не принимается — забываем и шлем по URL
+                logger.debug(f"[telegram] Cached file_id rejected for {photo}: {e}")
+                await cache.delete(photo)
+
+        result = None
+        try:
+            result = await self.bot.send_photo(chat_id=chat_id, photo=photo, caption=caption, **kwargs)
+            new_file_id = _photo_file_id(result)
+            if new_file_id:
+                await cache.set(photo, new_file_id)
+            return result
+        finally:
+            if owner:
+                cache.done(photo, _photo_file_id(result))
+
+    # --- диспетчер ---
+
+    def _drop(self, reason: str):
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            logger.warning(f"[telegram] Dropped {self.dropped} messages so far ({reason})")
+
+    def _defer(self, msg: _Message, ready_at: float):
+        heapq.heappush(self._delayed, (ready_at, next(self._seq), msg))
+
+    def _promote_delayed(self, now: float):
+        while self._delayed and self._delayed[0][0] <= now:
+            _, seq, msg = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (-msg.created_at, seq, msg))
+
+    async def _wait(self):
+        timeout = None
+        if self._delayed:
+            timeout = max(0.0, self._delayed[0][0] - time.monotonic())
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            try:
+                now = time.monotonic()
+                self._promote_delayed(now)
+                if not self._ready:
+                    await self._wait()
+                    continue
+
+                _, _, msg = heapq.heappop(self._ready)
+                if time.time() - msg.created_at > self.max_age:
+                    self._drop('stale')
+                    continue
+                chat_ready_at = self._chat_next.get(msg.chat_id, 0.0)
+                if chat_ready_at > now:
+                    self._defer(msg, chat_ready_at)
+                    continue
+
+                await self._bucket.acquire()
+                await self._concurrency.acquire()
+                self._chat_next[msg.chat_id] = time.monotonic() + self.chat_interval
+                task = asyncio.get_running_loop().create_task(self._deliver(msg))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+
+                if len(self._chat_next) > 10000:
+                    self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[telegram] Dispatcher error: {e}", exc_info=True)
+                await asyncio.sleep(1)
+
+    async def _deliver(self, msg: _Message):
+        try:
+            msg.attempts += 1
+            try:
+                await msg.send()
+            except Exception as e:
+                if TelegramBadRequest is not None and isinstance(e, TelegramBadRequest) and msg.fallback:
+                    logger.debug(f"[telegram] Chat {msg.chat_id}: {e}, sending fallback")
+                    msg.send, msg.fallback = msg.fallback, None
+                    await msg.send()
+                else:
+                    raise
+            latency = time.monotonic() - msg.enqueued_at
+            self.delivered += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                # 429 от Telegram — обычно превышен общий лимит бота: притормаживаем все чаты
+                self._bucket.penalize(retry_after)
+            if retry_after is not None and msg.attempts < TELEGRAM_SEND_ATTEMPTS:
+                # Telegram сам сказал, когда можно: пауза для чата и повтор
+                ready_at = time.monotonic() + retry_after
+                self._chat_next[msg.chat_id] = max(self._chat_next.get(msg.chat_id, 0.0), ready_at)
+                self._defer(msg, ready_at)
+                self.retried += 1
+                self._wakeup.set()
+                logger.warning(f"[telegram] Chat {msg.chat_id}: retry after {retry_after}s (attempt {msg.attempts})")
+            elif TelegramForbiddenError is not None and isinstance(e, TelegramForbiddenError):
+                # Пользователь заблокировал бота
+                self.failed += 1
+                logger.debug(f"[telegram] Chat {msg.chat_id}: forbidden: {e}")
+            else:
+                self.failed += 1
+                logger.warning(f"[telegram] Failed to send to {msg.chat_id}: {e}")
+        finally:
+            self._concurrency.release()
+
+    async def stop(self):
+        """Остановить диспетчер (неотправленные сообщения теряются)"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, *self._inflight, return_exceptions=True)
+            self._dispatcher = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': self._depth(),
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'retried': self.retried,
+            'avg_latency': round(self.total_latency / self.delivered, 3) if self.delivered else 0.0,
+            'max_latency': round(self.max_latency, 3),
+            'bucket': self._bucket.stats(),
+            'file_id_hits': self.photo_cache.hits if self.photo_cache else 0,
+            'file_id_misses': self.photo_cache.misses if self.photo_cache else 0,
+        }
@@ -2,12 +2,29 @@
 Обертка для работы с Tonnel Marketplace API через tonnelmp
 """
 
+import asyncio
 import logging
+import os
+import threading
+import time
 from typing import List, Dict, Optional, Any
 import requests
 import re
 import json
 
+try:
+    from marketplace_http import get_client
+except ImportError:
+    get_client = None
+
+from rate_limiter import get_limiter, is_rate_limit_error
+from retry_policy import retry_sync, retry_async, classify_error, RATE_LIMIT, CONNECTION, BAD_REQUEST
+
+try:
+    from single_flight import coalesce
+except ImportError:
+    coalesce = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -115,18 +132,6 @@ def _strip_tonnel_rarity(value: str) -> str:
     return re.sub(r"\s*\([^)]*\)", "", str(value)).strip()
 
 
-def _find_tonnel_gift_data(data: Dict[str, Any], gift_name: str) -> Optional[Dict[str, Any]]:
-    gift_key = _normalize_tonnel_key(gift_name)
-    if not gift_key:
-        return None
-    if gift_key in data:
-        gift_data = data.get(gift_key)
-        return gift_data if isinstance(gift_data, dict) else None
-    for key, value in data.items():
-        if isinstance(key, str) and _normalize_tonnel_key(key) == gift_key:
-            return value if isinstance(value, dict) else None
-    return None
-
 try:
     from tonnelmp import getGifts, saleHistory, filterStatsPretty, giftData
 except ImportError:
@@ -137,6 +142,30 @@ except ImportError:
     giftData = None
 
 
+def _limited(endpoint: str, func, *args, **kwargs):
+    """Вызов функции tonnelmp через общий лимитер Tonnel"""
+    limiter = get_limiter('tonnel', endpoint)
+    limiter.acquire_sync()
+    try:
+        return func(*args, **kwargs)
+    except Exception as e:
+        if is_rate_limit_error(e):
+            limiter.penalize()
+        raise
+
+
+async def _limited_async(endpoint: str, func, *args, **kwargs):
+    """То же, что _limited, но ждем лимитер в event loop, а в поток уходит только сам вызов"""
+    limiter = get_limiter('tonnel', endpoint)
+    await limiter.acquire()
+    try:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    except Exception as e:
+        if is_rate_limit_error(e):
+            limiter.penalize()
+        raise
+
+
 def search_tonnel(
     gift_name: Optional[str] = None,
     model: Optional[str] = None,
@@ -207,112 +236,51 @@ def search_tonnel(
         params_str = ', '.join(f'{k}={v if k != "authData" else "***"}' for k, v in params.items())
         logger.debug(f"Calling getGifts with params: {params_str}")
         
-        import time
-        max_retries = 3
-        retry_delay = 2  # Начальная задержка в секундах
-        
-        for attempt in range(max_retries):
-            try:
-                items = getGifts(**params)
-                # Если успешно, выходим из цикла
-                break
-            except Exception as e:
-                error_msg = str(e)
-                
-                # Если это ошибка подключения (Failed to connect), пробуем fallback метод
-                if "Failed to connect" in error_msg or "Could not connect" in error_msg or "curl: (7)" in error_msg:
-                    logger.warning(f"Tonnel API connection error, trying fallback method: {error_msg}")
-                    if attempt < max_retries - 1:
-                        # Пробуем использовать прямой запрос к API
-                        try:
-                            fallback_result = _search_pagegifts(gift_name=gift_name, model=model, limit=limit, sort=sort, authData=authData)
-                            if isinstance(fallback_result, list):
-                                logger.info(f"Fallback method succeeded, got {len(fallback_result)} items")
-                                return fallback_result
-                        except Exception as e2:
-                            logger.debug(f"Fallback method also failed: {e2}")
-                    
-                    # Если это последняя попытка и fallback не сработал, ждем и пробуем еще раз
-                    if attempt < max_retries - 1:
-                        wait_time = retry_delay * (attempt + 1)
-                        logger.warning(f"Tonnel API connection error, waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        logger.error(f"getGifts failed after {max_retries} retries due to connection error: {error_msg}")
-                        # Пробуем fallback в последний раз
-                        try:
-                            return _search_pagegifts(gift_name=gift_name, model=model, limit=limit, sort=sort, authData=authData)
-                        except:
-                            return f"Error: tonnelmp: getGifts(): Connection failed after {max_retries} retries"
-                
-                # Если это 429 ошибка (Too Many Requests), ждем и повторяем
-                if "429" in error_msg or "Too Many Requests" in error_msg or "CloudFlare" in error_msg:
-                    if attempt < max_retries - 1:
-                        wait_time = retry_delay * (2 ** attempt)  # Экспоненциальная задержка
-                        logger.warning(f"Tonnel API rate limit (429), waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        logger.error(f"getGifts failed after {max_retries} retries due to rate limit: {error_msg}")
-                        return f"Error: tonnelmp: getGifts(): Request failed with status code 429 (Rate limit exceeded)"
-                
-                logger.error(f"getGifts raised exception: {error_msg}")
-                
-                # Если ошибка 400, пробуем разные варианты
-                if "400" in error_msg or "Bad Request" in error_msg:
-                    logger.info("Trying getGifts with different parameters")
-                    
-                    # Пробуем без gift_name и model, если они были переданы
-                    if gift_name or model:
-                        try:
-                            minimal_params = {
-                                "limit": limit,
-                                "sort": sort_value
-                            }
-                            if authData and authData.strip():
-                                minimal_params["authData"] = authData.strip()
-                            logger.info("Trying getGifts without gift_name/model")
-                            items = getGifts(**minimal_params)
-                            logger.info("getGifts succeeded with minimal parameters")
-                            break  # Успешно, выходим из цикла
-                        except Exception as e2:
-                            logger.error(f"getGifts failed even with minimal parameters: {e2}")
-                            # Пробуем с дефолтными параметрами
-                            try:
-                                default_params = {
-                                    "limit": 30,
-                                    "sort": "price_asc"
-                                }
-                                if authData and authData.strip():
-                                    default_params["authData"] = authData.strip()
-                                logger.info("Trying getGifts with default parameters")
-                                items = getGifts(**default_params)
-                                logger.info("getGifts succeeded with default parameters")
-                                break  # Успешно, выходим из цикла
-                            except Exception as e3:
-                                logger.error(f"getGifts failed with default parameters: {e3}")
-                                return f"Error: tonnelmp: getGifts(): Request failed with status code 400"
-                    else:
-                        # Если уже были минимальные параметры, пробуем с дефолтными
-                        try:
-                            default_params = {
-                                "limit": 30,
-                                "sort": "price_asc"
-                            }
-                            if authData and authData.strip():
-                                default_params["authData"] = authData.strip()
-                            logger.info("Trying getGifts with default parameters")
-                            items = getGifts(**default_params)
-                            logger.info("getGifts succeeded with default parameters")
-                            break  # Успешно, выходим из цикла
-                        except Exception as e3:
-                            logger.error(f"getGifts failed with default parameters: {e3}")
-                            return f"Error: tonnelmp: getGifts(): Request failed with status code 400"
-                else:
-                    # Если не 400 и не 429, возвращаем ошибку после всех попыток
-                    if attempt == max_retries - 1:
-                        return f"Error: {error_msg}"
+        try:
+            # Повторяем только 429; при ошибке соединения сразу идем в pageGifts
+            items = retry_sync('tonnel:getGifts', lambda: _limited('search', getGifts, **params), retry_on={RATE_LIMIT})
+        except Exception as e:
+            error_msg = str(e)
+            kind = classify_error(e)
+            
+            # Если это ошибка подключения (Failed to connect), пробуем fallback метод
+            if kind == CONNECTION:
+                logger.warning(f"Tonnel API connection error, trying fallback method: {error_msg}")
+                fallback_result = _search_pagegifts(gift_name=gift_name, model=model, limit=limit, sort=sort, authData=authData)
+                if isinstance(fallback_result, list):
+                    logger.info(f"Fallback method succeeded, got {len(fallback_result)} items")
+                    return fallback_result
+                return f"Error: tonnelmp: getGifts(): Connection failed ({error_msg})"
+            
+            if kind == RATE_LIMIT:
+                logger.error(f"getGifts failed due to rate limit: {error_msg}")
+                return f"Error: tonnelmp: getGifts(): Request failed with status code 429 (Rate limit exceeded)"
+            
+            logger.error(f"getGifts raised exception: {error_msg}")
+            
+            # Если ошибка 400, пробуем разные варианты
+            if kind != BAD_REQUEST:
+                return f"Error: {error_msg}"
+            
+            logger.info("Trying getGifts with different parameters")
+            base_params = {"authData": authData.strip()} if authData and authData.strip() else {}
+            fallback_params = []
+            # Пробуем без gift_name и model, если они были переданы
+            if gift_name or model:
+                fallback_params.append({"limit": limit, "sort": sort_value, **base_params})
+            # Затем с дефолтными параметрами
+            fallback_params.append({"limit": 30, "sort": "price_asc", **base_params})
+            
+            items = None
+            for fb_params in fallback_params:
+                try:
+                    items = _limited('search', getGifts, **fb_params)
+                    logger.info(f"getGifts succeeded with fallback parameters: limit={fb_params['limit']}, sort={fb_params['sort']}")
+                    break
+                except Exception as e2:
+                    logger.error(f"getGifts failed with fallback parameters: {e2}")
+            if items is None:
+                return f"Error: tonnelmp: getGifts(): Request failed with status code 400"
         
         if isinstance(items, str):
             logger.error(f"getGifts returned error string: {items}")
@@ -353,26 +321,24 @@ def search_tonnel(
             return f"Error: {str(e)}"
 
 
-def _search_pagegifts(
+PAGEGIFTS_URL = "https://gifts2.tonnel.network/api/pageGifts"
+PAGEGIFTS_HEADERS = {
+    "accept": "*/*",
+    "content-type": "application/json",
+    "origin": "https://market.tonnel.network",
+    "referer": "https://market.tonnel.network/",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137 Safari/537.36",
+}
+
+
+def _pagegifts_body(
     gift_name: Optional[str],
     model: Optional[str],
     limit: int,
     sort: str,
     authData: Optional[str],
-) -> List[Dict[str, Any]] | str:
-    """
-    Прямой запрос к https://gifts2.tonnel.network/api/pageGifts согласно документации
-    https://github.com/boostNT/Tonnel-API
-    """
-    url = "https://gifts2.tonnel.network/api/pageGifts"
-    headers = {
-        "accept": "*/*",
-        "content-type": "application/json",
-        "origin": "https://market.tonnel.network",
-        "referer": "https://market.tonnel.network/",
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137 Safari/537.36",
-    }
-
+) -> Dict[str, Any]:
+    """JSON body для pageGifts"""
     # Ограничение API
     limit = max(1, min(limit, 30))
 
@@ -404,7 +370,7 @@ def _search_pagegifts(
         else:
             filter_data["model"] = {"$regex": f"^{model}"}
 
-    json_data = {
+    return {
         "page": 1,
         "limit": limit,
         "sort": json.dumps(sort_json, ensure_ascii=False),
@@ -413,14 +379,9 @@ def _search_pagegifts(
         "user_auth": authData or "",
     }
 
-    try:
-        resp = requests.post(url, headers=headers, json=json_data, timeout=15)
-        resp.raise_for_status()
-        data = resp.json()
-    except Exception as e:
-        logger.error(f"pageGifts request failed: {e}")
-        return f"Error: {e}"
 
+def _parse_pagegifts_data(data: Any) -> List[Dict[str, Any]]:
+    """Приводит ответ pageGifts к формату search_tonnel"""
     # Ответ может быть списком или словарем
     items = data
     if isinstance(data, dict):
@@ -467,11 +428,261 @@ def _search_pagegifts(
     return result
 
 
+def _search_pagegifts(
+    gift_name: Optional[str],
+    model: Optional[str],
+    limit: int,
+    sort: str,
+    authData: Optional[str],
+) -> List[Dict[str, Any]] | str:
+    """
+    Прямой запрос к https://gifts2.tonnel.network/api/pageGifts согласно документации
+    https://github.com/boostNT/Tonnel-API
+    """
+    json_data = _pagegifts_body(gift_name, model, limit, sort, authData)
+
+    try:
+        limiter = get_limiter('tonnel', 'search')
+        limiter.acquire_sync()
+        resp = requests.post(PAGEGIFTS_URL, headers=PAGEGIFTS_HEADERS, json=json_data, timeout=15)
+        limiter.note_response(resp.status_code, resp.headers)
+        resp.raise_for_status()
+        data = resp.json()
+    except Exception as e:
+        logger.error(f"pageGifts request failed: {e}")
+        return f"Error: {e}"
+
+    return _parse_pagegifts_data(data)
+
+
+async def _search_pagegifts_async(
+    gift_name: Optional[str],
+    model: Optional[str],
+    limit: int,
+    sort: str,
+    authData: Optional[str],
+) -> List[Dict[str, Any]] | str:
+    """Корутинная версия _search_pagegifts через общий пул соединений"""
+    if get_client is None:
+        return await asyncio.to_thread(_search_pagegifts, gift_name, model, limit, sort, authData)
+
+    json_data = _pagegifts_body(gift_name, model, limit, sort, authData)
+
+    try:
+        resp = await get_client('tonnel').post(PAGEGIFTS_URL, headers=PAGEGIFTS_HEADERS, json_data=json_data, timeout=15)
+        resp.raise_for_status()
+        data = resp.json()
+    except Exception as e:
+        logger.error(f"pageGifts request failed: {e}")
+        return f"Error: {e}"
+
+    return _parse_pagegifts_data(data)
+
+
+async def search_tonnel_async(
+    gift_name: Optional[str] = None,
+    model: Optional[str] = None,
+    limit: int = 10,
+    sort: str = "price_asc",
+    authData: Optional[str] = None
+) -> List[Dict[str, Any]] | str:
+    """
+    Корутинная версия search_tonnel.
+    Идет напрямую в pageGifts (тот же эндпоинт, что использует tonnelmp.getGifts),
+    чтобы не блокировать поток и переиспользовать соединения.
+    """
+    return await _search_pagegifts_async(gift_name=gift_name, model=model, limit=limit, sort=sort, authData=authData)
+
+
+def _stats_data(stats: Any) -> Optional[Dict[str, Any]]:
+    """Достает data из ответа filterStatsPretty"""
+    if not isinstance(stats, dict) or stats.get('status') != 'success':
+        logger.error(f"filterStatsPretty returned error: {stats}")
+        return None
+    data = stats.get('data', {})
+    if not data:
+        logger.warning("filterStatsPretty returned empty data")
+        return None
+    return data
+
+
+def _fetch_filter_stats(authData: str) -> Optional[Dict[str, Any]]:
+    """filterStatsPretty с общей политикой повторов (429)"""
+    try:
+        stats = retry_sync('tonnel:filterStats', lambda: _limited('stats', filterStatsPretty, authData), retry_on={RATE_LIMIT})
+    except Exception as e:
+        if classify_error(e) == RATE_LIMIT:
+            logger.error("filterStatsPretty failed: rate limit")
+            return None
+        raise  # Пробрасываем другие ошибки
+    return _stats_data(stats)
+
+
+async def _fetch_filter_stats_async(authData: str) -> Optional[Dict[str, Any]]:
+    """Корутинная версия _fetch_filter_stats: ожидание повторов не держит поток"""
+    try:
+        stats = await retry_async(
+            'tonnel:filterStats', lambda: _limited_async('stats', filterStatsPretty, authData), retry_on={RATE_LIMIT}
+        )
+    except Exception as e:
+        if classify_error(e) == RATE_LIMIT:
+            logger.error("filterStatsPretty failed: rate limit")
+            return None
+        raise
+    return _stats_data(stats)
+
+
+# Как часто обновлять снимок filterStatsPretty (секунды)
+TONNEL_STATS_REFRESH = float(os.getenv('TONNEL_STATS_REFRESH', '60'))
+# Через сколько повторить обновление после неудачи (секунды)
+TONNEL_STATS_RETRY = 10.0
+
+
+class _TonnelGiftStats:
+    __slots__ = ('floor', 'models', 'models_clean', 'model_keys')
+
+    def __init__(self):
+        self.floor: Optional[float] = None
+        self.models: Dict[str, Optional[float]] = {}  # нормализованный ключ (с редкостью)
+        self.models_clean: Dict[str, Optional[float]] = {}  # без редкости
+        self.model_keys: List[tuple] = []  # (ключ, флор) в исходном порядке для поиска по префиксу
+
+
+def _to_floor(info: Any) -> Optional[float]:
+    if isinstance(info, dict):
+        floor_price = info.get('floorPrice')
+        if floor_price is not None:
+            try:
+                return float(floor_price)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+class TonnelStatsIndex:
+    """
+    Снимок filterStatsPretty, один раз разобранный в словари по нормализованным
+    ключам: поиск флора — чтение из памяти без регулярок по всем ключам.
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        self.gifts: Dict[str, _TonnelGiftStats] = {}
+        for gift_key, gift_data in data.items():
+            if not isinstance(gift_key, str) or not isinstance(gift_data, dict):
+                continue
+            gift_norm = _normalize_tonnel_key(gift_key)
+            if gift_norm in self.gifts:
+                continue
+            entry = _TonnelGiftStats()
+            entry.floor = _to_floor(gift_data.get('data'))
+            for model_key, model_info in gift_data.items():
+                if not isinstance(model_key, str) or model_key == 'data':
+                    continue
+                floor = _to_floor(model_info)
+                key_norm = _normalize_tonnel_key(model_key)
+                entry.models.setdefault(key_norm, floor)
+                entry.models_clean.setdefault(_normalize_tonnel_key(_strip_tonnel_rarity(model_key)), floor)
+                entry.model_keys.append((key_norm, floor))
+            self.gifts[gift_norm] = entry
+
+    def gift_floor(self, gift_name: str) -> Optional[float]:
+        entry = self.gifts.get(_normalize_tonnel_key(gift_name))
+        return entry.floor if entry else None
+
+    def model_floor(self, gift_name: str, model: str) -> Optional[float]:
+        entry = self.gifts.get(_normalize_tonnel_key(gift_name))
+        if entry is None:
+            logger.warning(f"Gift '{gift_name}' not found in filterStatsPretty data")
+            return None
+        model_key_raw = _normalize_tonnel_key(model)
+        model_key_clean = _normalize_tonnel_key(_strip_tonnel_rarity(model))
+        if model_key_raw in entry.models:
+            return entry.models[model_key_raw]
+        if model_key_clean in entry.models:
+            return entry.models[model_key_clean]
+        if model_key_clean in entry.models_clean:
+            return entry.models_clean[model_key_clean]
+        if model_key_clean:
+            for key_norm, floor in entry.model_keys:
+                if key_norm.startswith(model_key_clean):
+                    logger.info(f"Found model with key '{key_norm}' matching prefix '{model_key_clean}'")
+                    return floor
+        logger.warning(f"Model '{model_key_raw}' not found in gift '{gift_name}'")
+        return None
+
+
+_stats_index: Optional[TonnelStatsIndex] = None
+_stats_next_refresh = 0.0
+_stats_lock = threading.Lock()
+
+
+def _stats_fresh() -> bool:
+    return _stats_index is not None and time.monotonic() < _stats_next_refresh
+
+
+def _apply_stats(data: Optional[Dict[str, Any]]) -> Optional[TonnelStatsIndex]:
+    """Заменить снимок; при неудаче оставляем старый и повторяем через TONNEL_STATS_RETRY"""
+    global _stats_index, _stats_next_refresh
+    if data:
+        _stats_index = TonnelStatsIndex(data)
+        _stats_next_refresh = time.monotonic() + TONNEL_STATS_REFRESH
+        logger.info(f"Tonnel filterStats snapshot refreshed: {len(_stats_index.gifts)} gifts")
+    else:
+        _stats_next_refresh = time.monotonic() + min(TONNEL_STATS_REFRESH, TONNEL_STATS_RETRY)
+    return _stats_index
+
+
+def _get_stats_index(authData: str) -> Optional[TonnelStatsIndex]:
+    """Снимок filterStatsPretty: не чаще одного запроса за TONNEL_STATS_REFRESH"""
+    if _stats_fresh():
+        return _stats_index
+    with _stats_lock:
+        if _stats_fresh() or (_stats_index is None and time.monotonic() < _stats_next_refresh):
+            return _stats_index
+        try:
+            data = _fetch_filter_stats(authData)
+        except Exception:
+            # Любая ошибка — тоже пауза TONNEL_STATS_RETRY, иначе каждый вызов снова идет в API
+            _apply_stats(None)
+            raise
+        return _apply_stats(data)
+
+
+async def _get_stats_index_async(authData: str) -> Optional[TonnelStatsIndex]:
+    """Корутинная версия _get_stats_index: параллельные вызовы ждут одно обновление"""
+    if _stats_fresh() or (_stats_index is None and time.monotonic() < _stats_next_refresh):
+        return _stats_index
+    try:
+        if coalesce is not None:
+            data = await coalesce('tonnel', 'filter_stats', None, None, lambda: _fetch_filter_stats_async(authData), ttl=0)
+        else:
+            data = await _fetch_filter_stats_async(authData)
+    except Exception:
+        _apply_stats(None)
+        raise
+    if _stats_fresh():
+        return _stats_index
+    return _apply_stats(data)
+
+
+async def refresh_tonnel_stats_async(authData: str) -> bool:
+    """Принудительно обновить снимок (для фоновой задачи)"""
+    if not filterStatsPretty:
+        return False
+    try:
+        data = await _fetch_filter_stats_async(authData)
+    except Exception:
+        _apply_stats(None)
+        raise
+    return _apply_stats(data) is not None and bool(data)
+
+
 def get_tonnel_model_floor_price(gift_name: str, model: str, authData: str) -> Optional[float]:
     """
     Получение флор-цены для конкретной модели подарка в Tonnel
     Использует filterStatsPretty() из tonnelmp согласно документации:
     https://github.com/bleach-hub/tonnelmp
+    Ответ берется из общего снимка, который обновляется раз в TONNEL_STATS_REFRESH
     
     Args:
         gift_name: Название подарка (не требует капитализации)
@@ -486,87 +697,22 @@ def get_tonnel_model_floor_price(gift_name: str, model: str, authData: str) -> O
         return None
     
     try:
-        logger.info(f"get_tonnel_model_floor_price called for {gift_name} / {model}")
-        
-        # Получаем статистику через filterStatsPretty с retry для 429 ошибок
-        import time
-        max_retries = 3
-        retry_delay = 2
-        stats = None
-        
-        for attempt in range(max_retries):
-            try:
-                stats = filterStatsPretty(authData)
-                break
-            except Exception as e:
-                error_msg = str(e)
-                if "429" in error_msg or "Too Many Requests" in error_msg or "CloudFlare" in error_msg:
-                    if attempt < max_retries - 1:
-                        wait_time = retry_delay * (2 ** attempt)
-                        logger.warning(f"Tonnel API rate limit (429) in filterStatsPretty, waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        logger.error(f"filterStatsPretty failed after {max_retries} retries due to rate limit")
-                        return None
-                else:
-                    raise  # Пробрасываем другие ошибки
-        
-        if not isinstance(stats, dict) or stats.get('status') != 'success':
-            logger.error(f"filterStatsPretty returned error: {stats}")
-            return None
-        
-        data = stats.get('data', {})
-        if not data:
-            logger.warning("filterStatsPretty returned empty data")
-            return None
+        index = _get_stats_index(authData)
+        return index.model_floor(gift_name, model) if index else None
+    except Exception as e:
+        logger.error(f"Error getting Tonnel model floor price: {e}", exc_info=True)
+        return None
 
-        gift_key = _normalize_tonnel_key(gift_name)
-        model_key_raw = _normalize_tonnel_key(model)
-        model_key_clean = _normalize_tonnel_key(_strip_tonnel_rarity(model))
 
-        logger.info(f"Looking for gift_key='{gift_key}', model_key='{model_key_raw}' in data")
-        logger.debug(f"Available gift keys: {list(data.keys())[:10]}")
-
-        gift_data = _find_tonnel_gift_data(data, gift_name)
-        if gift_data and isinstance(gift_data, dict):
-            logger.debug(f"Available model keys for {gift_key}: {list(gift_data.keys())[:10]}")
-
-            model_info = None
-            if model_key_raw in gift_data:
-                model_info = gift_data[model_key_raw]
-            elif model_key_clean in gift_data:
-                model_info = gift_data[model_key_clean]
-
-            if model_info is None:
-                for key in gift_data.keys():
-                    if not isinstance(key, str):
-                        continue
-                    key_norm = _normalize_tonnel_key(key)
-                    key_clean = _normalize_tonnel_key(_strip_tonnel_rarity(key))
-                    if key_norm == model_key_raw or key_clean == model_key_clean:
-                        model_info = gift_data[key]
-                        logger.info(f"Found model with key '{key}' matching '{model_key_raw}'")
-                        break
-                    if key_norm.startswith(model_key_clean) and model_key_clean:
-                        model_info = gift_data[key]
-                        logger.info(f"Found model with key '{key}' matching prefix '{model_key_clean}'")
-                        break
-
-            if model_info and isinstance(model_info, dict):
-                floor_price = model_info.get('floorPrice')
-                if floor_price is not None:
-                    result = float(floor_price)
-                    logger.info(f"get_tonnel_model_floor_price result: {result} TON")
-                    return result
-                else:
-                    logger.warning(f"Model info found but no floorPrice: {model_info}")
-            else:
-                logger.warning(f"Model '{model_key_raw}' not found in gift '{gift_key}'")
-        else:
-            logger.warning(f"Gift '{gift_key}' not found in filterStatsPretty data")
-        
+async def get_tonnel_model_floor_price_async(gift_name: str, model: str, authData: str) -> Optional[float]:
+    """Корутинная версия get_tonnel_model_floor_price"""
+    if not filterStatsPretty:
+        logger.error("filterStatsPretty not available from tonnelmp")
         return None
+    
+    try:
+        index = await _get_stats_index_async(authData)
+        return index.model_floor(gift_name, model) if index else None
     except Exception as e:
         logger.error(f"Error getting Tonnel model floor price: {e}", exc_info=True)
         return None
@@ -587,51 +733,95 @@ def get_tonnel_gift_floor_price(gift_name: str, authData: str) -> Optional[float
         return None
     
     try:
-        # Получаем статистику через filterStatsPretty с retry для 429 ошибок
-        import time
-        max_retries = 3
-        retry_delay = 2
-        stats = None
-        
-        for attempt in range(max_retries):
-            try:
-                stats = filterStatsPretty(authData)
-                break
-            except Exception as e:
-                error_msg = str(e)
-                if "429" in error_msg or "Too Many Requests" in error_msg or "CloudFlare" in error_msg:
-                    if attempt < max_retries - 1:
-                        wait_time = retry_delay * (2 ** attempt)
-                        logger.warning(f"Tonnel API rate limit (429) in filterStatsPretty, waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        logger.error(f"filterStatsPretty failed after {max_retries} retries due to rate limit")
-                        return None
-                else:
-                    raise  # Пробрасываем другие ошибки
-        
-        if not isinstance(stats, dict) or stats.get('status') != 'success':
-            return None
-        
-        data = stats.get('data', {})
-        if not data:
-            return None
+        index = _get_stats_index(authData)
+        return index.gift_floor(gift_name) if index else None
+    except Exception as e:
+        logger.error(f"Error getting Tonnel gift floor price: {e}")
+        return None
 
-        gift_data = _find_tonnel_gift_data(data, gift_name)
-        if gift_data and isinstance(gift_data, dict):
-            gift_info = gift_data.get('data')
-            if isinstance(gift_info, dict):
-                floor_price = gift_info.get('floorPrice')
-                if floor_price is not None:
-                    return float(floor_price)
-        
+
+async def get_tonnel_gift_floor_price_async(gift_name: str, authData: str) -> Optional[float]:
+    """Корутинная версия get_tonnel_gift_floor_price"""
+    if not filterStatsPretty:
         return None
+    
+    try:
+        index = await _get_stats_index_async(authData)
+        return index.gift_floor(gift_name) if index else None
     except Exception as e:
         logger.error(f"Error getting Tonnel gift floor price: {e}")
         return None
 
 
+def _sale_timestamp(sale: Dict[str, Any]) -> float:
+    sale_date = sale.get('date') or sale.get('sold_at') or sale.get('created_at') or sale.get('timestamp') or 0
+    if isinstance(sale_date, (int, float)):
+        return sale_date
+    elif isinstance(sale_date, str):
+        try:
+            from datetime import datetime
+            dt = datetime.fromisoformat(sale_date.replace('Z', '+00:00'))
+            return dt.timestamp()
+        except:
+            return 0
+    return 0
+
+
+def _filter_model_sales(sales: Any, gift_name: str, model: str, limit: int) -> List[Dict[str, Any]]:
+    """Продажи нужной модели, самые последние первыми"""
+    if not isinstance(sales, list):
+        return []
+    
+    # Очищаем названия для точного сравнения
+    gift_name_clean = re.sub(r'\s*\([^)]*\)', '', gift_name).strip().lower()
+    model_clean = re.sub(r'\s*\([^)]*\)', '', model).strip().lower()
+    
+    # Фильтруем по модели и подарку
+    filtered = []
+    for sale in sales:
+        if isinstance(sale, dict):
+            sale_gift_name = sale.get('gift_name') or sale.get('name') or ''
+            sale_model = sale.get('model') or sale.get('model_name') or ''
+            
+            # Очищаем от редкости в скобках для сравнения
+            sale_gift_name_clean = re.sub(r'\s*\([^)]*\)', '', sale_gift_name).strip().lower()
+            sale_model_clean = re.sub(r'\s*\([^)]*\)', '', sale_model).strip().lower()
+            
+            # Точное сравнение по названию подарка и модели
+            if sale_gift_name_clean == gift_name_clean and sale_model_clean == model_clean:
+                filtered.append(sale)
+                if len(filtered) >= limit:
+                    break
+    
+    filtered.sort(key=_sale_timestamp, reverse=True)
+    return filtered[:limit]
+
+
+def _filter_gift_sales(sales: Any, gift_name: str, limit: int) -> List[Dict[str, Any]]:
+    """Продажи подарка (все модели)"""
+    if not isinstance(sales, list):
+        return []
+    filtered = []
+    for sale in sales:
+        if isinstance(sale, dict):
+            sale_gift_name = (sale.get('gift_name') or sale.get('name') or '').lower()
+            if sale_gift_name == gift_name.lower():
+                filtered.append(sale)
+                if len(filtered) >= limit:
+                    break
+    return filtered[:limit]
+
+
+def _model_sales_params(gift_name: str, model: str, authData: str, limit: int) -> Dict[str, Any]:
+    # Берем больше продаж для фильтрации по модели
+    # Увеличиваем limit в 5 раз, чтобы точно найти нужное количество продаж модели
+    return dict(authData=authData, page=1, limit=limit * 5, type="SALE", gift_name=gift_name, model=model, sort="latest")
+
+
+def _gift_sales_params(gift_name: str, authData: str, limit: int) -> Dict[str, Any]:
+    return dict(authData=authData, page=1, limit=limit * 2, type="SALE", gift_name=gift_name, sort="latest")
+
+
 def get_tonnel_model_sales_history(gift_name: str, model: str, authData: str, limit: int = 3) -> List[Dict[str, Any]]:
     """
     Получение истории продаж для модели подарка в Tonnel
@@ -649,81 +839,32 @@ def get_tonnel_model_sales_history(gift_name: str, model: str, authData: str, li
         return []
     
     try:
-        # Берем больше продаж для фильтрации по модели
-        # Увеличиваем limit в 5 раз, чтобы точно найти нужное количество продаж модели
-        import time
-        max_retries = 3
-        retry_delay = 2
-        sales = None
-        
-        for attempt in range(max_retries):
-            try:
-                sales = saleHistory(
-                    authData=authData,
-                    page=1,
-                    limit=limit * 5,  # Берем больше для фильтрации
-                    type="SALE",
-                    gift_name=gift_name,
-                    model=model,
-                    sort="latest"
-                )
-                break
-            except Exception as e:
-                error_msg = str(e)
-                if "429" in error_msg or "Too Many Requests" in error_msg or "CloudFlare" in error_msg:
-                    if attempt < max_retries - 1:
-                        wait_time = retry_delay * (2 ** attempt)
-                        logger.warning(f"Tonnel API rate limit (429) in saleHistory, waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        logger.error(f"saleHistory failed after {max_retries} retries due to rate limit")
-                        return []
-                else:
-                    raise  # Пробрасываем другие ошибки
-        
-        if not isinstance(sales, list):
+        params = _model_sales_params(gift_name, model, authData, limit)
+        sales = retry_sync('tonnel:saleHistory', lambda: _limited('history', saleHistory, **params), retry_on={RATE_LIMIT})
+        return _filter_model_sales(sales, gift_name, model, limit)
+    except Exception as e:
+        if classify_error(e) == RATE_LIMIT:
+            logger.error("saleHistory failed: rate limit")
             return []
-        
-        # Очищаем названия для точного сравнения
-        gift_name_clean = re.sub(r'\s*\([^)]*\)', '', gift_name).strip().lower()
-        model_clean = re.sub(r'\s*\([^)]*\)', '', model).strip().lower()
-        
-        # Фильтруем по модели и подарку, сортируем по дате (самые последние первыми)
-        filtered = []
-        for sale in sales:
-            if isinstance(sale, dict):
-                sale_gift_name = sale.get('gift_name') or sale.get('name') or ''
-                sale_model = sale.get('model') or sale.get('model_name') or ''
-                
-                # Очищаем от редкости в скобках для сравнения
-                sale_gift_name_clean = re.sub(r'\s*\([^)]*\)', '', sale_gift_name).strip().lower()
-                sale_model_clean = re.sub(r'\s*\([^)]*\)', '', sale_model).strip().lower()
-                
-                # Точное сравнение по названию подарка и модели
-                if sale_gift_name_clean == gift_name_clean and sale_model_clean == model_clean:
-                    filtered.append(sale)
-                    if len(filtered) >= limit:
-                        break
-        
-        # Сортируем по дате (самые последние первыми)
-        def get_sale_timestamp(sale):
-            sale_date = sale.get('date') or sale.get('sold_at') or sale.get('created_at') or sale.get('timestamp') or 0
-            if isinstance(sale_date, (int, float)):
-                return sale_date
-            elif isinstance(sale_date, str):
-                try:
-                    from datetime import datetime
-                    dt = datetime.fromisoformat(sale_date.replace('Z', '+00:00'))
-                    return dt.timestamp()
-                except:
-                    return 0
-            return 0
-        
-        filtered.sort(key=get_sale_timestamp, reverse=True)
-        
-        return filtered[:limit]
+        logger.error(f"Error getting Tonnel model sales history: {e}", exc_info=True)
+        return []
+
+
+async def get_tonnel_model_sales_history_async(gift_name: str, model: str, authData: str, limit: int = 3) -> List[Dict[str, Any]]:
+    """Корутинная версия get_tonnel_model_sales_history"""
+    if not saleHistory:
+        return []
+    
+    try:
+        params = _model_sales_params(gift_name, model, authData, limit)
+        sales = await retry_async(
+            'tonnel:saleHistory', lambda: _limited_async('history', saleHistory, **params), retry_on={RATE_LIMIT}
+        )
+        return _filter_model_sales(sales, gift_name, model, limit)
     except Exception as e:
+        if classify_error(e) == RATE_LIMIT:
+            logger.error("saleHistory failed: rate limit")
+            return []
         logger.error(f"Error getting Tonnel model sales history: {e}", exc_info=True)
         return []
 
@@ -744,53 +885,13 @@ def get_tonnel_gift_sales_history(gift_name: str, authData: str, limit: int = 5)
         return []
     
     try:
-        # Получаем историю продаж с retry для 429 ошибок
-        import time
-        max_retries = 3
-        retry_delay = 2
-        sales = None
-        
-        for attempt in range(max_retries):
-            try:
-                sales = saleHistory(
-                    authData=authData,
-                    page=1,
-                    limit=limit * 2,  # Берем больше для фильтрации
-                    type="SALE",
-                    gift_name=gift_name,
-                    sort="latest"
-                )
-                break
-            except Exception as e:
-                error_msg = str(e)
-                if "429" in error_msg or "Too Many Requests" in error_msg or "CloudFlare" in error_msg:
-                    if attempt < max_retries - 1:
-                        wait_time = retry_delay * (2 ** attempt)
-                        logger.warning(f"Tonnel API rate limit (429) in saleHistory, waiting {wait_time}s before retry {attempt + 1}/{max_retries}")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        logger.error(f"saleHistory failed after {max_retries} retries due to rate limit")
-                        return []
-                else:
-                    raise  # Пробрасываем другие ошибки
-        
-        if not isinstance(sales, list):
-            return []
-        
-        # Фильтруем по подарку и берем последние limit
-        filtered = []
-        for sale in sales:
-            if isinstance(sale, dict):
-                sale_gift_name = (sale.get('gift_name') or sale.get('name') or '').lower()
-                
-                if sale_gift_name == gift_name.lower():
-                    filtered.append(sale)
-                    if len(filtered) >= limit:
-                        break
-        
-        return filtered[:limit]
+        params = _gift_sales_params(gift_name, authData, limit)
+        sales = retry_sync('tonnel:saleHistory', lambda: _limited('history', saleHistory, **params), retry_on={RATE_LIMIT})
+        return _filter_gift_sales(sales, gift_name, limit)
     except Exception as e:
+        if classify_error(e) == RATE_LIMIT:
+            logger.error("saleHistory failed: rate limit")
+            return []
         logger.error(f"Error getting Tonnel gift sales history: {e}")
         return []
 
@@ -810,7 +911,7 @@ def get_tonnel_gift_by_id(gift_id: str, authData: str) -> Optional[Dict[str, Any
         return None
     
     try:
-        data = giftData(gift_id=int(gift_id) if gift_id.isdigit() else gift_id, authData=authData)
+        data = _limited('search', giftData, gift_id=int(gift_id) if gift_id.isdigit() else gift_id, authData=authData)
         if isinstance(data, dict):
             # Нормализуем формат как в search_tonnel
             normalized = {
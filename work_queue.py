@@ -0,0 +1,183 @@
+"""
+Ограниченная очередь задач с фиксированным пулом воркеров.
+
+Заменяет asyncio.create_task на каждый новый листинг: при всплеске
+очередь не растет бесконечно, а параллелизм ограничен числом воркеров.
+Задачи с одинаковым ключом склеиваются (merge), при переполнении
+выкидывается самая старая или новая задача (политика drop_oldest / drop_newest).
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+Args = Tuple[Any, ...]
+
+
+class _Job:
+    __slots__ = ('key', 'args', 'enqueued_at', 'cancelled')
+
+    def __init__(self, key: Optional[Hashable], args: Args):
+        self.key = key
+        self.args = args
+        self.enqueued_at = time.monotonic()
+        self.cancelled = False
+
+
+class BoundedWorkQueue:
+    """
+    Очередь на asyncio.Queue(maxsize) + N воркеров.
+    merge(old_args, new_args) -> args склеивает задачу с уже ждущей по тому же ключу.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[..., Awaitable[Any]],
+        workers: int = 10,
+        maxsize: int = 500,
+        policy: str = DROP_OLDEST,
+        merge: Optional[Callable[[Args, Args], Args]] = None,
+    ):
+        if policy not in POLICIES:
+            logger.warning(f"[queue] {name}: unknown policy {policy!r}, using {DROP_OLDEST}")
+            policy = DROP_OLDEST
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.merge = merge
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Dict[Hashable, _Job] = {}
+        self._tasks = []
+        # Метрики
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.merged = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._last_log = time.monotonic()
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._worker(i)) for i in range(self.workers)]
+            logger.info(f"[queue] {self.name}: started {self.workers} workers (maxsize={self.maxsize}, policy={self.policy})")
+
+    def _drop(self, job: _Job, reason: str):
+        job.cancelled = True
+        if job.key is not None and self._pending.get(job.key) is job:
+            del self._pending[job.key]
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            logger.warning(f"[queue] {self.name}: queue full, dropped {self.dropped} jobs so far ({reason})")
+
+    def submit(self, *args, key: Optional[Hashable] = None) -> bool:
+        """
+        Поставить задачу в очередь (без ожидания). False — задача отброшена.
+        Вызывать из event loop.
+        """
+        self._ensure_started()
+
+        if key is not None and self.merge is not None:
+            pending = self._pending.get(key)
+            if pending is not None and not pending.cancelled:
+                pending.args = self.merge(pending.args, args)
+                self.merged += 1
+                return True
+
+        job = _Job(key, args)
+        if self._queue.full():
+            if self.policy == DROP_NEWEST:
+                self._drop(job, DROP_NEWEST)
+                return False
+            # drop_oldest: освобождаем место, выкидывая самую старую задачу
+            while self._queue.full():
+                self._drop(self._queue.get_nowait(), DROP_OLDEST)
+                self._queue.task_done()
+
+        self._queue.put_nowait(job)
+        if key is not None:
+            self._pending[key] = job
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.cancelled:
+                    continue
+                if job.key is not None and self._pending.get(job.key) is job:
+                    del self._pending[job.key]
+                wait = time.monotonic() - job.enqueued_at
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                await self.handler(*job.args)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"[queue] {self.name}: job failed: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def join(self):
+        """Дождаться обработки всего, что уже в очереди"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self):
+        """Остановить воркеров (необработанные задачи теряются)"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._queue = None
+        self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        started = self.processed + self.failed
+        return {
+            'depth': self._queue.qsize() if self._queue is not None else 0,
+            'max_depth': self.max_depth,
+            'maxsize': self.maxsize,
+            'workers': self.workers,
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'merged': self.merged,
+            'avg_wait': round(self.total_wait / started, 3) if started else 0.0,
+            'max_wait': round(self.max_wait, 3),
+        }
+
+    def log_stats(self, interval: float = 60.0):
+        """Залогировать метрики не чаще раза в interval секунд"""
+        now = time.monotonic()
+        if now - self._last_log < interval:
+            return
+        self._last_log = now
+        logger.info(f"[queue] {self.name}: {self.stats()}")
+
+
+def merge_users(old_args: Args, new_args: Args) -> Args:
+    """merge для (item, marketplace, users): свежий листинг, объединенный список пользователей"""
+    item, marketplace, users = new_args
+    merged = list(dict.fromkeys(list(old_args[2]) + list(users)))
+    return item, marketplace, merged